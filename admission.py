@@ -0,0 +1,216 @@
+"""Admission control for Mooltiroute client connections."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from config import AdmissionConfig
+
+logger = logging.getLogger("mooltiroute.admission")
+
+
+class AdmissionError(Exception):
+    """A connection or upstream connect refused for lack of capacity."""
+
+    def __init__(self, message: str):
+        self.message = message
+        self.status_code = 503
+        super().__init__(message)
+
+
+class _Limiter:
+    """
+    Counting semaphore with a bounded FIFO wait queue.
+
+    A released slot is handed over to the oldest waiter, so waiters
+    cannot be overtaken by newcomers.
+    """
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float):
+        self.limit = limit  # 0: unlimited
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def resize(self, limit: int, queue_size: int, queue_timeout: float) -> None:
+        """
+        Apply new limits; slots taken stay taken.
+
+        Waiters get the slots a higher limit frees. A lower limit takes
+        effect as slots are released; waiters already queued keep waiting.
+        """
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        while self._waiters and (not limit or self.active < limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    async def acquire(self) -> None:
+        """
+        Take a slot, waiting in the queue if none is free.
+
+        Raises:
+            AdmissionError: If the queue is full or the wait times out
+        """
+        if not self.limit or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise AdmissionError("Server busy")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return  # the slot was handed over as the wait timed out
+            raise AdmissionError("Server busy (queue timeout)")
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # the slot was handed over as we were cancelled
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        """Give the slot back, to the oldest waiter if any."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # the slot changes hands, active unchanged
+                return
+        self.active -= 1
+
+
+class Admission:
+    """
+    Limits on client connections and upstream connects.
+
+    admit() is called once per client connection, as soon as it is
+    accepted; a client over admission.max_per_client is refused at once,
+    other clients queue for one of admission.max_connections slots (at
+    most admission.queue_size waiting, each for queue_timeout).
+    connecting() bounds the upstream connects in progress the same way.
+    Refusals raise AdmissionError, answered with a 503.
+    """
+
+    def __init__(self, config: AdmissionConfig):
+        self.config = config
+        self._connections = _Limiter(
+            config.max_connections,
+            config.queue_size,
+            config.queue_timeout,
+        )
+        self._connects = _Limiter(
+            config.max_pending_connects,
+            config.queue_size,
+            config.queue_timeout,
+        )
+        self._per_client: dict[str, int] = {}
+
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected_per_client = 0
+        self.rejected_busy = 0
+        self.connects_rejected = 0
+
+    def reconfigure(self, config: AdmissionConfig) -> None:
+        """Apply new limits to current and future connections."""
+        self.config = config
+        self._connections.resize(
+            config.max_connections,
+            config.queue_size,
+            config.queue_timeout,
+        )
+        self._connects.resize(
+            config.max_pending_connects,
+            config.queue_size,
+            config.queue_timeout,
+        )
+
+    async def admit(self, client: str) -> None:
+        """
+        Admit a connection from client (an IP address).
+
+        Raises:
+            AdmissionError: If the client or the server is over capacity
+        """
+        count = self._per_client.get(client, 0)
+        if self.config.max_per_client and count >= self.config.max_per_client:
+            self.rejected_per_client += 1
+            logger.debug(f"Client {client} over {self.config.max_per_client} connections, refused")
+            raise AdmissionError("Too many connections from this client")
+        # Queued connections count for their client too
+        self._per_client[client] = count + 1
+
+        if self._connections.limit and (
+            self._connections.active >= self._connections.limit or self._connections.queued
+        ):
+            self.queued_total += 1
+        try:
+            await self._connections.acquire()
+        except BaseException as e:
+            self._forget(client)
+            if isinstance(e, AdmissionError):
+                self.rejected_busy += 1
+            raise
+        self.admitted += 1
+
+    def leave(self, client: str) -> None:
+        """An admitted connection from client is closed."""
+        self._connections.release()
+        self._forget(client)
+
+    def _forget(self, client: str) -> None:
+        count = self._per_client[client] - 1
+        if count:
+            self._per_client[client] = count
+        else:
+            del self._per_client[client]
+
+    @asynccontextmanager
+    async def connecting(self) -> AsyncIterator[None]:
+        """
+        Hold a pending-connect slot while connecting upstream.
+
+        Raises:
+            AdmissionError: If too many connects are pending
+        """
+        try:
+            await self._connects.acquire()
+        except AdmissionError:
+            self.connects_rejected += 1
+            raise
+        try:
+            yield
+        finally:
+            self._connects.release()
+
+    def stats(self) -> dict:
+        """Return admission counters."""
+        return {
+            "active": self._connections.active,
+            "queued": self._connections.queued,
+            "clients": len(self._per_client),
+            "connecting": self._connects.active,
+            "connects_queued": self._connects.queued,
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected_busy": self.rejected_busy,
+            "rejected_per_client": self.rejected_per_client,
+            "connects_rejected": self.connects_rejected,
+        }
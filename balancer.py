@@ -0,0 +1,158 @@
+"""Webshare upstream selection for Mooltiroute."""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import random
+
+from config import BalancerConfig, HealthConfig, ProxyConfig
+from health import CircuitBreaker
+
+logger = logging.getLogger("mooltiroute.balancer")
+
+LATENCY_ALPHA = 0.3  # weight of the latest sample in the latency average
+FAILURE_LATENCY = 5.0  # seconds, latency sample recorded for a failed attempt
+
+
+class Upstream:
+    """A webshare proxy and its live measurements."""
+
+    __slots__ = ("proxy", "breaker", "outstanding", "latency", "selected", "failures")
+
+    def __init__(self, proxy: ProxyConfig, health: HealthConfig):
+        self.proxy = proxy
+        self.breaker = CircuitBreaker(f"{proxy.host}:{proxy.port}", health)
+        self.outstanding = 0  # connections being opened or in use
+        self.latency: float | None = None  # moving average, seconds
+        self.selected = 0
+        self.failures = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.proxy.host}:{self.proxy.port}"
+
+    def record_latency(self, latency: float) -> None:
+        """Feed the time taken to establish a tunnel through this upstream."""
+        self.breaker.record_success()
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_ALPHA * (latency - self.latency)
+
+    def record_failure(self) -> None:
+        """Account for an upstream that could not be reached or did not answer."""
+        self.failures += 1
+        self.breaker.record_failure()
+        if self.latency is None:
+            self.latency = FAILURE_LATENCY
+        else:
+            self.latency += LATENCY_ALPHA * (FAILURE_LATENCY - self.latency)
+
+    def score(self) -> float:
+        """Expected cost of one more connection (lower is better)."""
+        # Unmeasured upstreams score 0 so that they get measured first
+        return (self.latency or 0.0) * (self.outstanding + 1)
+
+
+class Balancer:
+    """
+    Pick the webshare upstream for each new tunnel or HTTP request.
+
+    Strategies:
+        round_robin: each upstream in turn
+        least_outstanding: fewest connections being opened or in use
+        ewma: lowest latency average weighted by outstanding connections
+        p2c: the better (ewma score) of two upstreams picked at random
+
+    Upstreams whose circuit breaker is open are skipped. select() counts
+    the connection as outstanding on the returned upstream; the caller
+    reports the establishment latency or failure on the upstream and
+    calls release() when the connection ends.
+    """
+
+    def __init__(
+        self,
+        proxies: list[ProxyConfig],
+        config: BalancerConfig,
+        health: HealthConfig,
+        previous: Balancer | None = None,
+    ):
+        self.config = config
+        # On a reload, unchanged upstreams keep their measurements
+        kept = {u.proxy: u for u in previous.upstreams} if previous else {}
+        self.upstreams = []
+        for proxy in proxies:
+            upstream = kept.pop(proxy, None)
+            if upstream is None:
+                upstream = Upstream(proxy, health)
+            else:
+                upstream.breaker.config = health
+            self.upstreams.append(upstream)
+        self._round_robin = itertools.cycle(self.upstreams)
+        self._round_robin_offsets = itertools.count()
+        self._pick = {
+            "round_robin": self._pick_round_robin,
+            "least_outstanding": self._pick_least_outstanding,
+            "ewma": self._pick_ewma,
+            "p2c": self._pick_p2c,
+        }[config.strategy]
+
+    def select(self, prefer: tuple[str, int] | None = None) -> Upstream | None:
+        """
+        Choose an upstream and count a new outstanding connection on it.
+
+        The upstream at address prefer (a sticky session's) is chosen
+        whenever its circuit allows. Returns None when every upstream's
+        circuit is open.
+        """
+        candidates = [u for u in self.upstreams if u.breaker.available()]
+        if not candidates:
+            return None
+        upstream = None
+        if prefer is not None:
+            upstream = next((u for u in candidates if u.proxy.address == prefer), None)
+        if upstream is None:
+            upstream = self._pick(candidates) if len(candidates) > 1 else candidates[0]
+        upstream.breaker.begin()
+        upstream.outstanding += 1
+        upstream.selected += 1
+        return upstream
+
+    def release(self, upstream: Upstream) -> None:
+        """The connection obtained from select() is finished."""
+        upstream.outstanding -= 1
+
+    def _pick_round_robin(self, candidates: list[Upstream]) -> Upstream:
+        for _ in range(len(self.upstreams)):
+            upstream = next(self._round_robin)
+            if upstream in candidates:
+                return upstream
+        return candidates[0]
+
+    def _pick_least_outstanding(self, candidates: list[Upstream]) -> Upstream:
+        # Ties go round-robin rather than always to the first upstream
+        offset = next(self._round_robin_offsets) % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        return min(rotated, key=lambda u: u.outstanding)
+
+    def _pick_ewma(self, candidates: list[Upstream]) -> Upstream:
+        return min(candidates, key=Upstream.score)
+
+    def _pick_p2c(self, candidates: list[Upstream]) -> Upstream:
+        first, second = random.sample(candidates, 2)
+        return first if first.score() <= second.score() else second
+
+    def stats(self) -> dict:
+        """Per-upstream counters."""
+        return {
+            upstream.name: {
+                "outstanding": upstream.outstanding,
+                "selected": upstream.selected,
+                "failures": upstream.failures,
+                "circuit": upstream.breaker.state,
+                "circuit_opens": upstream.breaker.opens,
+                "latency_ms": round(upstream.latency * 1000, 1) if upstream.latency is not None else None,
+            }
+            for upstream in self.upstreams
+        }
@@ -0,0 +1,9 @@
+"""
+Mooltiroute benchmark suite.
+
+Runs ProxyServer against local stand-ins for the corporate proxy, the
+webshare proxy and an origin server, and measures CONNECT setup
+latency, plain HTTP requests/s and bulk relay throughput:
+
+    python -m benchmarks --concurrency 50 --json results.json
+"""
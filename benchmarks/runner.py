@@ -0,0 +1,378 @@
+"""Benchmark scenarios driving ProxyServer through the local stand-ins."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import socket
+import sys
+import time
+from asyncio import StreamReader, StreamWriter
+
+from benchmarks.standins import OriginServer, ProxyStandIn
+from config import (
+    IO_MODES,
+    RELAY_ENGINES,
+    Config,
+    HedgeConfig,
+    PoolConfig,
+    ProxyConfig,
+    RelayConfig,
+    ServerConfig,
+    TunnelConfig,
+)
+from main import install_event_loop
+from proxy_server import ProxyServer
+
+logger = logging.getLogger("mooltiroute.benchmarks")
+
+SCENARIOS = ("connect", "http", "bulk")
+CORPORATE_CREDENTIALS = ("corp", "corp-secret")
+WEBSHARE_CREDENTIALS = ("bench", "bench-secret")
+
+
+def percentile(samples: list[float], p: float) -> float | None:
+    """Nearest-rank percentile of samples (None when empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _latency_summary(samples: list[float]) -> dict:
+    def ms(value: float | None) -> float | None:
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "p50_ms": ms(percentile(samples, 50)),
+        "p90_ms": ms(percentile(samples, 90)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(max(samples) if samples else None),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _read_response(reader: StreamReader) -> tuple[int, int]:
+    """Read one Content-Length framed response; returns (status, body size)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    remaining = length
+    while remaining:
+        data = await reader.read(min(remaining, 1 << 20))
+        if not data:
+            raise asyncio.IncompleteReadError(b"", remaining)
+        remaining -= len(data)
+    return status, length
+
+
+async def _open_tunnel(port: int, target: str) -> tuple[StreamReader, StreamWriter, int]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    return reader, writer, int(head.split(b" ", 2)[1])
+
+
+class Bench:
+    """ProxyServer plus stand-ins, set up from the command line options."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.origin = OriginServer()
+        self.webshare = ProxyStandIn(
+            ":".join(WEBSHARE_CREDENTIALS),
+            latency=args.latency,
+            failure_rate=args.failure_rate,
+            slow_rate=args.slow_rate,
+            slow_latency=args.slow_latency,
+        )
+        self.corporate = ProxyStandIn(
+            ":".join(CORPORATE_CREDENTIALS),
+            latency=args.corporate_latency,
+        )
+        self.server: ProxyServer | None = None
+        self.port = 0
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self.origin.start()
+        await self.webshare.start()
+        if not self.args.direct:
+            await self.corporate.start()
+
+        self.port = _free_port()
+        corporate = None
+        if not self.args.direct:
+            corporate = ProxyConfig("127.0.0.1", self.corporate.port, *CORPORATE_CREDENTIALS)
+        webshare = ProxyConfig("127.0.0.1", self.webshare.port, *WEBSHARE_CREDENTIALS)
+        config = Config(
+            server=ServerConfig(port=self.port, io_mode=self.args.io_mode),
+            webshare=webshare,
+            corporate_proxy=corporate,
+            webshares=[webshare],
+            pool=PoolConfig(enabled=self.args.pool),
+            relay=RelayConfig(engine=self.args.relay_engine),
+            hedge=HedgeConfig(enabled=self.args.hedge),
+            tunnel=TunnelConfig(pipeline=self.args.pipeline, optimistic=self.args.optimistic),
+        )
+        self.server = ProxyServer(config, use_corporate=not self.args.direct)
+        self._task = asyncio.create_task(self.server.start())
+
+        # Wait for the listener
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+            else:
+                writer.close()
+                break
+
+    async def stop(self) -> None:
+        if self.server:
+            await self.server.stop()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for standin in (self.corporate, self.webshare, self.origin):
+            await standin.stop()
+
+    @property
+    def origin_target(self) -> str:
+        return f"127.0.0.1:{self.origin.port}"
+
+    async def _run_workers(self, total: int, one) -> tuple[list[float], int, float]:
+        """
+        Run one() total times from args.concurrency workers.
+
+        Returns (latency samples, failures, elapsed seconds).
+        """
+        samples: list[float] = []
+        failures = 0
+        remaining = total
+
+        async def worker() -> None:
+            nonlocal remaining, failures
+            state: dict = {}
+            try:
+                while remaining > 0:
+                    remaining -= 1
+                    started = time.perf_counter()
+                    try:
+                        ok = await one(state)
+                    except (asyncio.IncompleteReadError, OSError, ValueError):
+                        ok = False
+                        state.clear()
+                    if ok:
+                        samples.append(time.perf_counter() - started)
+                    else:
+                        failures += 1
+            finally:
+                if "writer" in state:
+                    state["writer"].close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return samples, failures, time.perf_counter() - started
+
+    async def connect_scenario(self) -> dict:
+        """CONNECT setup latency: time until the client receives the 200."""
+        setup: list[float] = []
+
+        async def one(state: dict) -> bool:
+            started = time.perf_counter()
+            reader, writer, status = await _open_tunnel(self.port, self.origin_target)
+            try:
+                if status != 200:
+                    return False
+                setup.append(time.perf_counter() - started)
+                writer.write(b"GET / HTTP/1.1\r\nHost: origin\r\nConnection: close\r\n\r\n")
+                status, _ = await _read_response(reader)
+                return status == 200
+            finally:
+                writer.close()
+
+        samples, failures, elapsed = await self._run_workers(self.args.connects, one)
+        return {
+            "tunnels": len(samples),
+            "failures": failures,
+            "tunnels_per_s": round(len(samples) / elapsed, 1),
+            "setup": _latency_summary(setup),
+            "round_trip": _latency_summary(samples),
+        }
+
+    async def http_scenario(self) -> dict:
+        """Plain HTTP requests/s over keep-alive client connections."""
+        request = (
+            f"GET http://{self.origin_target}/ HTTP/1.1\r\n"
+            f"Host: {self.origin_target}\r\n\r\n"
+        ).encode()
+
+        async def one(state: dict) -> bool:
+            if "writer" not in state:
+                state["reader"], state["writer"] = await asyncio.open_connection(
+                    "127.0.0.1",
+                    self.port,
+                )
+            state["writer"].write(request)
+            status, _ = await _read_response(state["reader"])
+            if status != 200:
+                # Error responses close the client connection
+                state.pop("writer").close()
+                state.clear()
+                return False
+            return True
+
+        samples, failures, elapsed = await self._run_workers(self.args.requests, one)
+        return {
+            "requests": len(samples),
+            "failures": failures,
+            "requests_per_s": round(len(samples) / elapsed, 1),
+            "latency": _latency_summary(samples),
+        }
+
+    async def bulk_scenario(self) -> dict:
+        """Download throughput through CONNECT tunnels."""
+        size = self.args.bulk_mb * 1024 * 1024
+
+        async def download() -> int:
+            reader, writer, status = await _open_tunnel(self.port, self.origin_target)
+            try:
+                if status != 200:
+                    return 0
+                writer.write(f"GET /bytes/{size} HTTP/1.1\r\nHost: origin\r\n\r\n".encode())
+                _, length = await _read_response(reader)
+                return length
+            finally:
+                writer.close()
+
+        started = time.perf_counter()
+        sizes = await asyncio.gather(
+            *(download() for _ in range(self.args.bulk_streams)),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - started
+        received = sum(s for s in sizes if isinstance(s, int))
+        return {
+            "streams": self.args.bulk_streams,
+            "bytes": received,
+            "failures": sum(1 for s in sizes if not isinstance(s, int) or s != size),
+            "mb_per_s": round(received / 1024 / 1024 / elapsed, 1),
+        }
+
+
+async def run(args: argparse.Namespace, event_loop: str) -> dict:
+    bench = Bench(args)
+    await bench.start()
+    results: dict = {
+        "settings": {
+            "mode": "direct" if args.direct else "corporate",
+            "io_mode": args.io_mode,
+            "relay_engine": bench.server.relay_engine,
+            "pool": args.pool,
+            "pipeline": args.pipeline,
+            "optimistic": args.optimistic,
+            "event_loop": event_loop,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "corporate_latency": args.corporate_latency,
+            "failure_rate": args.failure_rate,
+            "slow_rate": args.slow_rate,
+            "hedge": args.hedge,
+            "python": platform.python_version(),
+        },
+    }
+    try:
+        for name in args.scenarios:
+            logger.info(f"Running {name} scenario")
+            results[name] = await getattr(bench, f"{name}_scenario")()
+        results["server"] = bench.server.stats()
+    finally:
+        await bench.stop()
+    return results
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark Mooltiroute against local stand-in proxies",
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients (default: 20)")
+    parser.add_argument("--connects", type=int, default=500, help="Tunnels opened by the connect scenario")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests sent by the http scenario")
+    parser.add_argument("--bulk-mb", type=int, default=200, help="MiB downloaded per bulk stream")
+    parser.add_argument("--bulk-streams", type=int, default=1, help="Concurrent bulk downloads")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added by the webshare stand-in")
+    parser.add_argument("--corporate-latency", type=float, default=0.0, help="Seconds added by the corporate stand-in")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of webshare requests answered 502")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of webshare requests answered late")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="Seconds added to late webshare answers")
+    parser.add_argument("--hedge", action="store_true", help="Hedge slow tunnel establishments")
+    parser.add_argument("--direct", action="store_true", help="No corporate proxy in the chain")
+    parser.add_argument("--pool", action="store_true", help="Enable the corporate -> webshare pool")
+    parser.add_argument("--pipeline", action="store_true", help="Pipeline the chain's two CONNECTs")
+    parser.add_argument("--optimistic", action="store_true", help="Answer the client 200 before the tunnel is up")
+    parser.add_argument("--io-mode", choices=IO_MODES, default="streams")
+    parser.add_argument("--relay-engine", choices=RELAY_ENGINES, default="stream")
+    parser.add_argument("--event-loop", choices=("asyncio", "uvloop", "auto"), default="asyncio")
+    parser.add_argument("--json", metavar="PATH", help="Write results as JSON to PATH ('-' for stdout)")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    return parser.parse_args(argv)
+
+
+def print_summary(results: dict) -> None:
+    settings = results["settings"]
+    print(", ".join(f"{key}={value}" for key, value in settings.items()))
+    if "connect" in results:
+        r = results["connect"]
+        print(
+            f"connect: {r['tunnels_per_s']} tunnels/s, setup p50 {r['setup']['p50_ms']}ms "
+            f"p99 {r['setup']['p99_ms']}ms, {r['failures']} failures"
+        )
+    if "http" in results:
+        r = results["http"]
+        print(
+            f"http:    {r['requests_per_s']} requests/s, p50 {r['latency']['p50_ms']}ms "
+            f"p99 {r['latency']['p99_ms']}ms, {r['failures']} failures"
+        )
+    if "bulk" in results:
+        r = results["bulk"]
+        print(f"bulk:    {r['mb_per_s']} MiB/s over {r['streams']} stream(s), {r['failures']} failures")
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)-5s [%(name)s] %(message)s",
+    )
+    event_loop = install_event_loop(args.event_loop)
+    results = asyncio.run(run(args, event_loop))
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    return 0
@@ -0,0 +1,245 @@
+"""Local stand-ins for the corporate proxy, webshare and an origin server."""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import base64
+import logging
+import random
+from asyncio import StreamReader, StreamWriter
+from urllib.parse import urlparse
+
+from http_parser import (
+    HttpParseError,
+    error_response,
+    parse_connect_target,
+    read_request_head,
+    read_response_head,
+)
+
+logger = logging.getLogger("mooltiroute.benchmarks.standins")
+
+BUFFER_SIZE = 65536
+_PAYLOAD = b"x" * BUFFER_SIZE
+
+
+class _StandIn(abc.ABC):
+    """A local server on an ephemeral port."""
+
+    def __init__(self):
+        self._server: asyncio.Server | None = None
+        self.port = 0
+        self.connections = 0
+        self._writers: set[StreamWriter] = set()
+
+    async def start(self) -> int:
+        """Listen on 127.0.0.1 and return the port."""
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            await self.handle(reader, writer)
+        except (asyncio.IncompleteReadError, HttpParseError, OSError, asyncio.CancelledError):
+            # Cancelled when the benchmark shuts down with connections open
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @abc.abstractmethod
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Serve one accepted connection."""
+
+
+class OriginServer(_StandIn):
+    """
+    Keep-alive HTTP origin.
+
+    GET /bytes/<n> answers n bytes; any other request a short body.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        while True:
+            try:
+                head = await read_request_head(reader)
+            except asyncio.IncompleteReadError:
+                return
+            self.requests += 1
+            length = int(head.get("content-length", "0"))
+            if length:
+                await reader.readexactly(length)
+
+            if head.target.startswith("/bytes/"):
+                size = int(head.target[len("/bytes/"):])
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % size)
+                while size > 0:
+                    writer.write(_PAYLOAD[:size])
+                    size -= BUFFER_SIZE
+                    await writer.drain()
+            else:
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+
+            if head.get("connection", "").lower() == "close":
+                return
+
+
+class ProxyStandIn(_StandIn):
+    """
+    Forward proxy answering CONNECT and absolute-URI HTTP requests.
+
+    latency (seconds) is added before answering each request and
+    failure_rate is the probability of answering 502 instead. A
+    slow_rate fraction of the requests waits slow_latency seconds more,
+    like the slowest exits of a rotating pool. When
+    credentials ("user:pass") are given, requests without the matching
+    Proxy-Authorization header get a 407.
+    """
+
+    def __init__(
+        self,
+        credentials: str | None = None,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 0.0,
+    ):
+        super().__init__()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._auth = None
+        if credentials:
+            self._auth = "Basic " + base64.b64encode(credentials.encode()).decode()
+        self.connects = 0
+        self.requests = 0
+        self.injected_failures = 0
+
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        # Upstream connection reused across keep-alive HTTP requests
+        upstream: tuple[StreamReader, StreamWriter] | None = None
+        upstream_address = None
+        try:
+            while True:
+                try:
+                    head = await read_request_head(reader)
+                except asyncio.IncompleteReadError:
+                    return
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self.slow_rate and random.random() < self.slow_rate:
+                    await asyncio.sleep(self.slow_latency)
+
+                # Several Proxy-Authorization headers reach a chained proxy
+                if self._auth and self._auth not in head.get_all("proxy-authorization"):
+                    writer.write(error_response(407, "Proxy Authentication Required"))
+                    await writer.drain()
+                    continue
+                if random.random() < self.failure_rate:
+                    self.injected_failures += 1
+                    writer.write(error_response(502, "Bad Gateway"))
+                    await writer.drain()
+                    return
+
+                if head.method == "CONNECT":
+                    self.connects += 1
+                    await self._tunnel(head.target, reader, writer)
+                    return
+
+                self.requests += 1
+                url = urlparse(head.target)
+                address = (url.hostname, url.port or 80)
+                if upstream is None or address != upstream_address:
+                    if upstream:
+                        upstream[1].close()
+                    upstream = await asyncio.open_connection(*address)
+                    upstream_address = address
+                await self._forward(head, url, reader, writer, *upstream)
+        finally:
+            if upstream:
+                upstream[1].close()
+
+    async def _tunnel(self, target: str, reader: StreamReader, writer: StreamWriter) -> None:
+        address = parse_connect_target(target)
+        try:
+            remote_reader, remote_writer = await asyncio.open_connection(*address)
+        except (TypeError, OSError):
+            writer.write(error_response(502, "Bad Gateway"))
+            await writer.drain()
+            return
+        writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        await writer.drain()
+        try:
+            await asyncio.gather(_pipe(reader, remote_writer), _pipe(remote_reader, writer))
+        finally:
+            remote_writer.close()
+
+    async def _forward(
+        self,
+        head,
+        url,
+        reader: StreamReader,
+        writer: StreamWriter,
+        upstream_reader: StreamReader,
+        upstream_writer: StreamWriter,
+    ) -> None:
+        path = url.path or "/"
+        if url.query:
+            path += f"?{url.query}"
+        lines = [f"{head.method} {path} HTTP/1.1"]
+        lines.extend(
+            f"{name}: {value}" for name, value in head.headers
+            if not name.startswith("proxy-")
+        )
+        lines.extend(["", ""])
+        upstream_writer.write("\r\n".join(lines).encode())
+        length = int(head.get("content-length", "0"))
+        if length:
+            upstream_writer.write(await reader.readexactly(length))
+        await upstream_writer.drain()
+
+        response = await read_response_head(upstream_reader)
+        writer.write(response.raw)
+        remaining = int(response.get("content-length", "0"))
+        while remaining:
+            data = await upstream_reader.read(min(remaining, BUFFER_SIZE))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            writer.write(data)
+            remaining -= len(data)
+            await writer.drain()
+        await writer.drain()
+
+
+async def _pipe(reader: StreamReader, writer: StreamWriter) -> None:
+    """Copy reader to writer, passing the EOF on as a half-close."""
+    try:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+            return
+    except OSError:
+        pass
+    writer.close()
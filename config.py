@@ -11,6 +11,13 @@ from pathlib import Path
 import yaml
 
 
+EVENT_LOOPS = ("auto", "asyncio", "uvloop")
+IO_MODES = ("streams", "protocol")
+RELAY_ENGINES = ("auto", "stream", "recv_into", "splice")
+BALANCER_STRATEGIES = ("round_robin", "least_outstanding", "ewma", "p2c")
+SESSION_KEYS = ("client_ip", "username", "header")
+
+
 class ConfigError(Exception):
     """Configuration error."""
 
@@ -20,34 +27,165 @@ class ServerConfig:
     """Server configuration."""
     host: str = "127.0.0.1"
     port: int = 8888
+    io_mode: str = "streams"  # streams, protocol
+    event_loop: str = "auto"  # auto, asyncio, uvloop
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ProxyConfig:
-    """Proxy configuration."""
+    """
+    Proxy configuration.
+
+    Immutable: the Proxy-Authorization header is encoded once, when the
+    proxy is configured, and reused by every request sent to it (use
+    dataclasses.replace for a variant).
+    """
     host: str
     port: int
     username: str = ""
     password: str = ""
+    # Derived in __post_init__
+    address: tuple[str, int] = field(init=False, repr=False, compare=False)
+    auth_header: str | None = field(init=False, repr=False, compare=False)
+    auth_line: bytes = field(init=False, repr=False, compare=False)  # header line, b"" without auth
+
+    def __post_init__(self):
+        auth_header = None
+        auth_line = b""
+        if self.requires_auth:
+            credentials = f"{self.username}:{self.password}"
+            auth_header = f"Basic {base64.b64encode(credentials.encode()).decode()}"
+            auth_line = f"Proxy-Authorization: {auth_header}\r\n".encode()
+        object.__setattr__(self, "address", (self.host, self.port))
+        object.__setattr__(self, "auth_header", auth_header)
+        object.__setattr__(self, "auth_line", auth_line)
 
     @property
     def requires_auth(self) -> bool:
         """Check if authentication is required."""
         return bool(self.username and self.password)
 
-    @property
-    def auth_header(self) -> str | None:
-        """Return base64 encoded Proxy-Authorization header value."""
-        if not self.requires_auth:
-            return None
-        credentials = f"{self.username}:{self.password}"
-        encoded = base64.b64encode(credentials.encode()).decode()
-        return f"Basic {encoded}"
 
-    @property
-    def address(self) -> tuple[str, int]:
-        """Return (host, port) tuple."""
-        return (self.host, self.port)
+@dataclass
+class PoolConfig:
+    """Pre-warmed corporate -> webshare connection pool configuration."""
+    enabled: bool = False
+    min_size: int = 2
+    max_size: int = 10
+    idle_ttl: float = 30.0  # seconds
+    probe_interval: float = 5.0  # seconds
+
+
+@dataclass
+class HttpConfig:
+    """Plain HTTP forwarding configuration."""
+    keep_alive: bool = True
+    client_idle_timeout: float = 15.0  # seconds
+    upstream_max_idle: int = 8  # idle connections kept per upstream proxy
+    upstream_idle_ttl: float = 30.0  # seconds
+
+
+@dataclass
+class ConnectConfig:
+    """Upstream connection establishment configuration."""
+    happy_eyeballs_delay: float = 0.25  # seconds before racing the next address
+    failure_penalty: float = 30.0  # seconds a failed address is tried last
+
+
+@dataclass
+class TunnelConfig:
+    """CONNECT tunnel establishment configuration."""
+    pipeline: bool = False  # send both CONNECTs of a fresh chain at once
+    optimistic: bool = False  # answer the client 200 before the tunnel is up
+
+
+@dataclass
+class DnsConfig:
+    """Upstream proxy name resolution cache configuration."""
+    ttl: float = 60.0  # seconds a resolved name is cached
+    negative_ttl: float = 5.0  # seconds a resolution failure is cached
+
+
+@dataclass
+class BalancerConfig:
+    """Webshare upstream selection configuration."""
+    strategy: str = "round_robin"  # round_robin, least_outstanding, ewma, p2c
+
+
+@dataclass
+class SessionConfig:
+    """Sticky webshare session configuration."""
+    enabled: bool = False
+    key: str = "client_ip"  # client_ip, username, header
+    header: str = "x-mooltiroute-session"  # request header holding the key (key: header)
+    username_format: str = "{username}-session-{session}"  # sticky webshare username
+    max_sessions: int = 10000
+    ttl: float = 600.0  # seconds a session is kept unused
+
+
+@dataclass
+class HealthConfig:
+    """Upstream health checks and circuit breaker configuration."""
+    enabled: bool = False  # background probes (the breaker always runs)
+    interval: float = 10.0  # seconds between probe rounds
+    timeout: float = 5.0  # seconds per probe
+    canary: str = "example.com:443"  # CONNECT target used by probes
+    failure_threshold: int = 3  # consecutive failures that open a circuit
+    open_timeout: float = 10.0  # seconds before an open circuit is retried
+
+
+@dataclass
+class RetryConfig:
+    """CONNECT tunnel establishment retry configuration."""
+    max_attempts: int = 3  # 1 disables retries
+    statuses: list[int] = field(default_factory=lambda: [502, 503, 504])
+    backoff_base: float = 0.1  # seconds, doubled on each retry
+    backoff_max: float = 2.0  # seconds
+    deadline: float = 30.0  # seconds for all attempts together
+    attempt_timeout: float = 10.0  # seconds for one attempt, below deadline
+
+
+@dataclass
+class HedgeConfig:
+    """Hedged tunnel establishment configuration."""
+    enabled: bool = False
+    percentile: float = 95.0  # recent setup time percentile after which to hedge
+    min_delay: float = 0.05  # seconds, lower bound of the hedge delay
+    budget: float = 0.05  # hedges per tunnel establishment, at most
+
+
+@dataclass
+class AdmissionConfig:
+    """Client admission control configuration (0 disables a limit)."""
+    max_connections: int = 0  # admitted client connections, all clients
+    max_per_client: int = 0  # client connections per client IP
+    max_pending_connects: int = 0  # upstream connects in progress
+    queue_size: int = 100  # connections waiting for a slot
+    queue_timeout: float = 5.0  # seconds waited before a 503
+
+
+@dataclass
+class RelayConfig:
+    """CONNECT tunnel relay configuration."""
+    engine: str = "stream"  # auto, stream, recv_into, splice
+    idle_timeout: float = 300.0  # seconds without data before a tunnel is closed
+    max_lifetime: float = 0.0  # seconds a tunnel may stay open in total
+
+
+@dataclass
+class MetricsConfig:
+    """Prometheus metrics endpoint configuration."""
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9464  # workers use port + worker index
+
+
+@dataclass
+class TracingConfig:
+    """Per-connection phase tracing configuration."""
+    enabled: bool = False
+    slow_threshold: float = 2.0  # seconds to ready above which a trace is logged
+    sample_rate: float = 0.0  # fraction of other connections logged anyway
 
 
 @dataclass
@@ -56,12 +194,35 @@ class LoggingConfig:
     level: str = "INFO"
 
 
+@dataclass
+class ReloadConfig:
+    """Configuration file reload (SIGHUP reloads in any case)."""
+    watch: bool = False  # also reload when the file changes
+    interval: float = 2.0  # seconds between two checks of the file
+
+
 @dataclass
 class Config:
     """Main configuration."""
     server: ServerConfig
-    webshare: ProxyConfig
+    webshare: ProxyConfig  # first of webshares
     corporate_proxy: ProxyConfig | None = None
+    webshares: list[ProxyConfig] = field(default_factory=list)
+    balancer: BalancerConfig = field(default_factory=BalancerConfig)
+    sessions: SessionConfig = field(default_factory=SessionConfig)
+    health: HealthConfig = field(default_factory=HealthConfig)
+    retry: RetryConfig = field(default_factory=RetryConfig)
+    hedge: HedgeConfig = field(default_factory=HedgeConfig)
+    admission: AdmissionConfig = field(default_factory=AdmissionConfig)
+    pool: PoolConfig = field(default_factory=PoolConfig)
+    http: HttpConfig = field(default_factory=HttpConfig)
+    connect: ConnectConfig = field(default_factory=ConnectConfig)
+    tunnel: TunnelConfig = field(default_factory=TunnelConfig)
+    dns: DnsConfig = field(default_factory=DnsConfig)
+    relay: RelayConfig = field(default_factory=RelayConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    tracing: TracingConfig = field(default_factory=TracingConfig)
+    reload: ReloadConfig = field(default_factory=ReloadConfig)
     logging: LoggingConfig = field(default_factory=LoggingConfig)
 
 
@@ -117,22 +278,37 @@ def load_config(path: str) -> Config:
     server = ServerConfig(
         host=server_data.get("host", "127.0.0.1"),
         port=int(server_data.get("port", 8888)),
+        io_mode=str(server_data.get("io_mode", "streams")).lower(),
+        event_loop=str(server_data.get("event_loop", "auto")).lower(),
     )
+    if server.event_loop not in EVENT_LOOPS:
+        raise ConfigError(
+            f"Invalid server event_loop '{server.event_loop}' (expected one of: {', '.join(EVENT_LOOPS)})"
+        )
+    if server.io_mode not in IO_MODES:
+        raise ConfigError(
+            f"Invalid server io_mode '{server.io_mode}' (expected one of: {', '.join(IO_MODES)})"
+        )
 
-    # Parse webshare config (required)
+    # Parse webshare config (required): one proxy or a list of proxies
     webshare_data = data.get("webshare")
     if not webshare_data:
         raise ConfigError("Missing required 'webshare' configuration")
-
-    if "host" not in webshare_data or "port" not in webshare_data:
-        raise ConfigError("Webshare config must include 'host' and 'port'")
-
-    webshare = ProxyConfig(
-        host=webshare_data["host"],
-        port=int(webshare_data["port"]),
-        username=webshare_data.get("username", ""),
-        password=webshare_data.get("password", ""),
-    )
+    if isinstance(webshare_data, dict):
+        webshare_data = [webshare_data]
+
+    webshares = []
+    for entry in webshare_data:
+        if not isinstance(entry, dict) or "host" not in entry or "port" not in entry:
+            raise ConfigError("Webshare config must include 'host' and 'port'")
+        webshares.append(ProxyConfig(
+            host=entry["host"],
+            port=int(entry["port"]),
+            username=entry.get("username", ""),
+            password=entry.get("password", ""),
+        ))
+    if len({proxy.address for proxy in webshares}) != len(webshares):
+        raise ConfigError("Webshare proxies must have distinct host:port")
 
     # Parse corporate proxy config (optional)
     corporate_proxy = None
@@ -147,6 +323,206 @@ def load_config(path: str) -> Config:
             password=corporate_data.get("password", ""),
         )
 
+    # Parse pool config
+    pool_data = data.get("pool", {})
+    pool = PoolConfig(
+        enabled=bool(pool_data.get("enabled", False)),
+        min_size=int(pool_data.get("min_size", 2)),
+        max_size=int(pool_data.get("max_size", 10)),
+        idle_ttl=float(pool_data.get("idle_ttl", 30.0)),
+        probe_interval=float(pool_data.get("probe_interval", 5.0)),
+    )
+    if pool.min_size < 0 or pool.max_size < pool.min_size:
+        raise ConfigError("Pool config requires 0 <= min_size <= max_size")
+    if pool.probe_interval <= 0:
+        raise ConfigError("Pool probe_interval must be positive")
+
+    # Parse plain HTTP config
+    http_data = data.get("http", {})
+    http = HttpConfig(
+        keep_alive=bool(http_data.get("keep_alive", True)),
+        client_idle_timeout=float(http_data.get("client_idle_timeout", 15.0)),
+        upstream_max_idle=int(http_data.get("upstream_max_idle", 8)),
+        upstream_idle_ttl=float(http_data.get("upstream_idle_ttl", 30.0)),
+    )
+    if http.client_idle_timeout <= 0 or http.upstream_idle_ttl <= 0:
+        raise ConfigError("HTTP client_idle_timeout and upstream_idle_ttl must be positive")
+    if http.upstream_max_idle < 0:
+        raise ConfigError("HTTP upstream_max_idle must not be negative")
+
+    # Parse connect config
+    connect_data = data.get("connect", {})
+    connect = ConnectConfig(
+        happy_eyeballs_delay=float(connect_data.get("happy_eyeballs_delay", 0.25)),
+        failure_penalty=float(connect_data.get("failure_penalty", 30.0)),
+    )
+    if connect.happy_eyeballs_delay <= 0:
+        raise ConfigError("Connect happy_eyeballs_delay must be positive")
+
+    # Parse tunnel config
+    tunnel_data = data.get("tunnel", {})
+    tunnel = TunnelConfig(
+        pipeline=bool(tunnel_data.get("pipeline", False)),
+        optimistic=bool(tunnel_data.get("optimistic", False)),
+    )
+
+    # Parse DNS config
+    dns_data = data.get("dns", {})
+    dns = DnsConfig(
+        ttl=float(dns_data.get("ttl", 60.0)),
+        negative_ttl=float(dns_data.get("negative_ttl", 5.0)),
+    )
+    if dns.ttl < 0 or dns.negative_ttl < 0:
+        raise ConfigError("DNS ttl and negative_ttl must not be negative")
+
+    # Parse balancer config
+    balancer_data = data.get("balancer", {})
+    balancer = BalancerConfig(
+        strategy=str(balancer_data.get("strategy", "round_robin")).lower(),
+    )
+    if balancer.strategy not in BALANCER_STRATEGIES:
+        raise ConfigError(
+            f"Invalid balancer strategy '{balancer.strategy}' "
+            f"(expected one of: {', '.join(BALANCER_STRATEGIES)})"
+        )
+
+    # Parse sessions config
+    sessions_data = data.get("sessions", {})
+    sessions = SessionConfig(
+        enabled=bool(sessions_data.get("enabled", False)),
+        key=str(sessions_data.get("key", "client_ip")).lower(),
+        header=str(sessions_data.get("header", "x-mooltiroute-session")).lower(),
+        username_format=str(sessions_data.get("username_format", "{username}-session-{session}")),
+        max_sessions=int(sessions_data.get("max_sessions", 10000)),
+        ttl=float(sessions_data.get("ttl", 600.0)),
+    )
+    if sessions.key not in SESSION_KEYS:
+        raise ConfigError(
+            f"Invalid sessions key '{sessions.key}' (expected one of: {', '.join(SESSION_KEYS)})"
+        )
+    try:
+        sessions.username_format.format(username="", session="")
+    except (KeyError, IndexError, ValueError):
+        raise ConfigError(
+            f"Invalid sessions username_format '{sessions.username_format}' "
+            f"(fields: {{username}}, {{session}})"
+        )
+    if "{session}" not in sessions.username_format:
+        raise ConfigError("Sessions username_format must contain {session}")
+    if sessions.max_sessions < 1 or sessions.ttl <= 0:
+        raise ConfigError("Sessions max_sessions and ttl must be positive")
+
+    # Parse health config
+    health_data = data.get("health", {})
+    health = HealthConfig(
+        enabled=bool(health_data.get("enabled", False)),
+        interval=float(health_data.get("interval", 10.0)),
+        timeout=float(health_data.get("timeout", 5.0)),
+        canary=str(health_data.get("canary", "example.com:443")),
+        failure_threshold=int(health_data.get("failure_threshold", 3)),
+        open_timeout=float(health_data.get("open_timeout", 10.0)),
+    )
+    if not re.fullmatch(r"[^\s:]+:\d+", health.canary):
+        raise ConfigError(f"Invalid health canary '{health.canary}' (expected host:port)")
+    if health.interval <= 0 or health.timeout <= 0 or health.open_timeout <= 0:
+        raise ConfigError("Health interval, timeout and open_timeout must be positive")
+    if health.failure_threshold < 1:
+        raise ConfigError("Health failure_threshold must be at least 1")
+
+    # Parse retry config
+    retry_data = data.get("retry", {})
+    retry = RetryConfig(
+        max_attempts=int(retry_data.get("max_attempts", 3)),
+        statuses=[int(status) for status in retry_data.get("statuses", [502, 503, 504])],
+        backoff_base=float(retry_data.get("backoff_base", 0.1)),
+        backoff_max=float(retry_data.get("backoff_max", 2.0)),
+        deadline=float(retry_data.get("deadline", 30.0)),
+        attempt_timeout=float(retry_data.get("attempt_timeout", 10.0)),
+    )
+    if retry.max_attempts < 1:
+        raise ConfigError("Retry max_attempts must be at least 1")
+    if retry.deadline <= 0:
+        raise ConfigError("Retry deadline must be positive")
+    if not 0 < retry.attempt_timeout < retry.deadline:
+        raise ConfigError("Retry attempt_timeout must be positive and below deadline")
+
+    # Parse hedge config
+    hedge_data = data.get("hedge", {})
+    hedge = HedgeConfig(
+        enabled=bool(hedge_data.get("enabled", False)),
+        percentile=float(hedge_data.get("percentile", 95.0)),
+        min_delay=float(hedge_data.get("min_delay", 0.05)),
+        budget=float(hedge_data.get("budget", 0.05)),
+    )
+    if not 0 < hedge.percentile < 100:
+        raise ConfigError("Hedge percentile must be between 0 and 100")
+    if hedge.min_delay < 0:
+        raise ConfigError("Hedge min_delay must not be negative")
+    if not 0 <= hedge.budget <= 1:
+        raise ConfigError("Hedge budget must be between 0 and 1")
+
+    # Parse admission config
+    admission_data = data.get("admission", {})
+    admission = AdmissionConfig(
+        max_connections=int(admission_data.get("max_connections", 0)),
+        max_per_client=int(admission_data.get("max_per_client", 0)),
+        max_pending_connects=int(admission_data.get("max_pending_connects", 0)),
+        queue_size=int(admission_data.get("queue_size", 100)),
+        queue_timeout=float(admission_data.get("queue_timeout", 5.0)),
+    )
+    if min(
+        admission.max_connections,
+        admission.max_per_client,
+        admission.max_pending_connects,
+        admission.queue_size,
+    ) < 0:
+        raise ConfigError("Admission limits and queue_size must not be negative")
+    if admission.queue_timeout <= 0:
+        raise ConfigError("Admission queue_timeout must be positive")
+
+    # Parse relay config
+    relay_data = data.get("relay", {})
+    relay = RelayConfig(
+        engine=str(relay_data.get("engine", "stream")).lower(),
+        idle_timeout=float(relay_data.get("idle_timeout", 300.0)),
+        max_lifetime=float(relay_data.get("max_lifetime", 0.0)),
+    )
+    if relay.engine not in RELAY_ENGINES:
+        raise ConfigError(
+            f"Invalid relay engine '{relay.engine}' (expected one of: {', '.join(RELAY_ENGINES)})"
+        )
+    if relay.idle_timeout < 0 or relay.max_lifetime < 0:
+        raise ConfigError("Relay idle_timeout and max_lifetime must not be negative")
+
+    # Parse metrics config
+    metrics_data = data.get("metrics", {})
+    metrics = MetricsConfig(
+        enabled=bool(metrics_data.get("enabled", False)),
+        host=metrics_data.get("host", "127.0.0.1"),
+        port=int(metrics_data.get("port", 9464)),
+    )
+
+    # Parse tracing config
+    tracing_data = data.get("tracing", {})
+    tracing = TracingConfig(
+        enabled=bool(tracing_data.get("enabled", False)),
+        slow_threshold=float(tracing_data.get("slow_threshold", 2.0)),
+        sample_rate=float(tracing_data.get("sample_rate", 0.0)),
+    )
+    if tracing.slow_threshold < 0:
+        raise ConfigError("Tracing slow_threshold must not be negative")
+    if not 0 <= tracing.sample_rate <= 1:
+        raise ConfigError("Tracing sample_rate must be between 0 and 1")
+
+    # Parse reload config
+    reload_data = data.get("reload", {})
+    reload = ReloadConfig(
+        watch=bool(reload_data.get("watch", False)),
+        interval=float(reload_data.get("interval", 2.0)),
+    )
+    if reload.interval <= 0:
+        raise ConfigError("Reload interval must be positive")
+
     # Parse logging config
     logging_data = data.get("logging", {})
     logging_config = LoggingConfig(
@@ -155,7 +531,23 @@ def load_config(path: str) -> Config:
 
     return Config(
         server=server,
-        webshare=webshare,
+        webshare=webshares[0],
         corporate_proxy=corporate_proxy,
+        webshares=webshares,
+        balancer=balancer,
+        sessions=sessions,
+        health=health,
+        retry=retry,
+        hedge=hedge,
+        admission=admission,
+        pool=pool,
+        http=http,
+        connect=connect,
+        tunnel=tunnel,
+        dns=dns,
+        relay=relay,
+        metrics=metrics,
+        tracing=tracing,
+        reload=reload,
         logging=logging_config,
     )
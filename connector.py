@@ -0,0 +1,173 @@
+"""Upstream connection establishment for Mooltiroute (happy eyeballs)."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+import time
+from asyncio import StreamReader, StreamWriter
+
+import tracing
+from config import ConnectConfig, DnsConfig
+from resolver import Resolver
+
+logger = logging.getLogger("mooltiroute.connector")
+
+LATENCY_ALPHA = 0.3  # weight of the latest sample in the latency average
+
+Address = tuple  # socket address as returned by getaddrinfo
+
+
+class _AddressStats:
+    """Connect latency and failure history of one resolved address."""
+
+    __slots__ = ("latency", "failures", "last_failure")
+
+    def __init__(self):
+        self.latency: float | None = None  # moving average, seconds
+        self.failures = 0  # consecutive failures
+        self.last_failure = 0.0
+
+    def record_success(self, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_ALPHA * (latency - self.latency)
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.last_failure = time.monotonic()
+
+
+class Connector:
+    """
+    Open TCP connections to upstream proxies, racing their addresses.
+
+    All addresses of a host are resolved and tried with staggered starts
+    (RFC 8305): the next attempt starts when the previous one fails or
+    after happy_eyeballs_delay, and the first connection established
+    wins. Per-address latency and failure history is kept so that the
+    fastest recently healthy address is tried first on later connects,
+    and an address that failed recently is only tried last.
+    """
+
+    def __init__(self, config: ConnectConfig, resolver: Resolver):
+        self.config = config
+        self.resolver = resolver
+        self._stats: dict[Address, _AddressStats] = {}
+
+    async def open_connection(
+        self,
+        host: str,
+        port: int,
+    ) -> tuple[StreamReader, StreamWriter]:
+        """
+        Connect to host:port, racing its addresses.
+
+        The caller applies the overall timeout (asyncio.wait_for).
+
+        Raises:
+            OSError: If resolution fails or no address accepts the connection
+        """
+        infos = await self.resolver.resolve(host, port)
+        tracing.mark("dns")
+        sock = await self._race(self._order(infos))
+        tracing.mark("tcp_connect")
+        return await asyncio.open_connection(sock=sock)
+
+    def _order(self, infos: list) -> list:
+        """Sort resolved addresses: healthy and fast first, recent failures last."""
+        now = time.monotonic()
+        penalty = self.config.failure_penalty
+
+        def key(item: tuple[int, tuple]) -> tuple:
+            index, info = item
+            stats = self._stats.get(info[4])
+            if stats is None:
+                return (False, float("inf"), index)
+            failing = stats.failures > 0 and now - stats.last_failure < penalty
+            latency = stats.latency if stats.latency is not None else float("inf")
+            return (failing, latency, index)
+
+        # getaddrinfo may return duplicates (one per protocol)
+        unique = {info[4]: info for info in infos}
+        return [info for _, info in sorted(enumerate(unique.values()), key=key)]
+
+    async def _race(self, infos: list) -> socket.socket:
+        """Run staggered connect attempts and return the first connected socket."""
+        pending: dict[asyncio.Task, tuple] = {}
+        errors: list[OSError] = []
+        remaining = list(infos)
+        winner: socket.socket | None = None
+
+        try:
+            while winner is None and (remaining or pending):
+                if remaining:
+                    info = remaining.pop(0)
+                    task = asyncio.create_task(self._attempt(info))
+                    pending[task] = info
+                    timeout = self.config.happy_eyeballs_delay if remaining else None
+                else:
+                    timeout = None
+
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    del pending[task]
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        task.result().close()
+        finally:
+            # Attempts that lost the race, or were cut by the caller's
+            # timeout, did not fail: only connect errors (in _attempt)
+            # count against an address. An address that never answers
+            # stays unmeasured, so measured ones are tried before it.
+            for task in pending:
+                task.cancel()
+            if pending:
+                results = await asyncio.gather(*pending, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, socket.socket):
+                        result.close()
+
+        if winner is None:
+            if len(errors) == 1:
+                raise errors[0]
+            raise OSError(f"All connection attempts failed: {', '.join(str(e) for e in errors)}")
+        return winner
+
+    async def _attempt(self, info: tuple) -> socket.socket:
+        family, type_, proto, _, address = info
+        loop = asyncio.get_running_loop()
+        stats = self._stats_for(address)
+        sock = socket.socket(family, type_, proto)
+        started = time.monotonic()
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, address)
+        except BaseException as e:
+            sock.close()
+            if isinstance(e, OSError):
+                stats.record_failure()
+                logger.debug(f"Connect to {address[0]}:{address[1]} failed: {e}")
+            raise
+        stats.record_success(time.monotonic() - started)
+        return sock
+
+    def _stats_for(self, address: Address) -> _AddressStats:
+        stats = self._stats.get(address)
+        if stats is None:
+            stats = self._stats[address] = _AddressStats()
+        return stats
+
+
+# Used by callers that are not given a connector of their own
+default_connector = Connector(ConnectConfig(), Resolver(DnsConfig()))
@@ -0,0 +1,194 @@
+"""Upstream health checking and circuit breaking for Mooltiroute."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from config import HealthConfig, ProxyConfig
+from connector import Connector
+from http_parser import parse_connect_target
+from tunnel import (
+    CorporateProxyError,
+    CorporateRefusedError,
+    ProxyRefusedError,
+    TunnelError,
+    create_chained_tunnel,
+    create_tunnel,
+)
+
+if TYPE_CHECKING:
+    from balancer import Upstream
+
+logger = logging.getLogger("mooltiroute.health")
+
+STATE_CLOSED = "closed"        # upstream healthy, traffic flows
+STATE_OPEN = "open"            # upstream failing, traffic is refused
+STATE_HALF_OPEN = "half_open"  # one trial connection decides
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+
+    failure_threshold consecutive failures open the circuit: the upstream
+    is skipped without trying it. After open_timeout one trial connection
+    (a live one or a health probe) is let through; its success closes the
+    circuit, its failure opens it again.
+    """
+
+    def __init__(self, name: str, config: HealthConfig):
+        self.name = name
+        self.config = config
+        self.state = STATE_CLOSED
+        self.failures = 0  # consecutive
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self.opens = 0
+
+    def available(self) -> bool:
+        """True if a connection may be attempted now."""
+        if self.state == STATE_CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == STATE_OPEN:
+            return now - self.opened_at >= self.config.open_timeout
+        # Half-open: a trial that never reported back does not block forever
+        return now - self.trial_started >= self.config.open_timeout
+
+    def begin(self) -> None:
+        """A connection is being attempted (call after available())."""
+        if self.state != STATE_CLOSED:
+            self.state = STATE_HALF_OPEN
+            self.trial_started = time.monotonic()
+
+    def record_success(self) -> None:
+        if self.state != STATE_CLOSED:
+            logger.info(f"Upstream {self.name} recovered, circuit closed")
+        self.state = STATE_CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == STATE_HALF_OPEN or (
+            self.state == STATE_CLOSED and self.failures >= self.config.failure_threshold
+        ):
+            if self.state == STATE_CLOSED:
+                logger.warning(
+                    f"Upstream {self.name} failed {self.failures} times, circuit opened"
+                )
+            self.state = STATE_OPEN
+            self.opened_at = time.monotonic()
+            self.opens += 1
+
+
+class HealthChecker:
+    """
+    Background prober of the upstream proxies.
+
+    Every interval the corporate proxy (if any) gets a TCP connect, then
+    each webshare upstream gets a CONNECT to the canary target through
+    the usual chain. Results feed the upstream latency averages and
+    circuit breakers, so a dead upstream is taken out of rotation before
+    client requests hit it, and put back as soon as it answers again.
+    """
+
+    def __init__(
+        self,
+        config: HealthConfig,
+        upstreams: list[Upstream],
+        corporate: ProxyConfig | None,
+        corporate_breaker: CircuitBreaker | None,
+        connector: Connector,
+    ):
+        self.config = config
+        self.upstreams = upstreams
+        self.corporate = corporate
+        self.corporate_breaker = corporate_breaker
+        self.connector = connector
+        self.canary = parse_connect_target(config.canary)
+        self._task: asyncio.Task | None = None
+
+        self.probes = 0
+        self.probe_failures = 0
+
+    def start(self) -> None:
+        """Start probing in the background."""
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Health checks every {self.config.interval}s via {self.config.canary}"
+        )
+
+    async def close(self) -> None:
+        """Stop probing."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.config.interval)
+
+    async def check_all(self) -> None:
+        """Probe every upstream once."""
+        if self.corporate and not await self._probe_corporate():
+            # Everything behind a dead corporate proxy would fail too;
+            # do not blame the webshare upstreams for it.
+            return
+        await asyncio.gather(*(self._probe_upstream(u) for u in self.upstreams))
+
+    async def _probe_corporate(self) -> bool:
+        self.probes += 1
+        try:
+            _, writer = await asyncio.wait_for(
+                self.connector.open_connection(self.corporate.host, self.corporate.port),
+                timeout=self.config.timeout,
+            )
+        except (asyncio.TimeoutError, OSError) as e:
+            self.probe_failures += 1
+            logger.debug(f"Health probe of corporate proxy failed: {e}")
+            self.corporate_breaker.record_failure()
+            return False
+        writer.close()
+        self.corporate_breaker.record_success()
+        return True
+
+    async def _probe_upstream(self, upstream: Upstream) -> None:
+        host, port = self.canary
+        self.probes += 1
+        started = time.monotonic()
+        try:
+            if self.corporate:
+                tunnel = create_chained_tunnel(
+                    host,
+                    port,
+                    self.corporate,
+                    upstream.proxy,
+                    connector=self.connector,
+                )
+            else:
+                tunnel = create_tunnel(host, port, upstream.proxy, connector=self.connector)
+            _, writer = await asyncio.wait_for(tunnel, timeout=self.config.timeout)
+        except CorporateProxyError as e:
+            # Lost between the corporate probe and this one: not webshare's fault
+            self.probe_failures += 1
+            logger.debug(f"Health probe of {upstream.name} failed at the corporate proxy: {e}")
+            self.corporate_breaker.record_failure()
+        except CorporateRefusedError as e:
+            # Corporate misconfiguration: not webshare's fault either
+            self.probe_failures += 1
+            logger.debug(f"Health probe of {upstream.name} refused by the corporate proxy: {e}")
+        except ProxyRefusedError:
+            # Reachable and answering: the canary itself is the problem
+            upstream.record_latency(time.monotonic() - started)
+        except (asyncio.TimeoutError, TunnelError, OSError) as e:
+            self.probe_failures += 1
+            logger.debug(f"Health probe of {upstream.name} failed: {e}")
+            upstream.record_failure()
+        else:
+            upstream.record_latency(time.monotonic() - started)
+            writer.close()
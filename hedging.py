@@ -0,0 +1,155 @@
+"""Hedged CONNECT tunnel establishment for Mooltiroute."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+import metrics
+import tracing
+from config import HedgeConfig
+
+logger = logging.getLogger("mooltiroute.hedging")
+
+T = TypeVar("T")
+
+SAMPLE_WINDOW = 512  # latest setup times the hedge delay is derived from
+MIN_SAMPLES = 20  # no hedging before this many setup times are known
+RECOMPUTE_EVERY = 16  # new samples between two computations of the delay
+BUDGET_BURST = 10.0  # hedges that can be saved up while traffic is quiet
+
+
+def _abandon(task: asyncio.Future, discard: Callable[[T], None]) -> None:
+    """Cancel task, discarding its result should it complete anyway."""
+
+    def done(task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is None:
+            discard(task.result())
+
+    task.cancel()
+    task.add_done_callback(done)
+
+
+class HedgePolicy:
+    """
+    Start a second tunnel establishment when the first one is slow.
+
+    With a rotating webshare pool, a few exits take far longer than the
+    others to answer the target CONNECT. When an attempt has not completed
+    after the hedge.percentile of recent setup times (at least
+    hedge.min_delay), a second attempt starts in parallel; the first to
+    succeed is used and the other one is cancelled, or closed if it
+    succeeded too.
+
+    Each establishment earns hedge.budget of a hedge (up to BUDGET_BURST
+    saved), so hedges add at most that fraction of upstream connects.
+    """
+
+    def __init__(self, config: HedgeConfig):
+        self.config = config
+        self._samples: deque[float] = deque(maxlen=SAMPLE_WINDOW)
+        self._new_samples = 0
+        self._delay: float | None = None
+        self._tokens = 0.0
+
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+
+    def delay(self) -> float | None:
+        """Seconds after which an attempt is hedged (None: not yet known)."""
+        if len(self._samples) < MIN_SAMPLES:
+            return None
+        if self._delay is None or self._new_samples >= RECOMPUTE_EVERY:
+            ordered = sorted(self._samples)
+            rank = math.ceil(self.config.percentile / 100 * len(ordered)) - 1
+            self._delay = max(self.config.min_delay, ordered[rank])
+            self._new_samples = 0
+        return self._delay
+
+    def _observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._new_samples += 1
+
+    async def run(
+        self,
+        attempt: Callable[[], Awaitable[T]],
+        discard: Callable[[T], None],
+        label: str,
+    ) -> T:
+        """
+        Call attempt(), hedging it with a second call if it is slow.
+
+        discard releases the result of an attempt that completed but is
+        not used.
+
+        Raises:
+            The error of the last attempt to fail, when none succeeds
+        """
+        if not self.config.enabled:
+            return await attempt()
+
+        self._tokens = min(BUDGET_BURST, self._tokens + self.config.budget)
+        delay = self.delay()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(attempt())
+        tasks = [primary]
+        try:
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+            if primary.done() or delay is None:
+                result = await primary
+                self._observe(time.monotonic() - started)
+                return result
+
+            if self._tokens < 1:
+                self.over_budget += 1
+                result = await primary
+                self._observe(time.monotonic() - started)
+                return result
+
+            self._tokens -= 1
+            self.hedged += 1
+            tracing.mark("hedge")
+            logger.debug(f"{label}: no tunnel after {delay * 1000:.0f}ms, hedging")
+            tasks.append(asyncio.ensure_future(attempt()))
+
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # The primary wins a tie
+                winner = next((t for t in tasks if t in done and t.exception() is None), None)
+                if winner is not None:
+                    break
+                if not pending:
+                    metrics.HEDGES["both_failed"].inc()
+                    raise next(iter(done)).exception()
+
+            if winner is primary:
+                metrics.HEDGES["primary_won"].inc()
+            else:
+                self.hedge_wins += 1
+                metrics.HEDGES["hedge_won"].inc()
+            for task in tasks:
+                if task is not winner:
+                    _abandon(task, discard)
+            self._observe(time.monotonic() - started)
+            return winner.result()
+        except BaseException:
+            for task in tasks:
+                _abandon(task, discard)
+            raise
+
+    def stats(self) -> dict:
+        """Return hedging counters (the delay as last computed by run())."""
+        delay = self._delay if self.config.enabled else None
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "over_budget": self.over_budget,
+            "delay_ms": round(delay * 1000, 1) if delay is not None else None,
+        }
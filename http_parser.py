@@ -0,0 +1,488 @@
+"""HTTP/1.1 message parsing and body framing for Mooltiroute."""
+
+from __future__ import annotations
+
+import asyncio
+from asyncio import StreamReader, StreamWriter
+from dataclasses import dataclass, field
+
+MAX_HEAD_SIZE = 65536  # also the StreamReader default limit
+MAX_HEADERS = 100
+CHUNK_SIZE = 65536
+MAX_CHUNK_SIZE_DIGITS = 16  # hex digits of a chunk size (64 bits)
+_HEX_DIGITS = frozenset(b"0123456789abcdefABCDEF")
+# Header name characters (RFC 9110 section 5.6.2 tchar)
+_TOKEN_CHARS = frozenset(
+    b"!#$%&'*+-.^_`|~0123456789"
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+)
+
+CONNECT_ESTABLISHED = b"HTTP/1.1 200 Connection Established\r\n\r\n"
+
+# Body framing of an HTTP message
+FRAMING_NONE = "none"        # no body (HEAD, 1xx, 204, 304)
+FRAMING_LENGTH = "length"    # Content-Length bytes
+FRAMING_CHUNKED = "chunked"  # Transfer-Encoding: chunked
+FRAMING_CLOSE = "close"      # body ends when the connection closes
+
+
+class HttpParseError(Exception):
+    """Malformed HTTP message."""
+
+
+class HeadTooLargeError(HttpParseError):
+    """HTTP message head over the size limit."""
+
+
+class TruncatedBodyError(asyncio.IncompleteReadError):
+    """A message body that ended before its framing said it would."""
+
+    def __init__(self, copied: int, expected: int | None = None):
+        super().__init__(b"", expected)
+        self.copied = copied  # body bytes written before the end
+
+
+class _Headers:
+    """Header lookups over a list of (lowercase name, value) pairs."""
+
+    headers: list[tuple[str, str]]
+
+    def get(self, name: str, default: str | None = None) -> str | None:
+        """Return the first value of a header (name must be lowercase)."""
+        for key, value in self.headers:
+            if key == name:
+                return value
+        return default
+
+    def get_all(self, name: str) -> list[str]:
+        """Return every value of a header, in order (name must be lowercase)."""
+        return [value for key, value in self.headers if key == name]
+
+
+@dataclass
+class RequestHead(_Headers):
+    """Parsed HTTP request line and headers."""
+    method: str
+    target: str
+    version: str
+    headers: list[tuple[str, str]] = field(default_factory=list)
+    raw: bytes = b""
+
+
+@dataclass
+class ResponseHead(_Headers):
+    """Parsed HTTP response status line and headers."""
+    version: str
+    status_code: int
+    reason: str
+    headers: list[tuple[str, str]] = field(default_factory=list)
+    raw: bytes = b""
+
+    @property
+    def keep_alive(self) -> bool:
+        """True if the server allows reusing the connection."""
+        connection = self.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return "keep-alive" in connection
+        return "close" not in connection
+
+
+def _parse_head(raw: bytes) -> tuple[str, list[tuple[str, str]]]:
+    """
+    Split a message head into its start line and header pairs.
+
+    Works on a memoryview of raw: only the start line, header names and
+    header values are materialized, each decoded straight from the buffer.
+    Leading empty lines are ignored (RFC 9112 section 2.2). A bare CR or
+    LF, a header name that is not a token (such as "Name :") and an
+    obs-fold continuation line are rejected rather than cleaned up: the
+    next hop may read them differently (smuggling).
+
+    Raises:
+        HttpParseError: If a line ending or header line is malformed, or
+            there are too many headers
+    """
+    crlf = raw.count(b"\r\n")
+    if raw.count(b"\n") != crlf or raw.count(b"\r") != crlf:
+        raise HttpParseError("Bare CR or LF in message head")
+    view = memoryview(raw)
+    end = len(raw)
+    pos = 0
+    while raw.startswith(b"\r\n", pos):
+        pos += 2
+
+    line_end = raw.find(b"\r\n", pos)
+    if line_end < 0:
+        line_end = end
+    start_line = str(view[pos:line_end], "latin-1")
+    pos = line_end + 2
+
+    headers: list[tuple[str, str]] = []
+    while pos < end:
+        line_end = raw.find(b"\r\n", pos)
+        if line_end < 0:
+            line_end = end
+        if line_end == pos:
+            break
+
+        if raw[pos] in b" \t":
+            raise HttpParseError(f"Folded header line: {bytes(view[pos:line_end])!r}")
+        colon = raw.find(b":", pos, line_end)
+        if colon <= pos or not _TOKEN_CHARS.issuperset(view[pos:colon]):
+            raise HttpParseError(f"Invalid header line: {bytes(view[pos:line_end])!r}")
+        if len(headers) >= MAX_HEADERS:
+            raise HttpParseError(f"Too many headers (max {MAX_HEADERS})")
+
+        name = str(view[pos:colon], "latin-1").lower()
+        value = str(view[colon + 1:line_end], "latin-1").strip()
+        headers.append((name, value))
+        pos = line_end + 2
+
+    return start_line, headers
+
+
+def parse_request_head(raw: bytes) -> RequestHead:
+    """
+    Parse a request head (request line, headers, final CRLF).
+
+    Raises:
+        HttpParseError: If the head is malformed
+    """
+    start_line, headers = _parse_head(raw)
+    parts = start_line.split(" ")
+    if len(parts) < 3:
+        raise HttpParseError(f"Invalid request line: {start_line!r}")
+
+    return RequestHead(
+        method=parts[0].upper(),
+        target=parts[1],
+        version=parts[2].upper(),
+        headers=headers,
+        raw=raw,
+    )
+
+
+def parse_response_head(raw: bytes) -> ResponseHead:
+    """
+    Parse a response head (status line, headers, final CRLF).
+
+    Raises:
+        HttpParseError: If the head is malformed
+    """
+    start_line, headers = _parse_head(raw)
+    parts = start_line.split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise HttpParseError(f"Invalid status line: {start_line!r}")
+    try:
+        status_code = int(parts[1])
+    except ValueError:
+        raise HttpParseError(f"Invalid status code: {parts[1]!r}")
+
+    return ResponseHead(
+        version=parts[0],
+        status_code=status_code,
+        reason=parts[2] if len(parts) > 2 else "",
+        headers=headers,
+        raw=raw,
+    )
+
+
+async def _read_head(reader: StreamReader) -> bytes:
+    """
+    Read a message head up to and including the blank line.
+
+    Raises:
+        asyncio.IncompleteReadError: If the connection closes first
+        HeadTooLargeError: If the head exceeds MAX_HEAD_SIZE
+    """
+    try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HeadTooLargeError(f"Message head larger than {MAX_HEAD_SIZE} bytes")
+
+    if len(raw) > MAX_HEAD_SIZE:
+        raise HeadTooLargeError(f"Message head larger than {MAX_HEAD_SIZE} bytes")
+    return raw
+
+
+async def read_request_head(reader: StreamReader) -> RequestHead:
+    """
+    Read and parse a request head in one go.
+
+    Callers apply a single deadline to the whole head (asyncio.wait_for).
+
+    Raises:
+        asyncio.IncompleteReadError: If the connection closes first
+        HttpParseError: If the head is malformed or too large
+    """
+    return parse_request_head(await _read_head(reader))
+
+
+async def read_response_head(reader: StreamReader) -> ResponseHead:
+    """
+    Read and parse a response head in one go.
+
+    Raises:
+        asyncio.IncompleteReadError: If the connection closes first
+        HttpParseError: If the head is malformed or too large
+    """
+    return parse_response_head(await _read_head(reader))
+
+
+def parse_connect_target(target: str) -> tuple[str, int] | None:
+    """Parse a CONNECT target into (host, port); None if the port is invalid."""
+    if ":" not in target:
+        return target, 443
+    host, port_str = target.rsplit(":", 1)
+    try:
+        return host, int(port_str)
+    except ValueError:
+        return None
+
+
+def error_response(status_code: int, message: str) -> bytes:
+    """Build a plain-text error response that closes the connection."""
+    return (
+        f"HTTP/1.1 {status_code} {message}\r\n"
+        f"Content-Type: text/plain\r\n"
+        f"Content-Length: {len(message)}\r\n"
+        f"Connection: close\r\n"
+        f"\r\n"
+        f"{message}"
+    ).encode()
+
+
+def _content_length(head: _Headers) -> int | None:
+    """
+    Return the Content-Length of a message head (None if absent).
+
+    Repeated headers and comma-separated lists are accepted only when all
+    values are the same (RFC 9112 section 6.3).
+
+    Raises:
+        HttpParseError: If a value is not ASCII digits or values differ
+    """
+    values = head.get_all("content-length")
+    if not values:
+        return None
+    lengths = {item.strip() for value in values for item in value.split(",")}
+    if len(lengths) != 1:
+        raise HttpParseError(f"Conflicting Content-Length: {', '.join(values)!r}")
+    length = lengths.pop()
+    # int() would also take "+5", "1_0" or non-ASCII digits
+    if not (length.isascii() and length.isdigit()):
+        raise HttpParseError(f"Invalid Content-Length: {length!r}")
+    return int(length)
+
+
+def transfer_codings(head: _Headers) -> list[str]:
+    """Return the transfer codings of a message head, in order, lowercase."""
+    return [
+        coding.strip().lower()
+        for value in head.get_all("transfer-encoding")
+        for coding in value.split(",")
+        if coding.strip()
+    ]
+
+
+def _chunked_with_length(head: _Headers, codings: list[str]) -> None:
+    """
+    Reject a message framed by both Transfer-Encoding and Content-Length.
+
+    The proxy and the next hop could pick different framings (RFC 9112
+    section 6.3: such a message ought to be handled as an error).
+
+    Raises:
+        HttpParseError: If both headers are present
+    """
+    if codings and head.get("content-length") is not None:
+        raise HttpParseError("Both Transfer-Encoding and Content-Length")
+
+
+def request_framing(head: RequestHead) -> tuple[str, int]:
+    """
+    Return (framing, content_length) of the body following a request head.
+
+    Every Transfer-Encoding header counts, and chunked must be the final
+    coding: a request body has no other way to end (RFC 9112 section 6.3).
+
+    Raises:
+        HttpParseError: If Content-Length or Transfer-Encoding is invalid,
+            or both are present
+    """
+    codings = transfer_codings(head)
+    _chunked_with_length(head, codings)
+    if codings:
+        if codings[-1] != "chunked":
+            raise HttpParseError(f"Transfer-Encoding not ending with chunked: {codings}")
+        return FRAMING_CHUNKED, 0
+
+    length = _content_length(head)
+    return (FRAMING_LENGTH, length) if length else (FRAMING_NONE, 0)
+
+
+def response_framing(head: ResponseHead, request_method: str) -> tuple[str, int]:
+    """
+    Return (framing, content_length) of the body following a response head.
+
+    A Transfer-Encoding whose final coding is not chunked means the body
+    ends when the connection closes.
+
+    Raises:
+        HttpParseError: If Content-Length is invalid, or both it and
+            Transfer-Encoding are present
+    """
+    status = head.status_code
+    if request_method == "HEAD" or 100 <= status < 200 or status in (204, 304):
+        return FRAMING_NONE, 0
+
+    codings = transfer_codings(head)
+    _chunked_with_length(head, codings)
+    if codings:
+        return (FRAMING_CHUNKED, 0) if codings[-1] == "chunked" else (FRAMING_CLOSE, 0)
+
+    length = _content_length(head)
+    if length is not None:
+        return FRAMING_LENGTH, length
+
+    return FRAMING_CLOSE, 0
+
+
+async def _timed(awaitable, timeout: float | None):
+    """Await with an optional timeout."""
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
+async def copy_body(
+    reader: StreamReader,
+    writer: StreamWriter,
+    framing: str,
+    length: int = 0,
+    read_timeout: float | None = None,
+) -> int:
+    """
+    Copy a message body from reader to writer, honouring its framing.
+
+    The body is streamed in chunks of at most CHUNK_SIZE bytes, draining
+    the writer after each one, so memory use does not depend on the body
+    size. Chunked bodies are forwarded as-is (chunk headers and trailers
+    included). read_timeout bounds each read, not the whole copy.
+    Returns the number of bytes written.
+
+    Raises:
+        TruncatedBodyError: If the body is truncated
+        asyncio.TimeoutError: If a read takes longer than read_timeout
+        HttpParseError: If the chunked encoding is malformed
+    """
+    if framing == FRAMING_NONE:
+        return 0
+    if framing == FRAMING_LENGTH:
+        return await _copy_exactly(reader, writer, length, read_timeout)
+    if framing == FRAMING_CHUNKED:
+        return await _copy_chunked(reader, writer, read_timeout)
+
+    total = 0
+    while True:
+        data = await _timed(reader.read(CHUNK_SIZE), read_timeout)
+        if not data:
+            return total
+        writer.write(data)
+        await writer.drain()
+        total += len(data)
+
+
+async def _copy_exactly(
+    reader: StreamReader,
+    writer: StreamWriter,
+    length: int,
+    read_timeout: float | None = None,
+    copied: int = 0,
+) -> int:
+    """Copy length bytes; copied is the body size written before them."""
+    remaining = length
+    while remaining > 0:
+        data = await _timed(reader.read(min(remaining, CHUNK_SIZE)), read_timeout)
+        if not data:
+            raise TruncatedBodyError(copied + length - remaining, copied + length)
+        writer.write(data)
+        await writer.drain()
+        remaining -= len(data)
+    return length
+
+
+async def _read_line(reader: StreamReader, read_timeout: float | None, copied: int) -> bytes:
+    """
+    Read a CRLF-terminated line of a chunked body.
+
+    Raises:
+        TruncatedBodyError: If the body ends first (copied bytes written)
+        HttpParseError: If the line is too long or holds a bare CR or LF
+    """
+    try:
+        line = await _timed(reader.readuntil(b"\r\n"), read_timeout)
+    except asyncio.IncompleteReadError:
+        raise TruncatedBodyError(copied)
+    except asyncio.LimitOverrunError:
+        raise HttpParseError("Chunked body line too long")
+    if b"\r" in line[:-2] or b"\n" in line[:-2]:
+        raise HttpParseError(f"Bare CR or LF in chunked body line: {line!r}")
+    return line
+
+
+def _chunk_size(size_line: bytes) -> int:
+    """
+    Parse a chunk size line (size, optional extensions, CRLF).
+
+    Only hex digits are accepted: int(..., 16) would also take "-1",
+    "0x5", "+5" or "1_0", and the line is forwarded as-is, so the next
+    hop could frame the body differently (request smuggling).
+
+    Raises:
+        HttpParseError: If the chunk size is invalid
+    """
+    digits, semicolon, _ = size_line[:-2].partition(b";")
+    if semicolon:
+        digits = digits.rstrip(b" \t")  # BWS before extensions
+    if not 0 < len(digits) <= MAX_CHUNK_SIZE_DIGITS or not _HEX_DIGITS.issuperset(digits):
+        raise HttpParseError(f"Invalid chunk size: {size_line!r}")
+    return int(digits, 16)
+
+
+async def _copy_chunked(
+    reader: StreamReader,
+    writer: StreamWriter,
+    read_timeout: float | None = None,
+) -> int:
+    total = 0
+    while True:
+        size_line = await _read_line(reader, read_timeout, total)
+        size = _chunk_size(size_line)
+        writer.write(size_line)
+        total += len(size_line)
+
+        if size == 0:
+            # Trailer section, terminated by an empty line
+            trailers = 0
+            while True:
+                line = await _read_line(reader, read_timeout, total)
+                trailers += len(line)
+                if trailers > MAX_HEAD_SIZE:
+                    raise HttpParseError(f"Chunked trailers larger than {MAX_HEAD_SIZE} bytes")
+                writer.write(line)
+                total += len(line)
+                if line == b"\r\n":
+                    await writer.drain()
+                    return total
+
+        # Chunk data, then exactly CRLF
+        total += await _copy_exactly(reader, writer, size, read_timeout, copied=total)
+        try:
+            end = await _timed(reader.readexactly(2), read_timeout)
+        except asyncio.IncompleteReadError:
+            raise TruncatedBodyError(total)
+        if end != b"\r\n":
+            raise HttpParseError(f"Chunk data not followed by CRLF: {end!r}")
+        writer.write(end)
+        total += 2
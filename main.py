@@ -5,13 +5,17 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import functools
 import logging
 import signal
 import sys
 from pathlib import Path
 
-from config import ConfigError, load_config
+from config import EVENT_LOOPS, ConfigError, load_config
+from metrics import MetricsServer
 from proxy_server import ProxyServer
+from reloader import ConfigReloader
+from workers import STATS_INTERVAL, Supervisor, reuse_port_supported
 
 
 def setup_logging(level: str, verbose: bool) -> None:
@@ -48,6 +52,20 @@ def parse_args() -> argparse.Namespace:
         help="Disable corporate proxy (direct to Webshare)",
     )
 
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=1,
+        help="Number of worker processes sharing the port with SO_REUSEPORT (default: 1)",
+    )
+
+    parser.add_argument(
+        "--event-loop",
+        choices=EVENT_LOOPS,
+        default=None,
+        help="Event loop implementation (default: server.event_loop from config)",
+    )
+
     parser.add_argument(
         "--verbose", "-v",
         action="store_true",
@@ -57,7 +75,30 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def print_config_summary(config, use_corporate: bool) -> None:
+def install_event_loop(name: str) -> str:
+    """
+    Install the requested event loop implementation.
+
+    "auto" uses uvloop when it is installed, "uvloop" falls back to asyncio
+    with a warning when it is not. Returns the name of the active loop.
+    """
+    if name == "asyncio":
+        return "asyncio"
+
+    try:
+        import uvloop
+    except ImportError:
+        if name == "uvloop":
+            logging.getLogger("mooltiroute").warning(
+                "uvloop is not installed (pip install uvloop), using asyncio event loop"
+            )
+        return "asyncio"
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+def print_config_summary(config, use_corporate: bool, event_loop: str) -> None:
     """Print configuration summary."""
     logger = logging.getLogger("mooltiroute")
 
@@ -65,12 +106,12 @@ def print_config_summary(config, use_corporate: bool) -> None:
     logger.info("Mooltiroute - Proxy Chain Server")
     logger.info("=" * 50)
     logger.info(f"Listen: {config.server.host}:{config.server.port}")
-    logger.info(f"Webshare: {config.webshare.host}:{config.webshare.port}")
-
-    if config.webshare.requires_auth:
-        logger.info(f"Webshare auth: {config.webshare.username}:****")
-    else:
-        logger.info("Webshare auth: none")
+    logger.info(f"Event loop: {event_loop}")
+    for webshare in config.webshares:
+        auth = f"{webshare.username}:****" if webshare.requires_auth else "none"
+        logger.info(f"Webshare: {webshare.host}:{webshare.port} (auth: {auth})")
+    if len(config.webshares) > 1:
+        logger.info(f"Webshare balancing: {config.balancer.strategy}")
 
     if use_corporate and config.corporate_proxy:
         logger.info(f"Corporate proxy: {config.corporate_proxy.host}:{config.corporate_proxy.port}")
@@ -78,38 +119,80 @@ def print_config_summary(config, use_corporate: bool) -> None:
             logger.info(f"Corporate auth: {config.corporate_proxy.username}:****")
         else:
             logger.info("Corporate auth: none")
+        if config.pool.enabled:
+            logger.info(
+                f"Upstream pool: {config.pool.min_size}-{config.pool.max_size} "
+                f"connections per webshare, idle TTL {config.pool.idle_ttl}s"
+            )
     else:
         logger.info("Corporate proxy: disabled")
 
     logger.info("=" * 50)
 
 
-async def main_async(args: argparse.Namespace) -> int:
-    """Async main entry point."""
-    logger = logging.getLogger("mooltiroute")
+def config_path(args: argparse.Namespace) -> Path:
+    """Absolute path of the configuration file given on the command line."""
+    path = Path(args.config)
+    if not path.is_absolute():
+        path = Path.cwd() / path
+    return path
 
-    # Load configuration
-    config_path = Path(args.config)
-    if not config_path.is_absolute():
-        config_path = Path.cwd() / config_path
+
+def load_app_config(args: argparse.Namespace):
+    """Load the configuration file given on the command line (None on error)."""
+    logger = logging.getLogger("mooltiroute")
 
     try:
-        config = load_config(str(config_path))
+        return load_config(str(config_path(args)))
     except ConfigError as e:
         logger.error(f"Configuration error: {e}")
-        return 1
+        return None
+
+
+def running_loop_name() -> str:
+    """Return the name of the running event loop implementation."""
+    loop = asyncio.get_running_loop()
+    return "uvloop" if type(loop).__module__.startswith("uvloop") else "asyncio"
+
+
+async def report_stats(server: ProxyServer, worker_id: int, stats_queue) -> None:
+    """Periodically send this worker's stats to the supervisor."""
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        try:
+            stats_queue.put_nowait((worker_id, server.stats()))
+        except Exception:
+            pass
 
-    # Setup logging with config level
-    setup_logging(config.logging.level, args.verbose)
+
+async def main_async(
+    args: argparse.Namespace,
+    config,
+    worker_id: int | None = None,
+    stats_queue=None,
+) -> int:
+    """
+    Async main entry point.
+
+    worker_id and stats_queue are set when running as a worker process
+    under the supervisor (--workers).
+    """
+    logger = logging.getLogger("mooltiroute")
 
     # Determine if we use corporate proxy
     use_corporate = not args.no_corporate
 
-    # Print configuration summary
-    print_config_summary(config, use_corporate)
+    # Print configuration summary (once, by the supervisor, in worker mode)
+    if worker_id is None:
+        print_config_summary(config, use_corporate, running_loop_name())
 
     # Create and start server
-    server = ProxyServer(config, use_corporate=use_corporate)
+    server = ProxyServer(
+        config,
+        use_corporate=use_corporate,
+        reuse_port=worker_id is not None,
+    )
+    reloader = ConfigReloader(server, str(config_path(args)))
 
     # Setup signal handlers for graceful shutdown
     shutdown_event = asyncio.Event()
@@ -132,16 +215,32 @@ async def main_async(args: argparse.Namespace) -> int:
         loop = asyncio.get_running_loop()
         for sig in (signal.SIGINT, signal.SIGTERM):
             loop.add_signal_handler(sig, handle_signal)
-        logger.debug("Signal handlers configured for Unix (SIGINT, SIGTERM)")
+        loop.add_signal_handler(signal.SIGHUP, reloader.request)
+        logger.debug("Signal handlers configured for Unix (SIGINT, SIGTERM, SIGHUP)")
+
+    # Start the metrics endpoint (one port per worker)
+    metrics_server = None
+    if config.metrics.enabled:
+        metrics_server = MetricsServer(config.metrics, config.metrics.port + (worker_id or 0))
+        await metrics_server.start()
 
     # Start server
     server_task = asyncio.create_task(server.start())
+    reloader.start()
+    stats_task = None
+    if stats_queue is not None:
+        stats_task = asyncio.create_task(report_stats(server, worker_id, stats_queue))
 
     # Wait for shutdown signal
     await shutdown_event.wait()
 
     # Stop server
+    if stats_task:
+        stats_task.cancel()
+    await reloader.close()
     await server.stop()
+    if metrics_server:
+        await metrics_server.stop()
     server_task.cancel()
 
     try:
@@ -152,6 +251,35 @@ async def main_async(args: argparse.Namespace) -> int:
     return 0
 
 
+def run_worker(args: argparse.Namespace, config, worker_id: int, stats_queue) -> None:
+    """Worker process entry point (--workers)."""
+    # A worker restarted after a reload starts with the current file
+    config = load_app_config(args) or config
+    try:
+        code = asyncio.run(
+            main_async(args, config, worker_id=worker_id, stats_queue=stats_queue)
+        )
+    except KeyboardInterrupt:
+        code = 0
+    sys.exit(code)
+
+
+def run_supervisor(args: argparse.Namespace, config, event_loop: str) -> int:
+    """Run args.workers worker processes under a supervisor."""
+    logger = logging.getLogger("mooltiroute")
+
+    if not reuse_port_supported():
+        logger.error("--workers requires SO_REUSEPORT support (Linux/macOS)")
+        return 1
+
+    print_config_summary(config, not args.no_corporate, event_loop)
+    logger.info(f"Workers: {args.workers} (SO_REUSEPORT)")
+
+    # Workers inherit the event loop policy installed before forking
+    supervisor = Supervisor(args.workers, functools.partial(run_worker, args, config))
+    return supervisor.run()
+
+
 def main() -> int:
     """Main entry point."""
     args = parse_args()
@@ -159,8 +287,22 @@ def main() -> int:
     # Initial logging setup (will be reconfigured after loading config)
     setup_logging("INFO", args.verbose)
 
+    # Load configuration
+    config = load_app_config(args)
+    if config is None:
+        return 1
+
+    # Setup logging with config level
+    setup_logging(config.logging.level, args.verbose)
+
+    # Select the event loop before any loop is created
+    event_loop = install_event_loop(args.event_loop or config.server.event_loop)
+
+    if args.workers > 1:
+        return run_supervisor(args, config, event_loop)
+
     try:
-        return asyncio.run(main_async(args))
+        return asyncio.run(main_async(args, config))
     except KeyboardInterrupt:
         return 0
 
@@ -0,0 +1,298 @@
+"""Prometheus metrics for Mooltiroute."""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import logging
+from asyncio import StreamReader, StreamWriter
+from bisect import bisect_left
+
+from config import MetricsConfig
+from http_parser import HttpParseError, read_request_head
+
+logger = logging.getLogger("mooltiroute.metrics")
+
+# Seconds; tunnel setup ranges from sub-millisecond (pooled leg) to the
+# 30 s CONNECT timeout
+SETUP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RELAY_BUCKETS = (0.1, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class GaugeChild(CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: int = 1) -> None:
+        self.value -= amount
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric(abc.ABC):
+    """A metric family; children are created once per label set and reused."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """
+        Return the child for these label values.
+
+        Bind children once (at import or setup time) and keep them for
+        hot paths, so recording a sample is a plain attribute update.
+        """
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Create the child for a new label set."""
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(_format_labels(self.labelnames, values), values, child))
+        return lines
+
+    def _render_child(self, labels: str, values: tuple[str, ...], child) -> list[str]:
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = SETUP_BUCKETS,
+    ):
+        self.buckets = buckets
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def _render_child(self, labels: str, values: tuple[str, ...], child) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(child.bounds + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.labelnames + ("le",), values + (le,))
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> bytes:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+
+# Metric families
+CONNECTIONS = Counter("mooltiroute_connections_total", "Client connections accepted")
+CONNECTIONS_ACTIVE = Gauge("mooltiroute_connections_active", "Client connections currently open")
+REQUESTS = Counter("mooltiroute_requests_total", "Client requests by kind", ("kind",))
+TUNNEL_SETUP = Histogram(
+    "mooltiroute_tunnel_setup_seconds",
+    "Tunnel setup latency per hop",
+    ("hop",),
+)
+UPSTREAM_RESPONSES = Counter(
+    "mooltiroute_upstream_responses_total",
+    "CONNECT response status codes per hop",
+    ("hop", "code"),
+)
+UPSTREAM_TIMEOUTS = Counter(
+    "mooltiroute_upstream_timeouts_total",
+    "Upstream timeouts per hop (attempt: a CONNECT attempt cut short by the retry policy)",
+    ("hop",),
+)
+RELAY_BYTES = Counter(
+    "mooltiroute_relay_bytes_total",
+    "Bytes relayed through CONNECT tunnels per direction",
+    ("direction",),
+)
+RELAY_DURATION = Histogram(
+    "mooltiroute_relay_duration_seconds",
+    "Lifetime of relayed CONNECT tunnels",
+    buckets=RELAY_BUCKETS,
+)
+RELAY_EXPIRED_TOTAL = Counter(
+    "mooltiroute_relay_expired_total",
+    "CONNECT tunnels closed by the idle timeout or the lifetime cap",
+    ("reason",),
+)
+HEDGES_TOTAL = Counter(
+    "mooltiroute_hedges_total",
+    "Hedged tunnel establishments by outcome",
+    ("outcome",),
+)
+HTTP_RESPONSES = Counter(
+    "mooltiroute_http_responses_total",
+    "Plain HTTP responses forwarded to clients by status code",
+    ("code",),
+)
+HTTP_RESPONSE_BYTES = Counter(
+    "mooltiroute_http_response_bytes_total",
+    "Plain HTTP response body bytes forwarded to clients",
+)
+HTTP_TRUNCATED = Counter(
+    "mooltiroute_http_truncated_total",
+    "Plain HTTP responses cut short by the upstream",
+)
+
+# Tunnel setup hops
+HOP_TCP = "tcp_connect"
+HOP_CORPORATE = "corporate_connect"
+HOP_WEBSHARE = "webshare_connect"
+# Timeouts only: retry.attempt_timeout or retry.deadline cut the attempt
+# short, usually before the hop's own CONNECT_TIMEOUT can fire
+HOP_ATTEMPT = "attempt"
+
+# Pre-bound children for the hot paths
+CONNECTIONS_TOTAL = CONNECTIONS.labels()
+ACTIVE = CONNECTIONS_ACTIVE.labels()
+REQUESTS_CONNECT = REQUESTS.labels("connect")
+REQUESTS_HTTP = REQUESTS.labels("http")
+SETUP = {hop: TUNNEL_SETUP.labels(hop) for hop in (HOP_TCP, HOP_CORPORATE, HOP_WEBSHARE)}
+TIMEOUTS = {
+    hop: UPSTREAM_TIMEOUTS.labels(hop)
+    for hop in (HOP_TCP, HOP_CORPORATE, HOP_WEBSHARE, HOP_ATTEMPT)
+}
+BYTES_UPSTREAM = RELAY_BYTES.labels("client_to_upstream")
+BYTES_DOWNSTREAM = RELAY_BYTES.labels("upstream_to_client")
+RELAY_SECONDS = RELAY_DURATION.labels()
+RELAY_EXPIRED = {reason: RELAY_EXPIRED_TOTAL.labels(reason) for reason in ("idle", "lifetime")}
+HEDGES = {
+    outcome: HEDGES_TOTAL.labels(outcome)
+    for outcome in ("primary_won", "hedge_won", "both_failed")
+}
+RESPONSE_BYTES = HTTP_RESPONSE_BYTES.labels()
+TRUNCATED = HTTP_TRUNCATED.labels()
+
+_status_children: dict[tuple[str, int], CounterChild] = {}
+_http_status_children: dict[int, CounterChild] = {}
+
+
+def record_status(hop: str, code: int) -> None:
+    """Count an upstream CONNECT response status."""
+    child = _status_children.get((hop, code))
+    if child is None:
+        child = _status_children[(hop, code)] = UPSTREAM_RESPONSES.labels(hop, code)
+    child.inc()
+
+
+def record_http_response(code: int, body_bytes: int) -> None:
+    """Count a plain HTTP response forwarded to a client."""
+    child = _http_status_children.get(code)
+    if child is None:
+        child = _http_status_children[code] = HTTP_RESPONSES.labels(code)
+    child.inc()
+    RESPONSE_BYTES.inc(body_bytes)
+
+
+class MetricsServer:
+    """Serve /metrics on a separate local port."""
+
+    def __init__(self, config: MetricsConfig, port: int | None = None):
+        self.config = config
+        self.port = port if port is not None else config.port
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle,
+            self.config.host,
+            self.port,
+        )
+        logger.info(f"Metrics on http://{self.config.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        try:
+            head = await asyncio.wait_for(read_request_head(reader), timeout=10)
+            if head.target.split("?", 1)[0] == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", render()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"Not Found"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, HttpParseError, OSError):
+            pass
+        finally:
+            writer.close()
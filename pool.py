@@ -0,0 +1,285 @@
+"""Pre-warmed upstream connection pool for Mooltiroute."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from asyncio import StreamReader, StreamWriter
+from collections import deque
+
+import tracing
+from config import PoolConfig, ProxyConfig
+from connector import Connector
+from tunnel import TunnelError, open_webshare_leg
+
+logger = logging.getLogger("mooltiroute.pool")
+
+
+class _IdleConnection:
+    """An established upstream connection waiting to be used."""
+
+    __slots__ = ("reader", "writer", "idle_since")
+
+    def __init__(self, reader: StreamReader, writer: StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.idle_since = time.monotonic()
+
+    def is_alive(self) -> bool:
+        """Passive liveness probe: neither side may have closed the leg."""
+        if self.writer.is_closing() or self.reader.at_eof():
+            return False
+        return self.reader.exception() is None
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class UpstreamPool:
+    """
+    Pool of idle corporate -> webshare tunnels.
+
+    Each pooled connection has already paid the TCP handshake to the
+    corporate proxy and the CONNECT round trip to webshare, so a client
+    CONNECT only needs the final target CONNECT. Connections are single
+    use: once a target CONNECT has been sent the leg belongs to the client.
+
+    The number of idle connections kept warm starts at min_size, grows by
+    one on each miss and shrinks back when idle connections expire unused,
+    never exceeding max_size.
+    """
+
+    def __init__(
+        self,
+        corporate: ProxyConfig,
+        webshare: ProxyConfig,
+        config: PoolConfig,
+        connector: Connector | None = None,
+    ):
+        self.corporate = corporate
+        self.webshare = webshare
+        self.config = config
+        self.connector = connector
+        self._idle: deque[_IdleConnection] = deque()
+        self._target = config.min_size
+        self._opening = 0
+        self._maintain_task: asyncio.Task | None = None
+        self._refill_tasks: set[asyncio.Task] = set()
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.opened = 0
+        self.expired = 0
+        self.dead = 0
+        self.open_failures = 0
+
+    async def start(self) -> None:
+        """Warm up the pool and start the maintenance task."""
+        self._closed = False
+        self._refill()
+        self._maintain_task = asyncio.create_task(self._maintain())
+        logger.info(
+            f"Upstream pool started (min={self.config.min_size}, "
+            f"max={self.config.max_size}, idle_ttl={self.config.idle_ttl}s)"
+        )
+
+    async def close(self) -> None:
+        """Stop maintenance and close every idle connection."""
+        self._closed = True
+        tasks = list(self._refill_tasks)
+        if self._maintain_task:
+            tasks.append(self._maintain_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._maintain_task = None
+
+        while self._idle:
+            self._idle.popleft().close()
+
+        logger.info(f"Upstream pool closed: {self.stats()}")
+
+    def acquire(self) -> tuple[StreamReader, StreamWriter] | None:
+        """
+        Take a warm corporate -> webshare leg from the pool.
+
+        Returns None on a miss; the caller then opens its own leg.
+        """
+        now = time.monotonic()
+        while self._idle:
+            conn = self._idle.pop()  # most recently opened first
+            if now - conn.idle_since > self.config.idle_ttl:
+                self.expired += 1
+                conn.close()
+                continue
+            if not conn.is_alive():
+                self.dead += 1
+                conn.close()
+                continue
+            self.hits += 1
+            self._refill()
+            return conn.reader, conn.writer
+
+        self.misses += 1
+        if self._target < self.config.max_size:
+            self._target += 1
+        self._refill()
+        return None
+
+    def stats(self) -> dict:
+        """Return pool counters, for sizing the pool under load."""
+        lookups = self.hits + self.misses
+        return {
+            "idle": len(self._idle),
+            "opening": self._opening,
+            "target": self._target,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "opened": self.opened,
+            "expired": self.expired,
+            "dead": self.dead,
+            "open_failures": self.open_failures,
+        }
+
+    def _refill(self) -> None:
+        """Schedule new connections until the idle target is reached."""
+        if self._closed:
+            return
+        missing = self._target - len(self._idle) - self._opening
+        for _ in range(max(0, missing)):
+            self._opening += 1
+            task = asyncio.create_task(self._open_one())
+            self._refill_tasks.add(task)
+            task.add_done_callback(self._refill_tasks.discard)
+
+    async def _open_one(self) -> None:
+        # Tasks copy the context of the client task that triggered the
+        # refill: its trace must not get this connection's marks
+        tracing.activate(None)
+        try:
+            reader, writer = await open_webshare_leg(
+                self.corporate,
+                self.webshare,
+                self.connector,
+            )
+        except (TunnelError, OSError) as e:
+            self.open_failures += 1
+            logger.debug(f"Pool failed to open upstream connection: {e}")
+            return
+        finally:
+            self._opening -= 1
+
+        if self._closed or len(self._idle) >= self.config.max_size:
+            writer.close()
+            return
+
+        self.opened += 1
+        self._idle.append(_IdleConnection(reader, writer))
+
+    async def _maintain(self) -> None:
+        """Periodically drop expired or dead connections and top up."""
+        tracing.activate(None)
+        while True:
+            await asyncio.sleep(self.config.probe_interval)
+
+            now = time.monotonic()
+            alive: deque[_IdleConnection] = deque()
+            expired = 0
+            for conn in self._idle:
+                if now - conn.idle_since > self.config.idle_ttl:
+                    expired += 1
+                    conn.close()
+                elif not conn.is_alive():
+                    self.dead += 1
+                    conn.close()
+                else:
+                    alive.append(conn)
+            self._idle = alive
+            self.expired += expired
+
+            # Connections expiring unused means we keep too many warm
+            if expired and self._target > self.config.min_size:
+                self._target = max(self.config.min_size, self._target - expired)
+
+            self._refill()
+            logger.debug(f"Pool stats: {self.stats()}")
+
+
+class KeepAlivePool:
+    """
+    Idle keep-alive connections to the plain-HTTP upstream proxies.
+
+    Connections are keyed by upstream (host, port) and handed back with
+    release() once a response has been fully read, so they can carry the
+    next absolute-URI request.
+    """
+
+    def __init__(self, max_idle_per_upstream: int, idle_ttl: float):
+        self.max_idle_per_upstream = max_idle_per_upstream
+        self.idle_ttl = idle_ttl
+        self._idle: dict[tuple[str, int], deque[_IdleConnection]] = {}
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.released = 0
+
+    def acquire(self, key: tuple[str, int]) -> tuple[StreamReader, StreamWriter] | None:
+        """Take an idle connection to the upstream, or None on a miss."""
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            conn = idle.pop()
+            if now - conn.idle_since > self.idle_ttl or not conn.is_alive():
+                conn.close()
+                continue
+            self.hits += 1
+            return conn.reader, conn.writer
+
+        self.misses += 1
+        return None
+
+    def release(
+        self,
+        key: tuple[str, int],
+        reader: StreamReader,
+        writer: StreamWriter,
+    ) -> None:
+        """Return a connection whose last response was fully read."""
+        if self._closed:
+            writer.close()
+            return
+        idle = self._idle.setdefault(key, deque())
+        now = time.monotonic()
+        while idle and now - idle[0].idle_since > self.idle_ttl:
+            idle.popleft().close()
+
+        if len(idle) >= self.max_idle_per_upstream:
+            writer.close()
+            return
+
+        self.released += 1
+        idle.append(_IdleConnection(reader, writer))
+
+    def close(self) -> None:
+        """Close every idle connection, and those released from now on."""
+        self._closed = True
+        for idle in self._idle.values():
+            while idle:
+                idle.popleft().close()
+        self._idle.clear()
+
+    def stats(self) -> dict:
+        """Return keep-alive reuse counters."""
+        return {
+            "idle": sum(len(idle) for idle in self._idle.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "released": self.released,
+        }
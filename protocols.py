@@ -0,0 +1,388 @@
+"""asyncio.Protocol fast path for the Mooltiroute listener and tunnel relay."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from asyncio import StreamReader, StreamWriter
+from typing import TYPE_CHECKING, Callable
+
+import metrics
+import tracing
+from admission import AdmissionError
+from http_parser import (
+    CONNECT_ESTABLISHED,
+    MAX_HEAD_SIZE,
+    HttpParseError,
+    RequestHead,
+    error_response,
+    parse_connect_target,
+    parse_request_head,
+)
+from relay import RelayDeadline, set_write_limits, take_buffered
+from tunnel import TunnelError
+
+if TYPE_CHECKING:
+    from proxy_server import ProxyServer
+
+logger = logging.getLogger("mooltiroute.protocols")
+
+
+class RelayProtocol(asyncio.Protocol):
+    """
+    One side of a tunnel relayed directly between two transports.
+
+    Data received on this side is written to the peer transport. Flow
+    control is coupled: when this side's write buffer fills up
+    (pause_writing), reading from the peer is paused until it drains.
+    An EOF is passed on to the peer as a half-close; the tunnel closes
+    once both sides sent theirs.
+    """
+
+    def __init__(
+        self,
+        peer: asyncio.Transport,
+        relayed: metrics.CounterChild,
+        deadline: RelayDeadline,
+        stream_writer: StreamWriter | None = None,
+        on_close: Callable[[], None] | None = None,
+        trace: tracing.Trace | None = None,
+        first_byte: str = "",
+    ):
+        self.peer = peer
+        self.relayed = relayed
+        self.deadline = deadline
+        self.partner: RelayProtocol | None = None  # the protocol of the peer transport
+        self.eof = False
+        # Cleared once the first chunk is marked on the connection trace
+        self._trace = trace
+        self._first_byte = first_byte
+        self.transport: asyncio.Transport | None = None
+        # The StreamWriter that used to own this transport closes it when
+        # garbage collected, so it must live as long as the relay.
+        self._stream_writer = stream_writer
+        self._on_close = on_close
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def data_received(self, data: bytes) -> None:
+        self.peer.write(data)
+        self.relayed.inc(len(data))
+        self.deadline.touch()
+        if self._trace is not None:
+            self._trace.mark_first(self._first_byte)
+            self._trace = None
+
+    def eof_received(self) -> bool:
+        self.eof = True
+        if self.partner.eof or not self.peer.can_write_eof():
+            self.peer.close()
+            return False
+        self.peer.write_eof()
+        return True  # keep this side open: the peer may still be sending
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.deadline.cancel()
+        self.peer.close()
+        if self._on_close is not None:
+            self._on_close()
+
+    def pause_writing(self) -> None:
+        self.peer.pause_reading()
+
+    def resume_writing(self) -> None:
+        if not self.peer.is_closing():
+            self.peer.resume_reading()
+
+
+async def couple_transports(
+    client: asyncio.Transport,
+    client_pending: bytes,
+    remote_reader: StreamReader,
+    remote_writer: StreamWriter,
+    on_client_close: Callable[[], None] | None = None,
+    trace: tracing.Trace | None = None,
+    idle_timeout: float = 0,
+    max_lifetime: float = 0,
+) -> None:
+    """
+    Relay client <-> remote with RelayProtocol on both transports.
+
+    client_pending holds client bytes received after the CONNECT head;
+    bytes already buffered by remote_reader are forwarded to the client.
+    on_client_close is called once the client connection is lost. The
+    first byte in each direction is marked on trace. Both transports are
+    aborted after idle_timeout seconds without data or max_lifetime
+    seconds in total (0 disables either).
+    """
+    remote = remote_writer.transport
+    remote_pending = await take_buffered(remote_reader)
+
+    def expire() -> None:
+        client.abort()
+        remote.abort()
+
+    deadline = RelayDeadline(idle_timeout, max_lifetime, expire)
+    client_side = RelayProtocol(
+        remote,
+        metrics.BYTES_UPSTREAM,
+        deadline,
+        on_close=on_client_close,
+        trace=trace,
+        first_byte=tracing.FIRST_BYTE_UPSTREAM,
+    )
+    remote_side = RelayProtocol(
+        client,
+        metrics.BYTES_DOWNSTREAM,
+        deadline,
+        stream_writer=remote_writer,
+        trace=trace,
+        first_byte=tracing.FIRST_BYTE_DOWNSTREAM,
+    )
+    client_side.partner = remote_side
+    remote_side.partner = client_side
+    set_write_limits(client)
+    set_write_limits(remote)
+    client.set_protocol(client_side)
+    client_side.connection_made(client)
+    remote.set_protocol(remote_side)
+    remote_side.connection_made(remote)
+
+    if client_pending:
+        remote.write(client_pending)
+        metrics.BYTES_UPSTREAM.inc(len(client_pending))
+        if trace is not None:
+            trace.mark_first(tracing.FIRST_BYTE_UPSTREAM)
+    if remote_pending:
+        client.write(remote_pending)
+        metrics.BYTES_DOWNSTREAM.inc(len(remote_pending))
+        if trace is not None:
+            trace.mark_first(tracing.FIRST_BYTE_DOWNSTREAM)
+
+    # The remote stream may be closed already, or paused by its reader
+    # limit. Pausing and resuming makes the transport read the socket
+    # again, so an EOF received before coupling reaches remote_side.
+    if remote.is_closing():
+        client.close()
+        remote.close()
+        return
+    remote.pause_reading()
+    remote.resume_reading()
+    client.resume_reading()
+
+
+class ClientProtocol(asyncio.Protocol):
+    """
+    Listener protocol: reads the first request head of a connection.
+
+    CONNECT requests are tunneled with RelayProtocol, without any stream
+    wrappers. Other requests are handed over to the stream-based
+    ProxyServer.handle_client, which serves them exactly as in stream mode.
+    """
+
+    def __init__(self, server: ProxyServer, read_timeout: float):
+        self.server = server
+        self.read_timeout = read_timeout
+        self.transport: asyncio.Transport | None = None
+        self._buffer = bytearray()
+        self._timer: asyncio.TimerHandle | None = None
+        self._task: asyncio.Task | None = None
+        self._admission: asyncio.Task | None = None
+        self._handed_over = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+        self.server.client_connected(transport)
+        self._client_addr = transport.get_extra_info("peername")
+        self._trace = self.server.tracer.start(self._client_addr)
+        logger.debug(f"New connection from {self._client_addr}")
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(self.read_timeout, self._on_timeout)
+        # Admitted on accept, while the request head is still on its way
+        self._admission = self.server.track_task(loop.create_task(self.server.admission.admit(self._client_addr[0])))
+        self._admission.add_done_callback(self._on_admission)
+
+    def data_received(self, data: bytes) -> None:
+        search_from = max(0, len(self._buffer) - 3)
+        self._buffer += data
+
+        line_end = self._buffer.find(b"\n")
+        if line_end < 0:
+            if len(self._buffer) > MAX_HEAD_SIZE:
+                self._fail(431, "Request Header Fields Too Large")
+            return
+
+        if not self._buffer[:line_end].upper().startswith(b"CONNECT "):
+            self._handoff_to_streams()
+            return
+
+        head_end = self._buffer.find(b"\r\n\r\n", search_from)
+        if head_end < 0:
+            if len(self._buffer) > MAX_HEAD_SIZE:
+                self._fail(431, "Request Header Fields Too Large")
+            return
+
+        self._cancel_timer()
+        self.transport.pause_reading()
+        raw = bytes(self._buffer[:head_end + 4])
+        pending = bytes(self._buffer[head_end + 4:])
+        self._buffer.clear()
+
+        try:
+            head = parse_request_head(raw)
+        except HttpParseError:
+            self._fail(400, "Bad Request")
+            return
+
+        if self._trace is not None:
+            self._trace.mark("head_parsed")
+            self._trace.target = f"CONNECT {head.target}"
+        metrics.REQUESTS_CONNECT.inc()
+        self._task = self.server.track_task(asyncio.create_task(self._connect(head, pending)))
+
+    def eof_received(self) -> bool:
+        self._cancel_timer()
+        if self._task is None:
+            self.transport.close()
+        return False
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._cancel_timer()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if not self._handed_over:
+            if not self._admission.done():
+                self._admission.cancel()
+            elif self._admitted():
+                self.server.admission.leave(self._client_addr[0])
+            self.server.client_disconnected(self.transport)
+            self.server.tracer.finish(self._trace)
+
+    async def _connect(self, head: RequestHead, pending: bytes) -> None:
+        """Open the tunnel, answer the client and couple the transports."""
+        tracing.activate(self._trace)
+        address = parse_connect_target(head.target)
+        if address is None:
+            self._fail(400, "Invalid port")
+            return
+        host, port = address
+
+        try:
+            await self._admission
+        except AdmissionError as e:
+            self._fail(e.status_code, e.message)
+            return
+        session = self.server.sessions.lookup(head, self._client_addr[0])
+
+        logger.info(f"CONNECT {host}:{port}")
+
+        optimistic = self.server.config.tunnel.optimistic
+        if optimistic:
+            # Reading stays paused: the client's first bytes wait in the
+            # socket until the transports are coupled
+            self.transport.write(CONNECT_ESTABLISHED)
+            tracing.mark("optimistic_200_sent")
+
+        try:
+            remote_reader, remote_writer, upstream = await self.server.open_tunnel(host, port, session)
+        except TunnelError as e:
+            logger.error(f"CONNECT {host}:{port} -> {e.status_code} {e.message}")
+            if optimistic:
+                self.transport.close()
+            else:
+                self._fail(e.status_code, e.message)
+            return
+        except Exception as e:
+            logger.error(f"Error handling client {self._client_addr}: {e}")
+            self.transport.close()
+            return
+
+        if self.transport.is_closing():
+            remote_writer.close()
+            self.server.balancer.release(upstream)
+            return
+
+        relay_started = time.monotonic()
+
+        def on_client_close() -> None:
+            metrics.RELAY_SECONDS.observe(time.monotonic() - relay_started)
+            self.server.balancer.release(upstream)
+            self.server.admission.leave(self._client_addr[0])
+            self.server.client_disconnected(self.transport)
+            self.server.tracer.finish(self._trace)
+
+        if optimistic:
+            tracing.mark("tunnel_ready")
+        else:
+            self.transport.write(CONNECT_ESTABLISHED)
+            tracing.mark("connect_200_sent")
+        logger.info(f"CONNECT {host}:{port} -> 200")
+        logger.debug("Starting bidirectional relay (protocol)")
+        self._handed_over = True
+        await couple_transports(
+            self.transport,
+            pending,
+            remote_reader,
+            remote_writer,
+            on_client_close=on_client_close,
+            trace=self._trace,
+            idle_timeout=self.server.config.relay.idle_timeout,
+            max_lifetime=self.server.config.relay.max_lifetime,
+        )
+
+    def _admitted(self) -> bool:
+        admission = self._admission
+        return admission.done() and not admission.cancelled() and admission.exception() is None
+
+    def _on_admission(self, admission: asyncio.Task) -> None:
+        # Refused before the request head arrived: no need to wait for it
+        if self._task is None and not self._handed_over and not admission.cancelled():
+            e = admission.exception()
+            if isinstance(e, AdmissionError) and not self.transport.is_closing():
+                self._fail(e.status_code, e.message)
+
+    def _handoff_to_streams(self) -> None:
+        """Serve this connection with the stream-based handler."""
+        self._cancel_timer()
+        loop = asyncio.get_running_loop()
+        transport = self.transport
+
+        reader = StreamReader()
+        reader.feed_data(bytes(self._buffer))
+        self._buffer.clear()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        transport.set_protocol(protocol)
+        protocol.connection_made(transport)
+        writer = StreamWriter(transport, protocol, reader, loop)
+
+        self._handed_over = True
+        self._task = self.server.track_task(loop.create_task(self._serve_streams(reader, writer)))
+        self._task.add_done_callback(lambda _: self.server.client_disconnected(transport))
+
+    async def _serve_streams(self, reader: StreamReader, writer: StreamWriter) -> None:
+        tracing.activate(self._trace)
+        try:
+            await self.server.serve_admitted(
+                self._client_addr[0],
+                reader,
+                writer,
+                admission=self._admission,
+            )
+        finally:
+            self.server.tracer.finish(self._trace)
+
+    def _on_timeout(self) -> None:
+        logger.warning(f"Timeout reading request from {self._client_addr}")
+        self.transport.close()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _fail(self, status_code: int, message: str) -> None:
+        self._cancel_timer()
+        self.transport.write(error_response(status_code, message))
+        self.transport.close()
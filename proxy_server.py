@@ -4,14 +4,54 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
 from asyncio import StreamReader, StreamWriter
+from dataclasses import fields, replace
+from typing import Awaitable
 from urllib.parse import urlparse
 
-from config import Config
+import metrics
+import tracing
+from admission import Admission, AdmissionError
+from balancer import Balancer, Upstream
+from config import Config, ProxyConfig
+from connector import Connector
+from hedging import HedgePolicy
+from health import CircuitBreaker, HealthChecker
+from http_parser import (
+    CONNECT_ESTABLISHED,
+    FRAMING_CHUNKED,
+    FRAMING_CLOSE,
+    FRAMING_LENGTH,
+    FRAMING_NONE,
+    HeadTooLargeError,
+    HttpParseError,
+    RequestHead,
+    TruncatedBodyError,
+    copy_body,
+    error_response,
+    parse_connect_target,
+    read_request_head,
+    read_response_head,
+    request_framing,
+    response_framing,
+)
+from pool import KeepAlivePool, UpstreamPool
+from protocols import ClientProtocol
+from relay import resolve_engine
+from resolver import Resolver
+from retry import RetryPolicy
+from sessions import Session, Sessions
 from tunnel import (
+    CorporateProxyError,
+    CorporateRefusedError,
+    ProxyRefusedError,
     TunnelError,
+    UpstreamClosedError,
+    UpstreamUnavailableError,
     create_chained_tunnel,
     create_tunnel,
+    open_webshare_leg,
     relay_data,
 )
 
@@ -19,113 +59,401 @@ logger = logging.getLogger("mooltiroute.proxy_server")
 
 READ_TIMEOUT = 30  # seconds
 
+# Client request headers not forwarded with a plain HTTP request
+NOT_FORWARDED = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "proxy-connection",
+    "host", "content-length",
+})
+KEEP_ALIVE_END = b"Connection: keep-alive\r\n\r\n"
+CLOSE_END = b"Connection: close\r\n\r\n"
+
+# Configuration sections a reload cannot apply to a running server
+RESTART_SECTIONS = ("server", "metrics", "logging")
+
 
 class ProxyServer:
     """HTTP/HTTPS proxy server."""
 
-    def __init__(self, config: Config, use_corporate: bool = True):
+    def __init__(
+        self,
+        config: Config,
+        use_corporate: bool = True,
+        reuse_port: bool = False,
+    ):
         self.config = config
+        self._corporate_requested = use_corporate
         self.use_corporate = use_corporate and config.corporate_proxy is not None
+        self.reuse_port = reuse_port
+        self.relay_engine = resolve_engine(config.relay.engine)
+        self.resolver = Resolver(config.dns)
+        self.connector = Connector(config.connect, self.resolver)
+        self.balancer = Balancer(config.webshares, config.balancer, config.health)
+        self.retry_policy = RetryPolicy(config.retry)
+        self.hedge_policy = HedgePolicy(config.hedge)
+        self.sessions = Sessions(config.sessions)
+        # Request header carrying the session key, not forwarded upstream
+        self._session_header = (
+            config.sessions.header
+            if config.sessions.enabled and config.sessions.key == "header"
+            else None
+        )
+        self.admission = Admission(config.admission)
+        self.tracer = tracing.Tracer(config.tracing)
+        self.corporate_breaker: CircuitBreaker | None = None
+        if self.use_corporate:
+            self.corporate_breaker = CircuitBreaker("corporate proxy", config.health)
+        self._health = self._make_health_checker(config)
         self._server: asyncio.Server | None = None
+        self._pools = self._make_pools(config)
+        self._http_pool = KeepAlivePool(
+            config.http.upstream_max_idle,
+            config.http.upstream_idle_ttl,
+        )
+
+        # Open client connections and the tasks serving them, ended by stop()
+        self._clients: set[asyncio.BaseTransport] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._stopping = False
+
+        self.connections_total = 0
+        self.connections_active = 0
+        self.tunnels_opened = 0
+        self.tunnel_failures = 0
+        self.http_requests = 0
+        self.http_failures = 0
+        self.http_truncated = 0
+        self.http_response_bytes = 0
+
+    def stats(self) -> dict:
+        """Return server counters (plus pool counters when pools are used)."""
+        stats = {
+            "connections_total": self.connections_total,
+            "connections_active": self.connections_active,
+            "tunnels_opened": self.tunnels_opened,
+            "tunnel_failures": self.tunnel_failures,
+            "http_requests": self.http_requests,
+            "http_failures": self.http_failures,
+            "http_truncated": self.http_truncated,
+            "http_response_bytes": self.http_response_bytes,
+            "http_keepalive": self._http_pool.stats(),
+            "dns": self.resolver.stats(),
+            "upstreams": self.balancer.stats(),
+            "retry": self.retry_policy.stats(),
+            "hedge": self.hedge_policy.stats(),
+            "sessions": self.sessions.stats(),
+            "admission": self.admission.stats(),
+            "traces_logged": self.tracer.logged,
+        }
+        if self.corporate_breaker:
+            stats["corporate_circuit"] = self.corporate_breaker.state
+        if self._health:
+            stats["health"] = {
+                "probes": self._health.probes,
+                "probe_failures": self._health.probe_failures,
+            }
+        if self._pools:
+            stats["pool"] = {
+                f"{host}:{port}": pool.stats()
+                for (host, port), pool in self._pools.items()
+            }
+        return stats
+
+    def _make_health_checker(self, config: Config) -> HealthChecker | None:
+        """Background probes of the current upstreams (None when disabled)."""
+        if not config.health.enabled:
+            return None
+        return HealthChecker(
+            config.health,
+            self.balancer.upstreams,
+            config.corporate_proxy if self.use_corporate else None,
+            self.corporate_breaker,
+            self.connector,
+        )
+
+    def _make_pools(self, config: Config) -> dict[tuple[str, int], UpstreamPool]:
+        """One pool of warm corporate -> webshare legs per webshare upstream."""
+        if not (self.use_corporate and config.pool.enabled):
+            return {}
+        return {
+            webshare.address: UpstreamPool(
+                config.corporate_proxy,
+                webshare,
+                config.pool,
+                self.connector,
+            )
+            for webshare in config.webshares
+        }
+
+    async def reconfigure(self, config: Config) -> None:
+        """
+        Serve new connections and requests with config.
+
+        Established tunnels and requests in progress keep the upstream
+        connections they have. Idle pooled connections, made with the old
+        settings, are closed and the pools refilled with the new ones;
+        upstreams whose settings did not change keep their latency
+        measurements and circuit breakers. The server (listener),
+        metrics and logging sections only take effect on restart.
+        """
+        old = self.config
+        for section in RESTART_SECTIONS:
+            if getattr(config, section) != getattr(old, section):
+                logger.warning(f"Configuration section '{section}' changed: restart to apply it")
+        config = replace(config, **{section: getattr(old, section) for section in RESTART_SECTIONS})
+        changed = [f.name for f in fields(Config) if getattr(config, f.name) != getattr(old, f.name)]
+
+        old_health = self._health
+        old_pools = self._pools
+        old_http_pool = self._http_pool
+
+        # Everything below runs without yielding to the event loop: new
+        # connections see either the old settings or the new ones
+        self.config = config
+        self.use_corporate = self._corporate_requested and config.corporate_proxy is not None
+        self.relay_engine = resolve_engine(config.relay.engine)
+        self.resolver.config = config.dns
+        self.connector.config = config.connect
+        self.balancer = Balancer(
+            config.webshares,
+            config.balancer,
+            config.health,
+            previous=self.balancer,
+        )
+        if not self.use_corporate:
+            self.corporate_breaker = None
+        elif self.corporate_breaker is None or config.corporate_proxy != old.corporate_proxy:
+            self.corporate_breaker = CircuitBreaker("corporate proxy", config.health)
+        else:
+            self.corporate_breaker.config = config.health
+        self.retry_policy.config = config.retry
+        self.hedge_policy.config = config.hedge
+        self.sessions.reconfigure(config.sessions)
+        self._session_header = (
+            config.sessions.header
+            if config.sessions.enabled and config.sessions.key == "header"
+            else None
+        )
+        self.admission.reconfigure(config.admission)
+        self.tracer.config = config.tracing
+        self._health = self._make_health_checker(config)
+        self._pools = self._make_pools(config)
+        self._http_pool = KeepAlivePool(
+            config.http.upstream_max_idle,
+            config.http.upstream_idle_ttl,
+        )
+
+        logger.info(f"Configuration reloaded (changed: {', '.join(changed) or 'nothing'})")
+
+        # Drain what was set up with the old settings, then warm up
+        if old_health:
+            await old_health.close()
+        for pool in old_pools.values():
+            await pool.close()
+        old_http_pool.close()
+        await self.resolver.prepopulate(self._upstream_addresses())
+        for pool in self._pools.values():
+            await pool.start()
+        if self._health:
+            self._health.start()
+
+    def _upstream_addresses(self) -> list[tuple[str, int]]:
+        """Addresses this server connects to directly."""
+        if self.use_corporate:
+            return [self.config.corporate_proxy.address]
+        return [webshare.address for webshare in self.config.webshares]
+
+    def client_connected(self, transport: asyncio.BaseTransport) -> None:
+        """Account for a newly accepted client connection."""
+        self._clients.add(transport)
+        self.connections_total += 1
+        self.connections_active += 1
+        metrics.CONNECTIONS_TOTAL.inc()
+        metrics.ACTIVE.inc()
+
+    def client_disconnected(self, transport: asyncio.BaseTransport) -> None:
+        """Account for a closed client connection."""
+        self._clients.discard(transport)
+        self.connections_active -= 1
+        metrics.ACTIVE.dec()
 
     async def start(self) -> None:
         """Start the asyncio server."""
-        self._server = await asyncio.start_server(
-            self.handle_client,
-            self.config.server.host,
-            self.config.server.port,
-        )
+        await self.resolver.prepopulate(self._upstream_addresses())
+        for pool in self._pools.values():
+            await pool.start()
+        if self._health:
+            self._health.start()
+
+        if self.config.server.io_mode == "protocol":
+            loop = asyncio.get_running_loop()
+            self._server = await loop.create_server(
+                lambda: ClientProtocol(self, READ_TIMEOUT),
+                self.config.server.host,
+                self.config.server.port,
+                reuse_port=self.reuse_port,
+            )
+            relay = "protocol"
+        else:
+            self._server = await asyncio.start_server(
+                self._serve_client,
+                self.config.server.host,
+                self.config.server.port,
+                reuse_port=self.reuse_port,
+            )
+            relay = self.relay_engine
 
         mode = "with corporate proxy" if self.use_corporate else "direct to webshare"
         logger.info(
-            f"Started on {self.config.server.host}:{self.config.server.port} ({mode})"
+            f"Started on {self.config.server.host}:{self.config.server.port} "
+            f"({mode}, {relay} relay)"
         )
 
         async with self._server:
             await self._server.serve_forever()
 
+    def track_task(self, task: asyncio.Task) -> asyncio.Task:
+        """Keep a connection task referenced until it ends, for stop()."""
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
     async def stop(self) -> None:
-        """Stop the server."""
+        """Stop the server, closing client connections and their tunnels."""
+        self._stopping = True
         if self._server:
             self._server.close()
+        for transport in list(self._clients):
+            transport.abort()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._server:
             await self._server.wait_closed()
             logger.info("Server stopped")
+        if self._health:
+            await self._health.close()
+        for pool in self._pools.values():
+            await pool.close()
+        self._http_pool.close()
 
-    async def handle_client(
+    async def _serve_client(
         self,
         reader: StreamReader,
         writer: StreamWriter,
     ) -> None:
-        """Handle an incoming client connection."""
+        """start_server callback: handle_client with connection accounting."""
+        self.track_task(asyncio.current_task())
+        self.client_connected(writer.transport)
         client_addr = writer.get_extra_info("peername")
-        logger.debug(f"New connection from {client_addr}")
-
+        trace = self.tracer.start(client_addr)
+        tracing.activate(trace)
         try:
-            # Read the first line to determine request type
-            try:
-                request_line = await asyncio.wait_for(
-                    reader.readline(),
-                    timeout=READ_TIMEOUT,
-                )
-            except asyncio.TimeoutError:
-                logger.warning(f"Timeout reading request from {client_addr}")
-                return
-
-            if not request_line:
-                return
-
-            request_str = request_line.decode().strip()
-            if not request_str:
-                return
+            await self.serve_admitted(client_addr[0] if client_addr else "?", reader, writer)
+        except asyncio.CancelledError:
+            if not self._stopping:
+                raise
+            # Cancelled by stop(): ending normally spares asyncio's
+            # start_server callback a CancelledError of its own
+        finally:
+            self.client_disconnected(writer.transport)
+            self.tracer.finish(trace)
 
-            parts = request_str.split(" ")
-            if len(parts) < 3:
-                await self._send_error(writer, 400, "Bad Request")
-                return
+    async def serve_admitted(
+        self,
+        client_ip: str,
+        reader: StreamReader,
+        writer: StreamWriter,
+        admission: Awaitable[None] | None = None,
+    ) -> None:
+        """
+        Admit a new client connection, then serve it with handle_client.
+
+        Connections count against the admission limits from the moment
+        they are accepted, before their first request head arrives, so
+        idle or slow clients cannot hold more than their share of file
+        descriptors. admission is a pending admission.admit() already
+        started for this connection.
+        """
+        try:
+            await (admission or self.admission.admit(client_ip))
+        except AdmissionError as e:
+            await self._send_error(writer, e.status_code, e.message)
+            writer.close()
+            return
+        try:
+            await self.handle_client(reader, writer)
+        finally:
+            self.admission.leave(client_ip)
 
-            method = parts[0].upper()
-            target = parts[1]
+    async def handle_client(
+        self,
+        reader: StreamReader,
+        writer: StreamWriter,
+    ) -> None:
+        """Handle an incoming client connection, already admitted."""
+        client_addr = writer.get_extra_info("peername")
+        client_ip = client_addr[0] if client_addr else "?"
+        logger.debug(f"New connection from {client_addr}")
 
-            # Read headers
-            headers = {}
-            content_length = 0
+        try:
+            timeout = READ_TIMEOUT
             while True:
+                # Read the whole request head under a single deadline
                 try:
-                    header_line = await asyncio.wait_for(
-                        reader.readline(),
-                        timeout=READ_TIMEOUT,
+                    head = await asyncio.wait_for(
+                        read_request_head(reader),
+                        timeout=timeout,
                     )
                 except asyncio.TimeoutError:
-                    logger.warning(f"Timeout reading headers from {client_addr}")
+                    if timeout == READ_TIMEOUT:
+                        logger.warning(f"Timeout reading request from {client_addr}")
+                    return
+                except asyncio.IncompleteReadError:
+                    return
+                except HeadTooLargeError:
+                    await self._send_error(writer, 431, "Request Header Fields Too Large")
+                    return
+                except HttpParseError as e:
+                    logger.debug(f"Bad request from {client_addr}: {e}")
+                    await self._send_error(writer, 400, "Bad Request")
                     return
 
-                if header_line in (b"\r\n", b"\n", b""):
-                    break
+                tracing.mark("head_parsed")
+                tracing.set_target(f"{head.method} {head.target}")
+
+                try:
+                    framing, length = request_framing(head)
+                except HttpParseError:
+                    await self._send_error(writer, 400, "Bad Request")
+                    return
 
-                header_str = header_line.decode().strip()
-                if ":" in header_str:
-                    key, value = header_str.split(":", 1)
-                    headers[key.strip().lower()] = value.strip()
-                    if key.strip().lower() == "content-length":
-                        content_length = int(value.strip())
+                session = self.sessions.lookup(head, client_ip)
 
-            # Handle CONNECT for HTTPS
-            if method == "CONNECT":
-                await self.handle_connect(target, reader, writer)
-            else:
-                # Read body if present
-                body = b""
-                if content_length > 0:
-                    try:
-                        body = await asyncio.wait_for(
-                            reader.read(content_length),
-                            timeout=READ_TIMEOUT,
-                        )
-                    except asyncio.TimeoutError:
-                        logger.warning(f"Timeout reading body from {client_addr}")
-                        return
+                # Handle CONNECT for HTTPS
+                if head.method == "CONNECT":
+                    metrics.REQUESTS_CONNECT.inc()
+                    await self.handle_connect(head.target, reader, writer, session)
+                    return
 
-                await self.handle_http(method, target, headers, body, writer)
+                metrics.REQUESTS_HTTP.inc()
+                keep_alive = await self.handle_http(
+                    head.method,
+                    head.target,
+                    head.headers,
+                    reader,
+                    writer,
+                    body_framing=framing,
+                    body_length=length,
+                    client_keep_alive=self._client_keep_alive(head),
+                    session=session,
+                )
+                if not keep_alive:
+                    return
+
+                # Wait for the next request on this persistent connection
+                timeout = self.config.http.client_idle_timeout
 
         except Exception as e:
             logger.error(f"Error handling client {client_addr}: {e}")
@@ -136,64 +464,241 @@ class ProxyServer:
             except Exception:
                 pass
 
+    def _client_keep_alive(self, head: RequestHead) -> bool:
+        """Return True if the client asked for a persistent connection."""
+        if not self.config.http.keep_alive:
+            return False
+        connection = head.get("proxy-connection", head.get("connection", "")).lower()
+        if head.version == "HTTP/1.0":
+            return "keep-alive" in connection
+        return "close" not in connection
+
     async def handle_connect(
         self,
         target: str,
         client_reader: StreamReader,
         client_writer: StreamWriter,
+        session: Session | None = None,
     ) -> None:
         """Handle CONNECT request (HTTPS tunneling)."""
         # Parse target host:port
-        if ":" in target:
-            host, port_str = target.rsplit(":", 1)
-            try:
-                port = int(port_str)
-            except ValueError:
-                await self._send_error(client_writer, 400, "Invalid port")
-                return
-        else:
-            host = target
-            port = 443
+        address = parse_connect_target(target)
+        if address is None:
+            await self._send_error(client_writer, 400, "Invalid port")
+            return
+        host, port = address
 
         logger.info(f"CONNECT {host}:{port}")
 
+        optimistic = self.config.tunnel.optimistic
+        if optimistic:
+            # The client's first bytes wait in client_reader until the
+            # relay starts
+            client_writer.write(CONNECT_ESTABLISHED)
+            tracing.mark("optimistic_200_sent")
+
+        try:
+            remote_reader, remote_writer, upstream = await self.open_tunnel(host, port, session)
+        except TunnelError as e:
+            logger.error(f"CONNECT {host}:{port} -> {e.status_code} {e.message}")
+            if not optimistic:
+                await self._send_error(client_writer, e.status_code, e.message)
+            return
+
+        try:
+            if optimistic:
+                tracing.mark("tunnel_ready")
+            else:
+                # Send success response to client
+                client_writer.write(CONNECT_ESTABLISHED)
+                await client_writer.drain()
+                tracing.mark("connect_200_sent")
+
+            logger.info(f"CONNECT {host}:{port} -> 200")
+
+            # Relay data bidirectionally
+            await relay_data(
+                client_reader,
+                client_writer,
+                remote_reader,
+                remote_writer,
+                engine=self.relay_engine,
+                idle_timeout=self.config.relay.idle_timeout,
+                max_lifetime=self.config.relay.max_lifetime,
+            )
+        finally:
+            self.balancer.release(upstream)
+
+    async def open_tunnel(
+        self,
+        host: str,
+        port: int,
+        session: Session | None = None,
+    ) -> tuple[StreamReader, StreamWriter, Upstream]:
+        """
+        Open a tunnel to host:port through the configured proxy chain.
+
+        Failed attempts are retried according to the retry policy, each
+        on a freshly selected upstream, and slow ones hedged according to
+        the hedge policy. A sticky session keeps its webshare upstream and
+        exit. The whole establishment holds one of
+        admission.max_pending_connects slots. The caller must pass the
+        returned upstream to self.balancer.release() once the tunnel is
+        closed.
+
+        Raises:
+            TunnelError: If any hop refuses or fails on the last attempt,
+                or with a 503 when too many connects are pending
+        """
+        label = f"CONNECT {host}:{port}"
+        try:
+            async with self.admission.connecting():
+                tunnel = await self.retry_policy.run(
+                    lambda: self.hedge_policy.run(
+                        lambda: self._open_tunnel_once(host, port, session),
+                        self._discard_tunnel,
+                        label,
+                    ),
+                    label,
+                )
+        except AdmissionError as e:
+            self.tunnel_failures += 1
+            raise TunnelError(e.message, status_code=e.status_code)
+        except TunnelError:
+            self.tunnel_failures += 1
+            raise
+        self.tunnels_opened += 1
+        return tunnel
+
+    def _discard_tunnel(self, tunnel: tuple[StreamReader, StreamWriter, Upstream]) -> None:
+        """Close a tunnel that was established but is not used."""
+        _, writer, upstream = tunnel
+        writer.close()
+        self.balancer.release(upstream)
+
+    async def _open_tunnel_once(
+        self,
+        host: str,
+        port: int,
+        session: Session | None = None,
+    ) -> tuple[StreamReader, StreamWriter, Upstream]:
+        """
+        One tunnel establishment attempt.
+
+        The webshare upstream is chosen by the balancer and fed the time
+        taken to establish the tunnel; when circuit breakers leave no
+        usable upstream, fails at once with a 503.
+        """
+        if self.corporate_breaker and not self.corporate_breaker.available():
+            raise UpstreamUnavailableError("Corporate proxy unavailable")
+        upstream = self.balancer.select(session.upstream if session else None)
+        if upstream is None:
+            raise UpstreamUnavailableError("No webshare proxy available")
+        webshare = upstream.proxy
+        if session:
+            session.upstream = webshare.address
+            webshare = session.proxy(webshare)
+        if self.corporate_breaker:
+            self.corporate_breaker.begin()
+
+        started = time.monotonic()
         try:
             if self.use_corporate:
-                remote_reader, remote_writer = await create_chained_tunnel(
+                reader, writer = await self._create_chained_tunnel(host, port, webshare)
+            else:
+                reader, writer = await create_tunnel(
                     host,
                     port,
-                    self.config.corporate_proxy,
-                    self.config.webshare,
+                    webshare,
+                    connector=self.connector,
                 )
-            else:
-                remote_reader, remote_writer = await create_tunnel(
+        except CorporateProxyError:
+            # Webshare was never reached: it is not to blame
+            self.corporate_breaker.record_failure()
+            self.balancer.release(upstream)
+            raise
+        except CorporateRefusedError:
+            # Corporate misconfiguration: the corporate proxy answered and
+            # webshare was never reached, no breaker is to blame
+            self._corporate_reached()
+            self.balancer.release(upstream)
+            raise
+        except ProxyRefusedError:
+            # The proxy answered: it is reachable, the target or
+            # credentials are the problem
+            self._corporate_reached()
+            upstream.record_latency(time.monotonic() - started)
+            self.balancer.release(upstream)
+            raise
+        except TunnelError:
+            self._corporate_reached()
+            upstream.record_failure()
+            self.balancer.release(upstream)
+            raise
+        except BaseException:
+            self.balancer.release(upstream)
+            raise
+
+        self._corporate_reached()
+        upstream.record_latency(time.monotonic() - started)
+        return reader, writer, upstream
+
+    def _corporate_reached(self) -> None:
+        """The corporate proxy took a connection (no-op without one)."""
+        if self.corporate_breaker:
+            self.corporate_breaker.record_success()
+
+    async def _create_chained_tunnel(
+        self,
+        host: str,
+        port: int,
+        webshare: ProxyConfig,
+    ) -> tuple[StreamReader, StreamWriter]:
+        """Create a chained tunnel, starting from a pooled leg when available."""
+        pool = self._pools.get(webshare.address)
+        pooled = pool.acquire() if pool else None
+        if pooled:
+            try:
+                return await create_chained_tunnel(
                     host,
                     port,
-                    self.config.webshare,
+                    self.config.corporate_proxy,
+                    webshare,
+                    existing_connection=pooled,
+                    connector=self.connector,
                 )
-
-            # Send success response to client
-            client_writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
-            await client_writer.drain()
-
-            logger.info(f"CONNECT {host}:{port} -> 200")
-
-            # Relay data bidirectionally
-            await relay_data(client_reader, client_writer, remote_reader, remote_writer)
-
-        except TunnelError as e:
-            logger.error(f"CONNECT {host}:{port} -> {e.status_code} {e.message}")
-            await self._send_error(client_writer, e.status_code, e.message)
+            except UpstreamClosedError as e:
+                # The pooled leg died while idle: fall back to a fresh one
+                logger.debug(f"Pooled connection unusable ({e.message}), reconnecting")
+
+        return await create_chained_tunnel(
+            host,
+            port,
+            self.config.corporate_proxy,
+            webshare,
+            connector=self.connector,
+            pipeline=self.config.tunnel.pipeline,
+        )
 
     async def handle_http(
         self,
         method: str,
         url: str,
-        headers: dict,
-        body: bytes,
+        headers: list[tuple[str, str]],
+        client_reader: StreamReader,
         client_writer: StreamWriter,
-    ) -> None:
-        """Handle HTTP request (GET, POST, etc.)."""
+        body_framing: str = FRAMING_NONE,
+        body_length: int = 0,
+        client_keep_alive: bool = False,
+        session: Session | None = None,
+    ) -> bool:
+        """
+        Handle HTTP request (GET, POST, etc.).
+
+        The request body, if any, is streamed from client_reader to the
+        upstream as it arrives. Returns True if the client connection can
+        serve another request.
+        """
         # Parse URL
         parsed = urlparse(url)
         host = parsed.hostname
@@ -204,107 +709,212 @@ class ProxyServer:
 
         if not host:
             await self._send_error(client_writer, 400, "Invalid URL")
-            return
+            return False
 
         logger.info(f"{method} {url}")
-
+        self.http_requests += 1
+
+        # For HTTP requests, the full URL goes to a webshare upstream chosen
+        # by the balancer, through a corporate -> webshare leg if any
+        if self.corporate_breaker and not self.corporate_breaker.available():
+            self.http_failures += 1
+            await self._send_error(client_writer, 503, "Corporate proxy unavailable")
+            return False
+        selected = self.balancer.select(session.upstream if session else None)
+        if selected is None:
+            self.http_failures += 1
+            await self._send_error(client_writer, 503, "No webshare proxy available")
+            return False
+        upstream = webshare = selected.proxy
+        upstream_name = f"webshare {selected.name}"
+        if session:
+            session.upstream = webshare.address
+            webshare = session.proxy(webshare)
+
+        # Original headers, except hop-by-hop, proxy and framing ones
+        forwarded = "".join([
+            f"{key}: {value}\r\n"
+            for key, value in headers
+            if key not in NOT_FORWARDED and key != self._session_header
+        ])
+
+        # Body framing headers
+        if body_framing == FRAMING_CHUNKED:
+            # Every coding, not just chunked: the body stays encoded with them
+            codings = ", ".join(value for key, value in headers if key == "transfer-encoding")
+            forwarded += f"Transfer-Encoding: {codings}\r\n"
+        elif body_framing == FRAMING_LENGTH:
+            forwarded += f"Content-Length: {body_length}\r\n"
+
+        upstream_keep_alive = self.config.http.keep_alive
+        # Heads are decoded as latin-1, so this encoding restores their bytes;
+        # proxy credentials come preencoded
+        request_data = b"".join((
+            f"{method} {url} HTTP/1.1\r\nHost: {host}:{port}\r\n".encode("latin-1"),
+            webshare.auth_line,
+            forwarded.encode("latin-1"),
+            KEEP_ALIVE_END if upstream_keep_alive else CLOSE_END,
+        ))
+
+        key = upstream.address
+        # The pool in use now: a reload closes it rather than taking this
+        # connection, made with the old settings, back
+        http_pool = self._http_pool
+        response_started = False
         try:
-            # For HTTP requests, we forward through the proxy chain
-            if self.use_corporate:
-                # Connect to corporate proxy
-                try:
-                    reader, writer = await asyncio.wait_for(
-                        asyncio.open_connection(
-                            self.config.corporate_proxy.host,
-                            self.config.corporate_proxy.port,
-                        ),
-                        timeout=30,
-                    )
-                except (asyncio.TimeoutError, OSError) as e:
-                    logger.error(f"Failed to connect to corporate proxy: {e}")
-                    await self._send_error(client_writer, 502, "Bad Gateway")
-                    return
-
-                # Build request to forward through corporate -> webshare
-                # We send the full URL to the proxy
-                webshare_url = f"http://{self.config.webshare.host}:{self.config.webshare.port}"
-
-                request_lines = [
-                    f"{method} {url} HTTP/1.1",
-                    f"Host: {host}:{port}",
-                ]
-
-                # Add corporate proxy auth
-                if self.config.corporate_proxy.requires_auth:
-                    request_lines.append(
-                        f"Proxy-Authorization: {self.config.corporate_proxy.auth_header}"
-                    )
+            # A pooled connection may have been closed by the upstream while
+            # idle; the request is then replayed once on a fresh connection,
+            # unless body bytes were already consumed from the client.
+            pooled = http_pool.acquire(key) if upstream_keep_alive else None
+            while True:
+                if pooled:
+                    reader, writer = pooled
+                else:
+                    if self.corporate_breaker:
+                        self.corporate_breaker.begin()
+                    started = time.monotonic()
+                    try:
+                        async with self.admission.connecting():
+                            reader, writer = await asyncio.wait_for(
+                                self._open_http_connection(upstream),
+                                timeout=30,
+                            )
+                    except AdmissionError as e:
+                        self.http_failures += 1
+                        await self._send_error(client_writer, e.status_code, e.message)
+                        return False
+                    except CorporateProxyError as e:
+                        logger.error(f"Failed to connect to {upstream_name}: {e.message}")
+                        self.corporate_breaker.record_failure()
+                        self.http_failures += 1
+                        await self._send_error(client_writer, 502, "Bad Gateway")
+                        return False
+                    except CorporateRefusedError as e:
+                        logger.error(f"Failed to connect to {upstream_name}: {e.message}")
+                        self._corporate_reached()
+                        self.http_failures += 1
+                        await self._send_error(client_writer, e.status_code, e.message)
+                        return False
+                    except TunnelError as e:
+                        # The corporate proxy could not reach webshare
+                        logger.error(f"Failed to connect to {upstream_name}: {e.message}")
+                        self._corporate_reached()
+                        selected.record_failure()
+                        self.http_failures += 1
+                        await self._send_error(client_writer, e.status_code, e.message)
+                        return False
+                    except (asyncio.TimeoutError, OSError) as e:
+                        logger.error(f"Failed to connect to {upstream_name}: {e}")
+                        selected.record_failure()
+                        self.http_failures += 1
+                        await self._send_error(client_writer, 502, "Bad Gateway")
+                        return False
+                    self._corporate_reached()
+                    # Connection setup only, like a tunnel establishment:
+                    # the origin's response time is not the upstream's
+                    selected.record_latency(time.monotonic() - started)
 
-            else:
-                # Connect directly to webshare
                 try:
-                    reader, writer = await asyncio.wait_for(
-                        asyncio.open_connection(
-                            self.config.webshare.host,
-                            self.config.webshare.port,
-                        ),
-                        timeout=30,
+                    writer.write(request_data)
+                    await writer.drain()
+                    await copy_body(
+                        client_reader,
+                        writer,
+                        body_framing,
+                        body_length,
+                        read_timeout=READ_TIMEOUT,
                     )
-                except (asyncio.TimeoutError, OSError) as e:
-                    logger.error(f"Failed to connect to webshare: {e}")
-                    await self._send_error(client_writer, 502, "Bad Gateway")
-                    return
-
-                request_lines = [
-                    f"{method} {url} HTTP/1.1",
-                    f"Host: {host}:{port}",
-                ]
-
-            # Add webshare auth
-            if self.config.webshare.requires_auth:
-                request_lines.append(
-                    f"Proxy-Authorization: {self.config.webshare.auth_header}"
+                    response = await read_response_head(reader)
+                    break
+                except asyncio.TimeoutError:
+                    writer.close()
+                    raise
+                except (asyncio.IncompleteReadError, OSError) as e:
+                    writer.close()
+                    if (
+                        not pooled
+                        or body_framing != FRAMING_NONE
+                        or (isinstance(e, asyncio.IncompleteReadError) and e.partial)
+                    ):
+                        raise
+                    logger.debug(f"Stale keep-alive connection to {upstream_name}, reconnecting")
+                    pooled = None
+
+            tracing.mark("response_head")
+
+            # Forward interim (1xx) responses, then the final response
+            while 100 <= response.status_code < 200 and response.status_code != 101:
+                client_writer.write(response.raw)
+                response_started = True
+                response = await read_response_head(reader)
+
+            framing, length = response_framing(response, method)
+            client_writer.write(response.raw)
+            response_started = True
+            try:
+                body_bytes = await copy_body(reader, client_writer, framing, length)
+            except TruncatedBodyError as e:
+                # The client sees the connection close before the end of
+                # the body, not a complete-looking response
+                writer.close()
+                self.http_truncated += 1
+                self.http_response_bytes += e.copied
+                metrics.TRUNCATED.inc()
+                metrics.RESPONSE_BYTES.inc(e.copied)
+                expected = f" of {length}" if framing == FRAMING_LENGTH else ""
+                logger.warning(
+                    f"{method} {url} -> {response.status_code} truncated by upstream "
+                    f"after {e.copied}{expected} body bytes"
                 )
+                return False
+            await client_writer.drain()
+            self.http_response_bytes += body_bytes
+            metrics.record_http_response(response.status_code, body_bytes)
+
+            reusable = (
+                upstream_keep_alive
+                and response.keep_alive
+                and framing != FRAMING_CLOSE
+                and response.status_code != 101
+            )
+            if reusable:
+                http_pool.release(key, reader, writer)
+            else:
+                writer.close()
+                await writer.wait_closed()
 
-            # Add original headers (except hop-by-hop and proxy headers)
-            hop_by_hop = {
-                "connection", "keep-alive", "proxy-authenticate",
-                "proxy-authorization", "te", "trailers", "transfer-encoding",
-                "upgrade", "proxy-connection",
-            }
-            for key, value in headers.items():
-                if key.lower() not in hop_by_hop and key.lower() != "host":
-                    request_lines.append(f"{key}: {value}")
-
-            # Add content-length if body present
-            if body:
-                request_lines.append(f"Content-Length: {len(body)}")
-
-            request_lines.append("Connection: close")
-            request_lines.extend(["", ""])
-
-            request_data = "\r\n".join(request_lines).encode()
-            if body:
-                request_data += body
-
-            writer.write(request_data)
-            await writer.drain()
-
-            # Read and forward response
-            response = await reader.read(65536)
-            while response:
-                client_writer.write(response)
-                await client_writer.drain()
-                response = await reader.read(65536)
+            logger.info(f"{method} {url} -> {response.status_code} ({body_bytes} bytes)")
 
-            writer.close()
-            await writer.wait_closed()
+            return client_keep_alive and reusable
 
-            logger.info(f"{method} {url} -> completed")
+        except asyncio.TimeoutError:
+            # Only client body reads are timed
+            logger.warning(f"Timeout reading request body for {method} {url}")
+            self.http_failures += 1
+            await self._send_error(client_writer, 408, "Request Timeout")
+            return False
 
         except Exception as e:
             logger.error(f"HTTP request failed: {e}")
-            await self._send_error(client_writer, 502, "Bad Gateway")
+            self.http_failures += 1
+            if not response_started:
+                await self._send_error(client_writer, 502, "Bad Gateway")
+            return False
+        finally:
+            self.balancer.release(selected)
+
+    async def _open_http_connection(self, webshare: ProxyConfig) -> tuple[StreamReader, StreamWriter]:
+        """
+        Open a connection speaking to webshare, for absolute-URI requests.
+
+        Raises:
+            CorporateProxyError: If the corporate proxy cannot be reached
+            TunnelError: If the corporate proxy cannot reach webshare
+            OSError: If webshare cannot be reached directly
+        """
+        if self.use_corporate:
+            return await open_webshare_leg(self.config.corporate_proxy, webshare, self.connector)
+        return await self.connector.open_connection(webshare.host, webshare.port)
 
     async def _send_error(
         self,
@@ -313,16 +923,8 @@ class ProxyServer:
         message: str,
     ) -> None:
         """Send HTTP error response."""
-        response = (
-            f"HTTP/1.1 {status_code} {message}\r\n"
-            f"Content-Type: text/plain\r\n"
-            f"Content-Length: {len(message)}\r\n"
-            f"Connection: close\r\n"
-            f"\r\n"
-            f"{message}"
-        )
         try:
-            writer.write(response.encode())
+            writer.write(error_response(status_code, message))
             await writer.drain()
         except Exception:
             pass
@@ -0,0 +1,368 @@
+"""Socket-level relay engines for Mooltiroute tunnels."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+from asyncio import StreamReader, StreamWriter
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import metrics
+import tracing
+
+logger = logging.getLogger("mooltiroute.relay")
+
+ENGINE_STREAM = "stream"
+ENGINE_RECV_INTO = "recv_into"
+ENGINE_SPLICE = "splice"
+ENGINE_AUTO = "auto"
+
+# Relay read sizes adapt between these bounds: a read filling the whole
+# size doubles it (bulk transfer), a read under an eighth of it halves it
+# (interactive traffic), so idle tunnels keep small buffers.
+READ_SIZE_MIN = 16384
+READ_SIZE_MAX = 262144
+# Transport write buffer limits: writes only wait for the peer above
+# WRITE_BUFFER_HIGH, then until the buffer drains below WRITE_BUFFER_LOW
+WRITE_BUFFER_HIGH = 262144
+WRITE_BUFFER_LOW = 65536
+SPLICE_SIZE = 1 << 20
+PIPE_SIZE_MAX = 1 << 20
+_SPLICE_AVAILABLE = sys.platform.startswith("linux") and hasattr(os, "splice")
+_PIPE_RESIZABLE = fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ")
+
+
+def resolve_engine(name: str) -> str:
+    """Map a configured engine name to the engine usable on this platform."""
+    if name == ENGINE_AUTO:
+        return ENGINE_SPLICE if _SPLICE_AVAILABLE else ENGINE_RECV_INTO
+    if name == ENGINE_SPLICE and not _SPLICE_AVAILABLE:
+        logger.warning("splice relay engine unavailable on this platform, using recv_into")
+        return ENGINE_RECV_INTO
+    return name
+
+
+class RelayDeadline:
+    """
+    Idle and lifetime deadline shared by both directions of a tunnel.
+
+    Relays call touch() whenever data moves; a single timer per tunnel
+    checks the deadline and re-arms itself at the next possible expiry,
+    instead of a timeout around every read. When the tunnel has been idle
+    for idle_timeout seconds, or open for max_lifetime seconds, on_expire
+    is called to tear it down. 0 disables either limit.
+    """
+
+    __slots__ = ("idle_timeout", "expires_at", "last_activity", "reason", "_clock", "_loop", "_timer", "_on_expire")
+
+    def __init__(
+        self,
+        idle_timeout: float,
+        max_lifetime: float,
+        on_expire: Callable[[], None],
+    ):
+        self._loop = asyncio.get_running_loop()
+        self._clock = self._loop.time
+        now = self._clock()
+        self.idle_timeout = idle_timeout
+        self.expires_at = now + max_lifetime if max_lifetime else float("inf")
+        self.last_activity = now
+        self.reason: str | None = None  # "idle" or "lifetime" once expired
+        self._on_expire = on_expire
+        self._timer: asyncio.TimerHandle | None = None
+        if idle_timeout or max_lifetime:
+            self._timer = self._loop.call_at(self._next_deadline(), self._check)
+
+    def touch(self) -> None:
+        self.last_activity = self._clock()
+
+    def cancel(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _next_deadline(self) -> float:
+        if not self.idle_timeout:
+            return self.expires_at
+        return min(self.last_activity + self.idle_timeout, self.expires_at)
+
+    def _check(self) -> None:
+        deadline = self._next_deadline()
+        if self._clock() < deadline:
+            self._timer = self._loop.call_at(deadline, self._check)
+            return
+        self._timer = None
+        self.reason = "lifetime" if deadline >= self.expires_at else "idle"
+        metrics.RELAY_EXPIRED[self.reason].inc()
+        logger.debug(f"Tunnel closed: {self.reason} deadline reached")
+        self._on_expire()
+
+
+def next_read_size(size: int, received: int) -> int:
+    """Adapt a relay read size to the amount the last read returned."""
+    if received >= size:
+        return min(size * 2, READ_SIZE_MAX)
+    if received < size >> 3:
+        return max(size >> 1, READ_SIZE_MIN)
+    return size
+
+
+def set_write_limits(transport: asyncio.BaseTransport) -> None:
+    """Apply the relay write buffer limits to a tunnel transport."""
+    transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH, low=WRITE_BUFFER_LOW)
+
+
+def _can_detach(writer: StreamWriter) -> bool:
+    """True if the stream is a plain socket with nothing left to write."""
+    sock = writer.get_extra_info("socket")
+    return (
+        sock is not None
+        and hasattr(sock, "dup")
+        and writer.get_extra_info("sslcontext") is None
+        and not writer.transport.get_write_buffer_size()
+    )
+
+
+async def take_buffered(reader: StreamReader) -> bytes:
+    """
+    Return what reader has buffered, for a new owner of its transport.
+
+    The reader is fed an EOF so that read() returns the buffered bytes
+    at once, without waiting for more: it must not be read from again.
+    An EOF the peer had already sent is still reported by the socket to
+    whoever reads it next. Reading it may resume the transport, which
+    the caller pauses again or hands over before yielding to the loop.
+    """
+    reader.feed_eof()
+    try:
+        return await reader.read()
+    except Exception:
+        return b""  # the connection failed: nothing usable was buffered
+
+
+async def _detach(reader: StreamReader, writer: StreamWriter) -> tuple[socket.socket, bytes]:
+    """
+    Take over the socket behind a stream pair.
+
+    A duplicate of the socket is returned together with whatever the
+    StreamReader had already buffered, and reading on the transport is
+    paused so the event loop stops filling the StreamReader. The
+    transport keeps ownership of the original descriptor and still
+    closes it.
+    """
+    pending = await take_buffered(reader)
+    writer.transport.pause_reading()
+    dup = writer.get_extra_info("socket").dup()
+    dup.setblocking(False)
+    return dup, pending
+
+
+def _grow_pipe(pipe_fd: int, size: int) -> int:
+    """Double a pipe's capacity; returns the new size (unchanged on failure)."""
+    try:
+        return fcntl.fcntl(pipe_fd, fcntl.F_SETPIPE_SZ, min(size * 2, PIPE_SIZE_MAX))
+    except OSError:
+        return PIPE_SIZE_MAX  # over the system limit: stop trying
+
+
+def _shutdown(sock: socket.socket, how: int) -> None:
+    try:
+        sock.shutdown(how)
+    except OSError:
+        pass  # already disconnected
+
+
+def _shutdown_write(sock: socket.socket) -> None:
+    """Propagate an EOF: half-close sock, which can still receive."""
+    _shutdown(sock, socket.SHUT_WR)
+
+
+async def _wait_fd(loop: asyncio.AbstractEventLoop, fd: int, writable: bool) -> None:
+    """Wait until fd is readable (or writable)."""
+    waiter = loop.create_future()
+
+    def wake() -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+    if writable:
+        loop.add_writer(fd, wake)
+    else:
+        loop.add_reader(fd, wake)
+    try:
+        await waiter
+    finally:
+        if writable:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+async def _relay_recv_into(
+    src: socket.socket,
+    dst: socket.socket,
+    relayed: metrics.CounterChild,
+    first_byte: str,
+    deadline: RelayDeadline,
+) -> None:
+    """Relay src -> dst through one reused buffer, resized to the traffic."""
+    loop = asyncio.get_running_loop()
+    size = READ_SIZE_MIN
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    trace = tracing.current()
+    while True:
+        n = await loop.sock_recv_into(src, buffer)
+        if not n:
+            _shutdown_write(dst)
+            return
+        if trace is not None:
+            trace.mark_first(first_byte)
+            trace = None
+        await loop.sock_sendall(dst, view[:n])
+        relayed.inc(n)
+        deadline.touch()
+        new_size = next_read_size(size, n)
+        if new_size != size:
+            size = new_size
+            buffer = bytearray(size)
+            view = memoryview(buffer)
+
+
+async def _relay_splice(
+    src: socket.socket,
+    dst: socket.socket,
+    relayed: metrics.CounterChild,
+    first_byte: str,
+    deadline: RelayDeadline,
+) -> None:
+    """
+    Relay src -> dst inside the kernel, through a pipe.
+
+    The pipe starts at the kernel default size and is grown, up to
+    PIPE_SIZE_MAX, while transfers keep filling it.
+    """
+    loop = asyncio.get_running_loop()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    pipe_r, pipe_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    pipe_size = fcntl.fcntl(pipe_w, fcntl.F_GETPIPE_SZ) if _PIPE_RESIZABLE else PIPE_SIZE_MAX
+    trace = tracing.current()
+    try:
+        while True:
+            # socket -> pipe (the pipe is always empty here)
+            try:
+                n = os.splice(src_fd, pipe_w, SPLICE_SIZE, flags=flags)
+            except BlockingIOError:
+                await _wait_fd(loop, src_fd, writable=False)
+                continue
+            if n == 0:
+                _shutdown_write(dst)
+                return
+            relayed.inc(n)
+            deadline.touch()
+            if trace is not None:
+                trace.mark_first(first_byte)
+                trace = None
+            if n >= pipe_size and pipe_size < PIPE_SIZE_MAX:
+                pipe_size = _grow_pipe(pipe_w, pipe_size)
+
+            # pipe -> socket, until the pipe is drained
+            while n:
+                try:
+                    n -= os.splice(pipe_r, dst_fd, n, flags=flags)
+                except BlockingIOError:
+                    await _wait_fd(loop, dst_fd, writable=True)
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+
+
+async def relay_sockets(
+    client_reader: StreamReader,
+    client_writer: StreamWriter,
+    remote_reader: StreamReader,
+    remote_writer: StreamWriter,
+    engine: str,
+    idle_timeout: float = 0,
+    max_lifetime: float = 0,
+) -> bool:
+    """
+    Relay a tunnel with a socket-level engine (recv_into or splice).
+
+    Returns False without touching the streams when the engine cannot
+    take over these connections; the caller then uses the stream relay.
+    An EOF in one direction is passed on as a half-close; the relay
+    ends when both directions are done, on an error, or when the
+    RelayDeadline expires. The streams are closed when the relay ends.
+    """
+    relay_one_way = _relay_splice if engine == ENGINE_SPLICE else _relay_recv_into
+
+    if not (_can_detach(client_writer) and _can_detach(remote_writer)):
+        return False
+
+    client_sock, client_pending = await _detach(client_reader, client_writer)
+    remote_sock, remote_pending = await _detach(remote_reader, remote_writer)
+    loop = asyncio.get_running_loop()
+
+    def expire() -> None:
+        # Wakes both directions up: their reads return EOF at once
+        _shutdown(client_sock, socket.SHUT_RDWR)
+        _shutdown(remote_sock, socket.SHUT_RDWR)
+
+    deadline = RelayDeadline(idle_timeout, max_lifetime, expire)
+    tasks: list[asyncio.Task] = []
+    try:
+        if client_pending:
+            tracing.mark_first(tracing.FIRST_BYTE_UPSTREAM)
+            await loop.sock_sendall(remote_sock, client_pending)
+            metrics.BYTES_UPSTREAM.inc(len(client_pending))
+        if remote_pending:
+            tracing.mark_first(tracing.FIRST_BYTE_DOWNSTREAM)
+            await loop.sock_sendall(client_sock, remote_pending)
+            metrics.BYTES_DOWNSTREAM.inc(len(remote_pending))
+
+        tasks = [
+            asyncio.create_task(relay_one_way(
+                client_sock,
+                remote_sock,
+                metrics.BYTES_UPSTREAM,
+                tracing.FIRST_BYTE_UPSTREAM,
+                deadline,
+            )),
+            asyncio.create_task(relay_one_way(
+                remote_sock,
+                client_sock,
+                metrics.BYTES_DOWNSTREAM,
+                tracing.FIRST_BYTE_DOWNSTREAM,
+                deadline,
+            )),
+        ]
+        # Both directions reaching EOF end the tunnel, an error ends it at once
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except OSError:
+        pass
+    finally:
+        deadline.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        client_sock.close()
+        remote_sock.close()
+        for writer in (client_writer, remote_writer):
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    return True
@@ -0,0 +1,95 @@
+"""Configuration reload for Mooltiroute."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import TYPE_CHECKING
+
+from config import ConfigError, load_config
+
+if TYPE_CHECKING:
+    from proxy_server import ProxyServer
+
+logger = logging.getLogger("mooltiroute.reloader")
+
+
+class ConfigReloader:
+    """
+    Reload the configuration file into a running ProxyServer.
+
+    reload() runs on SIGHUP (request()) and, with reload.watch, whenever
+    the file's modification time or size changes. A file that fails to
+    load or validate is reported and the running configuration stays in
+    use. Reloads never overlap.
+    """
+
+    def __init__(self, server: ProxyServer, path: str):
+        self.server = server
+        self.path = path
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        self._watcher: asyncio.Task | None = None
+        self._signature = self._stat()
+
+        self.reloads = 0
+        self.failures = 0
+
+    def _stat(self) -> tuple[int, int] | None:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    async def reload(self) -> bool:
+        """Load the file and apply it; False if it was rejected."""
+        async with self._lock:
+            self._signature = self._stat()
+            try:
+                config = load_config(self.path)
+            except ConfigError as e:
+                self.failures += 1
+                logger.error(f"Configuration reload failed, keeping the current one: {e}")
+                return False
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Configuration reload failed, keeping the current one: {e!r}")
+                return False
+            await self.server.reconfigure(config)
+            self.reloads += 1
+        # Watching may have been turned on by this reload
+        self.start()
+        return True
+
+    def request(self) -> None:
+        """Schedule a reload (signal handler)."""
+        logger.info(f"Reloading configuration from {self.path}")
+        task = asyncio.get_running_loop().create_task(self.reload())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def start(self) -> None:
+        """Start watching the file if reload.watch is set."""
+        if self.server.config.reload.watch and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.server.config.reload.interval)
+            if not self.server.config.reload.watch:
+                self._watcher = None
+                return
+            signature = self._stat()
+            if signature is not None and signature != self._signature:
+                logger.info(f"{self.path} changed, reloading configuration")
+                await self.reload()
+
+    async def close(self) -> None:
+        """Stop watching and wait for reloads in progress."""
+        if self._watcher:
+            self._watcher.cancel()
+            self._watcher = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
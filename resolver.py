@@ -0,0 +1,140 @@
+"""Cached asynchronous DNS resolution for Mooltiroute upstream proxies."""
+
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+
+from config import DnsConfig
+
+logger = logging.getLogger("mooltiroute.resolver")
+
+AddrInfo = tuple  # (family, type, proto, canonname, sockaddr)
+
+
+class _CacheEntry:
+    """Resolved addresses (or a resolution error) and their expiry time."""
+
+    __slots__ = ("infos", "error", "expires")
+
+    def __init__(self, infos: list[AddrInfo] | None, error: OSError | None, expires: float):
+        self.infos = infos
+        self.error = error
+        self.expires = expires
+
+
+def _literal_infos(host: str, port: int) -> list[AddrInfo] | None:
+    """Build addrinfo for an IP literal without a lookup; None for names."""
+    try:
+        address = ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return None
+    if address.version == 6:
+        return [(socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (str(address), port, 0, 0))]
+    return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (str(address), port))]
+
+
+class Resolver:
+    """
+    getaddrinfo with a TTL cache, negative caching and lookup coalescing.
+
+    getaddrinfo runs on the default executor, so every uncached lookup
+    takes a thread; under connection bursts to the same upstream the
+    executor becomes a queue. Results are cached for dns.ttl seconds and
+    failures for dns.negative_ttl seconds, and concurrent lookups of the
+    same name share one in-flight query. IP literals never reach
+    getaddrinfo.
+    """
+
+    def __init__(self, config: DnsConfig):
+        self.config = config
+        self._cache: dict[tuple[str, int], _CacheEntry] = {}
+        self._inflight: dict[tuple[str, int], asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.negative_hits = 0
+        self.failures = 0
+
+    async def resolve(self, host: str, port: int) -> list[AddrInfo]:
+        """
+        Return the TCP addrinfo list of host:port.
+
+        Raises:
+            OSError: If the name does not resolve (possibly cached)
+        """
+        literal = _literal_infos(host, port)
+        if literal is not None:
+            return literal
+
+        key = (host, port)
+        entry = self._cache.get(key)
+        if entry is not None and entry.expires > time.monotonic():
+            if entry.error is not None:
+                self.negative_hits += 1
+                raise socket.gaierror(*entry.error.args)
+            self.hits += 1
+            return entry.infos
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._lookup(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._lookup_done(key, t))
+        else:
+            self.coalesced += 1
+
+        # A caller giving up (timeout) must not cancel the shared lookup
+        return await asyncio.shield(task)
+
+    async def _lookup(self, key: tuple[str, int]) -> list[AddrInfo]:
+        host, port = key
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            if not infos:
+                raise socket.gaierror(socket.EAI_NONAME, f"No address found for {host}")
+        except OSError as e:
+            self.failures += 1
+            logger.debug(f"DNS lookup for {host} failed: {e}")
+            if self.config.negative_ttl > 0:
+                self._cache[key] = _CacheEntry(None, e, time.monotonic() + self.config.negative_ttl)
+            raise
+
+        if self.config.ttl > 0:
+            self._cache[key] = _CacheEntry(infos, None, time.monotonic() + self.config.ttl)
+        return infos
+
+    def _lookup_done(self, key: tuple[str, int], task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        # Mark the error as retrieved when every waiter gave up
+        if not task.cancelled():
+            task.exception()
+
+    async def prepopulate(self, addresses: list[tuple[str, int]]) -> None:
+        """Resolve addresses ahead of the first connection (failures are logged)."""
+        results = await asyncio.gather(
+            *(self.resolve(host, port) for host, port in addresses),
+            return_exceptions=True,
+        )
+        for (host, port), result in zip(addresses, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not resolve {host}: {result}")
+            else:
+                logger.debug(f"Resolved {host}: {[info[4][0] for info in result]}")
+
+    def stats(self) -> dict:
+        """Return cache counters."""
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "negative_hits": self.negative_hits,
+            "failures": self.failures,
+        }
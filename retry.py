@@ -0,0 +1,109 @@
+"""Retry policy for CONNECT tunnel establishment in Mooltiroute."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import metrics
+import tracing
+from config import RetryConfig
+from tunnel import CorporateRefusedError, TunnelError, UpstreamUnavailableError
+
+logger = logging.getLogger("mooltiroute.retry")
+
+T = TypeVar("T")
+
+
+class RetryPolicy:
+    """
+    Retry failed tunnel establishments on a fresh upstream connection.
+
+    Retrying is safe because nothing has been sent to the client before
+    the tunnel is up. With a rotating webshare pool, each new CONNECT
+    usually gets another exit IP, so transient exit failures are hidden
+    from clients.
+
+    An attempt is retried when it fails with one of retry.statuses
+    (connection failures and timeouts count as 502), up to
+    retry.max_attempts attempts, waiting a jittered exponential backoff
+    between them. All attempts and waits share the retry.deadline budget;
+    an attempt still running after retry.attempt_timeout is abandoned and
+    counts as a 502, so one blackholed exit cannot use up the deadline.
+    """
+
+    def __init__(self, config: RetryConfig):
+        self.config = config
+        self.retries = 0
+        self.recovered = 0  # establishments that succeeded after a retry
+        self.exhausted = 0  # establishments that failed after retrying
+
+    def retryable(self, error: TunnelError) -> bool:
+        """True if a failed attempt is worth another try."""
+        if isinstance(error, UpstreamUnavailableError):
+            return False  # every circuit is open: fail fast
+        if isinstance(error, CorporateRefusedError):
+            return False  # another exit would be refused the same way
+        return error.status_code in self.config.statuses
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before the attempt following attempt number `attempt` (1-based)."""
+        ceiling = min(self.config.backoff_max, self.config.backoff_base * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)  # "full jitter"
+
+    async def run(self, attempt: Callable[[], Awaitable[T]], label: str) -> T:
+        """
+        Call attempt() until it succeeds or the policy gives up.
+
+        Raises:
+            TunnelError: The error of the last attempt
+        """
+        deadline = time.monotonic() + self.config.deadline
+        number = 1
+        while True:
+            remaining = deadline - time.monotonic()
+            timeout = min(self.config.attempt_timeout, remaining)
+            try:
+                result = await asyncio.wait_for(attempt(), timeout=timeout)
+            except asyncio.TimeoutError:
+                metrics.TIMEOUTS[metrics.HOP_ATTEMPT].inc()
+                if timeout < remaining:
+                    error = TunnelError(f"Tunnel attempt timed out after {timeout:g}s")
+                else:
+                    error = TunnelError(f"Tunnel not established within {self.config.deadline}s")
+            except TunnelError as e:
+                error = e
+            else:
+                if number > 1:
+                    self.recovered += 1
+                return result
+
+            delay = self.backoff(number)
+            if (
+                number >= self.config.max_attempts
+                or not self.retryable(error)
+                or time.monotonic() + delay >= deadline
+            ):
+                if number > 1:
+                    self.exhausted += 1
+                raise error
+
+            logger.info(
+                f"{label}: attempt {number} failed ({error.status_code} {error.message}), "
+                f"retrying in {delay * 1000:.0f}ms"
+            )
+            self.retries += 1
+            tracing.mark("retry")
+            number += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """Return retry counters."""
+        return {
+            "retries": self.retries,
+            "recovered": self.recovered,
+            "exhausted": self.exhausted,
+        }
@@ -0,0 +1,140 @@
+"""Sticky webshare sessions for Mooltiroute."""
+
+from __future__ import annotations
+
+import base64
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import replace
+
+from config import ProxyConfig, SessionConfig
+from http_parser import RequestHead
+
+logger = logging.getLogger("mooltiroute.sessions")
+
+# Separates a client's own name from its session key in "username" mode,
+# e.g. Proxy-Authorization username "crawler-session-42"
+SESSION_MARKER = "-session-"
+
+
+class Session:
+    """One sticky session: the exit chosen for a session key."""
+
+    __slots__ = ("key", "id", "upstream", "last_used", "_username_format", "_proxies")
+
+    def __init__(self, key: str, username_format: str, now: float):
+        self.key = key
+        self.id = secrets.token_hex(4)
+        self.upstream: tuple[str, int] | None = None  # webshare address, once used
+        self.last_used = now
+        self._username_format = username_format
+        self._proxies: dict[ProxyConfig, ProxyConfig] = {}
+
+    def proxy(self, webshare: ProxyConfig) -> ProxyConfig:
+        """Return webshare with its username in sticky-session form."""
+        proxy = self._proxies.get(webshare)
+        if proxy is None:
+            username = self._username_format.format(username=webshare.username, session=self.id)
+            proxy = self._proxies[webshare] = replace(webshare, username=username)
+        return proxy
+
+
+class Sessions:
+    """
+    Map session keys to sticky webshare sessions.
+
+    The key of a request is the client IP, the part of its
+    Proxy-Authorization username after SESSION_MARKER, or the value of
+    sessions.header (per sessions.key). Requests with the same key use the
+    same webshare upstream with the same sticky-session username, so the
+    webshare pool keeps them on one exit IP; requests without a key rotate
+    as usual.
+
+    The table holds at most sessions.max_sessions entries, least recently
+    used first, and forgets a session unused for sessions.ttl seconds: its
+    key then gets a new session, thus a new exit.
+    """
+
+    def __init__(self, config: SessionConfig):
+        self.config = config
+        self._table: OrderedDict[str, Session] = OrderedDict()
+
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def reconfigure(self, config: SessionConfig) -> None:
+        """Apply new settings; sessions are forgotten if their key or username changes."""
+        if (config.key, config.header, config.username_format) != (
+            self.config.key,
+            self.config.header,
+            self.config.username_format,
+        ):
+            if self._table:
+                logger.info(f"Session settings changed, forgetting {len(self._table)} sessions")
+            self._table.clear()
+        self.config = config
+
+    def lookup(self, head: RequestHead, client_ip: str) -> Session | None:
+        """Return the session of a request (None when disabled or without a key)."""
+        if not self.config.enabled:
+            return None
+        key = self._key(head, client_ip)
+        if not key:
+            return None
+
+        now = time.monotonic()
+        self._expire(now)
+        session = self._table.get(key)
+        if session is None:
+            session = self._table[key] = Session(key, self.config.username_format, now)
+            self.created += 1
+            logger.debug(f"New session {session.id} for {key!r}")
+            if len(self._table) > self.config.max_sessions:
+                self._table.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._table.move_to_end(key)
+            session.last_used = now
+            self.reused += 1
+        return session
+
+    def _key(self, head: RequestHead, client_ip: str) -> str | None:
+        if self.config.key == "client_ip":
+            return client_ip
+        if self.config.key == "header":
+            return head.get(self.config.header)
+
+        authorization = head.get("proxy-authorization", "")
+        scheme, _, encoded = authorization.partition(" ")
+        if scheme.lower() != "basic":
+            return None
+        try:
+            username = base64.b64decode(encoded.strip()).decode().partition(":")[0]
+        except (ValueError, UnicodeDecodeError):
+            return None
+        _, marker, key = username.rpartition(SESSION_MARKER)
+        return key if marker else None
+
+    def _expire(self, now: float) -> None:
+        # Least recently used first: expired sessions are at the front
+        while self._table:
+            session = next(iter(self._table.values()))
+            if now - session.last_used < self.config.ttl:
+                return
+            self._table.popitem(last=False)
+            self.expired += 1
+
+    def stats(self) -> dict:
+        """Return session counters."""
+        self._expire(time.monotonic())
+        return {
+            "active": len(self._table),
+            "created": self.created,
+            "reused": self.reused,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
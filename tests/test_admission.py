@@ -0,0 +1,159 @@
+"""Tests for the admission limiter."""
+
+import asyncio
+
+import pytest
+
+from admission import AdmissionError, _Limiter
+
+
+async def _settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_acquire_within_limit():
+    async def run():
+        limiter = _Limiter(2, queue_size=0, queue_timeout=1)
+        await limiter.acquire()
+        await limiter.acquire()
+        assert limiter.active == 2
+        limiter.release()
+        assert limiter.active == 1
+    asyncio.run(run())
+
+
+def test_unlimited():
+    async def run():
+        limiter = _Limiter(0, queue_size=0, queue_timeout=1)
+        for _ in range(100):
+            await limiter.acquire()
+        assert limiter.active == 100
+    asyncio.run(run())
+
+
+def test_full_queue_rejected():
+    async def run():
+        limiter = _Limiter(1, queue_size=1, queue_timeout=1)
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await _settle()
+        assert limiter.queued == 1
+        with pytest.raises(AdmissionError):
+            await limiter.acquire()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert limiter.queued == 0
+        assert limiter.active == 1
+    asyncio.run(run())
+
+
+def test_queue_is_fifo():
+    async def run():
+        limiter = _Limiter(1, queue_size=3, queue_timeout=1)
+        await limiter.acquire()
+        order = []
+
+        async def wait(n):
+            await limiter.acquire()
+            order.append(n)
+
+        tasks = []
+        for n in range(3):
+            tasks.append(asyncio.create_task(wait(n)))
+            await _settle()
+        for _ in range(3):
+            limiter.release()
+            await _settle()
+        await asyncio.gather(*tasks)
+        assert order == [0, 1, 2]
+        assert limiter.active == 1
+        assert limiter.queued == 0
+    asyncio.run(run())
+
+
+def test_newcomer_does_not_overtake_waiter():
+    async def run():
+        limiter = _Limiter(1, queue_size=2, queue_timeout=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await _settle()
+        limiter.release()  # handed over to the waiter
+        newcomer = asyncio.create_task(limiter.acquire())
+        await _settle()
+        assert waiter.done()
+        assert not newcomer.done()
+        limiter.release()
+        await newcomer
+        assert limiter.active == 1
+    asyncio.run(run())
+
+
+def test_queue_timeout():
+    async def run():
+        limiter = _Limiter(1, queue_size=1, queue_timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(AdmissionError):
+            await limiter.acquire()
+        assert limiter.queued == 0
+        assert limiter.active == 1
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def run():
+        limiter = _Limiter(1, queue_size=1, queue_timeout=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await _settle()
+        limiter.release()  # handed over...
+        waiter.cancel()    # ...but the waiter is cancelled before it runs
+        await asyncio.gather(waiter, return_exceptions=True)
+        # Depending on the Python version wait_for() either keeps the slot
+        # (the task ends normally) or raises, and acquire() gives it back
+        assert limiter.active == (0 if waiter.cancelled() else 1)
+    asyncio.run(run())
+
+
+def test_resize_up_admits_waiters():
+    async def run():
+        limiter = _Limiter(1, queue_size=2, queue_timeout=1)
+        await limiter.acquire()
+        waiters = [asyncio.create_task(limiter.acquire()) for _ in range(2)]
+        await _settle()
+        limiter.resize(3, queue_size=2, queue_timeout=1)
+        await asyncio.gather(*waiters)
+        assert limiter.active == 3
+        assert limiter.queued == 0
+    asyncio.run(run())
+
+
+def test_resize_to_unlimited_admits_waiters():
+    async def run():
+        limiter = _Limiter(1, queue_size=1, queue_timeout=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await _settle()
+        limiter.resize(0, queue_size=1, queue_timeout=1)
+        await waiter
+        assert limiter.active == 2
+    asyncio.run(run())
+
+
+def test_resize_down_applies_on_release():
+    async def run():
+        limiter = _Limiter(3, queue_size=1, queue_timeout=1)
+        for _ in range(3):
+            await limiter.acquire()
+        limiter.resize(1, queue_size=1, queue_timeout=1)
+        assert limiter.active == 3  # slots taken stay taken
+        limiter.release()
+        limiter.release()
+        assert limiter.active == 1
+        waiter = asyncio.create_task(limiter.acquire())
+        await _settle()
+        assert not waiter.done()
+        limiter.release()
+        await waiter
+        assert limiter.active == 1
+    asyncio.run(run())
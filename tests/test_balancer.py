@@ -0,0 +1,116 @@
+"""Tests for webshare upstream selection."""
+
+import pytest
+
+from balancer import FAILURE_LATENCY, LATENCY_ALPHA, Balancer
+from config import BalancerConfig, HealthConfig, ProxyConfig
+
+PROXIES = [ProxyConfig(f"ws{i}", 80) for i in range(3)]
+
+
+def _balancer(strategy: str = "round_robin", threshold: int = 1) -> Balancer:
+    return Balancer(PROXIES, BalancerConfig(strategy), HealthConfig(failure_threshold=threshold))
+
+
+def _names(balancer: Balancer, count: int) -> list[str]:
+    picks = []
+    for _ in range(count):
+        upstream = balancer.select()
+        picks.append(upstream.proxy.host)
+        balancer.release(upstream)
+    return picks
+
+
+def test_round_robin():
+    assert _names(_balancer(), 6) == ["ws0", "ws1", "ws2", "ws0", "ws1", "ws2"]
+
+
+def test_select_and_release_count_outstanding():
+    balancer = _balancer()
+    upstream = balancer.select()
+    assert (upstream.outstanding, upstream.selected) == (1, 1)
+    balancer.release(upstream)
+    assert (upstream.outstanding, upstream.selected) == (0, 1)
+
+
+def test_open_circuit_is_skipped():
+    balancer = _balancer(threshold=1)
+    balancer.upstreams[1].record_failure()
+    assert _names(balancer, 4) == ["ws0", "ws2", "ws0", "ws2"]
+
+
+def test_no_upstream_when_every_circuit_is_open():
+    balancer = _balancer(threshold=1)
+    for upstream in balancer.upstreams:
+        upstream.record_failure()
+    assert balancer.select() is None
+
+
+def test_preferred_upstream_wins_while_available():
+    balancer = _balancer(threshold=1)
+    assert balancer.select(prefer=("ws2", 80)).proxy.host == "ws2"
+    balancer.upstreams[2].record_failure()
+    assert balancer.select(prefer=("ws2", 80)).proxy.host != "ws2"
+
+
+def test_least_outstanding():
+    balancer = _balancer("least_outstanding")
+    held = [balancer.select() for _ in range(3)]
+    assert sorted(u.proxy.host for u in held) == ["ws0", "ws1", "ws2"]
+    balancer.release(held[1])
+    assert balancer.select() is held[1]
+
+
+def test_ewma_prefers_fast_upstream():
+    balancer = _balancer("ewma")
+    for upstream, latency in zip(balancer.upstreams, (0.3, 0.1, 0.2)):
+        upstream.record_latency(latency)
+    assert _names(balancer, 3) == ["ws1", "ws1", "ws1"]
+
+
+def test_ewma_weighs_outstanding_connections():
+    balancer = _balancer("ewma")
+    for upstream, latency in zip(balancer.upstreams, (0.3, 0.1, 0.2)):
+        upstream.record_latency(latency)
+    held = [balancer.select() for _ in range(3)]
+    # ws1 at 0.1 * 3 outstanding costs more than ws2 at 0.2 * 1
+    assert [u.proxy.host for u in held] == ["ws1", "ws1", "ws2"]
+
+
+def test_ewma_measures_unknown_upstreams_first():
+    balancer = _balancer("ewma")
+    balancer.upstreams[0].record_latency(0.01)
+    balancer.upstreams[1].record_latency(0.01)
+    assert balancer.select().proxy.host == "ws2"
+
+
+def test_p2c_picks_the_better_of_two():
+    balancer = Balancer(PROXIES[:2], BalancerConfig("p2c"), HealthConfig())
+    balancer.upstreams[0].record_latency(0.5)
+    balancer.upstreams[1].record_latency(0.1)
+    assert _names(balancer, 5) == ["ws1"] * 5
+
+
+def test_latency_moving_average():
+    upstream = _balancer().upstreams[0]
+    upstream.record_latency(1.0)
+    assert upstream.latency == 1.0
+    upstream.record_latency(2.0)
+    assert upstream.latency == pytest.approx(1.0 + LATENCY_ALPHA)
+
+
+def test_failure_counts_as_slow_sample():
+    upstream = _balancer(threshold=3).upstreams[0]
+    upstream.record_failure()
+    assert upstream.latency == FAILURE_LATENCY
+    assert upstream.failures == 1
+
+
+def test_reload_keeps_measurements_of_unchanged_upstreams():
+    balancer = _balancer()
+    balancer.upstreams[0].record_latency(0.2)
+    new_proxies = [PROXIES[0], ProxyConfig("ws9", 80)]
+    reloaded = Balancer(new_proxies, BalancerConfig("ewma"), HealthConfig(), previous=balancer)
+    assert reloaded.upstreams[0] is balancer.upstreams[0]
+    assert reloaded.upstreams[0].latency == 0.2
+    assert reloaded.upstreams[1].latency is None
@@ -0,0 +1,84 @@
+"""Tests for the circuit breaker state machine."""
+
+from config import HealthConfig
+from health import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+
+
+def _breaker(threshold: int = 3, open_timeout: float = 10.0) -> CircuitBreaker:
+    return CircuitBreaker("test", HealthConfig(failure_threshold=threshold, open_timeout=open_timeout))
+
+
+def _elapse(breaker: CircuitBreaker, seconds: float) -> None:
+    """Pretend seconds went by since the circuit opened or the trial began."""
+    breaker.opened_at -= seconds
+    breaker.trial_started -= seconds
+
+
+def test_opens_after_consecutive_failures():
+    breaker = _breaker(threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.available()
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert breaker.opens == 1
+    assert not breaker.available()
+
+
+def test_success_resets_failure_count():
+    breaker = _breaker(threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_open_circuit_allows_trial_after_timeout():
+    breaker = _breaker(threshold=1)
+    breaker.record_failure()
+    assert not breaker.available()
+    _elapse(breaker, 10)
+    assert breaker.available()
+    breaker.begin()
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.available()  # one trial at a time
+
+
+def test_trial_success_closes():
+    breaker = _breaker(threshold=1)
+    breaker.record_failure()
+    _elapse(breaker, 10)
+    breaker.begin()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.failures == 0
+    assert breaker.available()
+
+
+def test_trial_failure_reopens():
+    breaker = _breaker(threshold=3)
+    for _ in range(3):
+        breaker.record_failure()
+    _elapse(breaker, 10)
+    breaker.begin()
+    breaker.record_failure()  # a single failure is enough in half-open
+    assert breaker.state == STATE_OPEN
+    assert breaker.opens == 2
+    assert not breaker.available()
+
+
+def test_stuck_trial_does_not_block_forever():
+    breaker = _breaker(threshold=1)
+    breaker.record_failure()
+    _elapse(breaker, 10)
+    breaker.begin()
+    assert not breaker.available()
+    _elapse(breaker, 10)
+    assert breaker.available()
+
+
+def test_begin_on_closed_circuit_is_a_no_op():
+    breaker = _breaker()
+    breaker.begin()
+    assert breaker.state == STATE_CLOSED
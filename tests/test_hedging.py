@@ -0,0 +1,139 @@
+"""Tests for the hedged establishment policy."""
+
+import asyncio
+
+import pytest
+
+from config import HedgeConfig
+from hedging import MIN_SAMPLES, RECOMPUTE_EVERY, HedgePolicy
+
+
+def _policy(**overrides) -> HedgePolicy:
+    settings = dict(enabled=True, percentile=50.0, min_delay=0.01, budget=1.0)
+    settings.update(overrides)
+    return HedgePolicy(HedgeConfig(**settings))
+
+
+def _warm(policy: HedgePolicy, seconds: float = 0.001, count: int = MIN_SAMPLES) -> None:
+    for _ in range(count):
+        policy._observe(seconds)
+
+
+def _attempts(*durations):
+    """An attempt() sleeping each duration in turn, then returning its index."""
+    calls = []
+
+    async def attempt():
+        index = len(calls)
+        calls.append(index)
+        await asyncio.sleep(durations[index])
+        return index
+
+    return attempt, calls
+
+
+def test_no_delay_before_enough_samples():
+    policy = _policy()
+    _warm(policy, count=MIN_SAMPLES - 1)
+    assert policy.delay() is None
+    _warm(policy, count=1)
+    assert policy.delay() is not None
+
+
+def test_delay_is_percentile_with_floor():
+    policy = _policy(percentile=50.0, min_delay=0.0)
+    for i in range(1, MIN_SAMPLES + 1):
+        policy._observe(i / 100)
+    assert policy.delay() == pytest.approx(MIN_SAMPLES / 2 / 100)
+
+    floored = _policy(min_delay=0.5)
+    _warm(floored)
+    assert floored.delay() == 0.5
+
+
+def test_delay_recomputed_every_few_samples():
+    policy = _policy(min_delay=0.0)
+    _warm(policy, 0.001)
+    assert policy.delay() == 0.001
+    _warm(policy, 1.0, count=RECOMPUTE_EVERY - 1)
+    assert policy.delay() == 0.001
+    _warm(policy, 1.0, count=MIN_SAMPLES)
+    assert policy.delay() == 1.0
+
+
+def test_stats_do_not_recompute_the_delay():
+    policy = _policy(min_delay=0.0)
+    _warm(policy, 0.002)
+    policy.delay()
+    _warm(policy, 1.0, count=MIN_SAMPLES * 2)
+    assert policy.stats()["delay_ms"] == 2.0
+    assert policy.stats()["delay_ms"] == 2.0
+    assert policy.delay() == 1.0
+
+
+def test_disabled_runs_a_single_attempt():
+    policy = _policy(enabled=False)
+    _warm(policy)
+    attempt, calls = _attempts(0.05)
+    assert asyncio.run(policy.run(attempt, lambda _: None, "test")) == 0
+    assert calls == [0]
+    assert policy.stats()["delay_ms"] is None
+
+
+def test_slow_attempt_is_hedged():
+    policy = _policy()
+    _warm(policy)
+    attempt, calls = _attempts(1.0, 0.0)
+    assert asyncio.run(policy.run(attempt, lambda _: None, "test")) == 1
+    assert calls == [0, 1]
+    assert (policy.hedged, policy.hedge_wins) == (1, 1)
+
+
+def test_fast_attempt_is_not_hedged():
+    policy = _policy(min_delay=0.5)
+    _warm(policy)
+    attempt, calls = _attempts(0.0)
+    assert asyncio.run(policy.run(attempt, lambda _: None, "test")) == 0
+    assert calls == [0]
+    assert policy.hedged == 0
+
+
+def test_losing_result_is_discarded():
+    policy = _policy()
+    _warm(policy)
+    discarded = []
+
+    async def stubborn():
+        # Like a connection completing as it is cancelled
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            return "late"
+
+    async def fast():
+        return "fast"
+
+    attempts = iter([stubborn, fast])
+
+    async def run():
+        result = await policy.run(lambda: next(attempts)(), discarded.append, "test")
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "fast"
+    assert discarded == ["late"]
+
+
+def test_budget_limits_hedges():
+    policy = _policy(budget=0.5)
+    _warm(policy)
+
+    attempt, calls = _attempts(0.05, 0.0)
+    assert asyncio.run(policy.run(attempt, lambda _: None, "test")) == 0
+    assert calls == [0]  # half a token saved: over budget
+    assert policy.over_budget == 1
+
+    attempt, calls = _attempts(1.0, 0.0)
+    assert asyncio.run(policy.run(attempt, lambda _: None, "test")) == 1
+    assert calls == [0, 1]
+    assert policy.hedged == 1
@@ -0,0 +1,328 @@
+"""Tests for http_parser: head parsing, body framing and body copying."""
+
+import asyncio
+
+import pytest
+
+from http_parser import (
+    FRAMING_CHUNKED,
+    FRAMING_CLOSE,
+    FRAMING_LENGTH,
+    FRAMING_NONE,
+    MAX_HEAD_SIZE,
+    MAX_HEADERS,
+    HeadTooLargeError,
+    HttpParseError,
+    TruncatedBodyError,
+    copy_body,
+    parse_connect_target,
+    parse_request_head,
+    parse_response_head,
+    read_request_head,
+    request_framing,
+    response_framing,
+)
+
+
+class _Writer:
+    """Collects what copy_body writes."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self.data += data
+
+    async def drain(self) -> None:
+        pass
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    """A reader holding data then EOF (call inside a running loop)."""
+    reader = asyncio.StreamReader(limit=MAX_HEAD_SIZE)
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def _copy(data: bytes, framing: str, length: int = 0) -> tuple[int, bytes]:
+    async def run():
+        writer = _Writer()
+        copied = await copy_body(_reader(data), writer, framing, length)
+        return copied, bytes(writer.data)
+    return asyncio.run(run())
+
+
+def _response(status: int = 200, headers: str = "") -> bytes:
+    return f"HTTP/1.1 {status} OK\r\n{headers}\r\n".encode()
+
+
+# Head parsing
+
+def test_parse_request_head():
+    head = parse_request_head(
+        b"get http://example.com/ HTTP/1.1\r\nHost: example.com\r\nX-A:  1 \r\n\r\n"
+    )
+    assert (head.method, head.target, head.version) == ("GET", "http://example.com/", "HTTP/1.1")
+    assert head.headers == [("host", "example.com"), ("x-a", "1")]
+    assert head.get("host") == "example.com"
+    assert head.get("missing", "default") == "default"
+
+
+def test_parse_request_head_skips_leading_empty_lines():
+    head = parse_request_head(b"\r\n\r\nGET / HTTP/1.1\r\nHost: a\r\n\r\n")
+    assert head.method == "GET"
+    assert head.get("host") == "a"
+
+
+def test_parse_response_head():
+    head = parse_response_head(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+    assert (head.version, head.status_code, head.reason) == ("HTTP/1.1", 404, "Not Found")
+    assert head.keep_alive
+
+
+def test_response_keep_alive():
+    assert not parse_response_head(b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n").keep_alive
+    assert not parse_response_head(b"HTTP/1.0 200 OK\r\n\r\n").keep_alive
+    assert parse_response_head(b"HTTP/1.0 200 OK\r\nConnection: keep-alive\r\n\r\n").keep_alive
+
+
+@pytest.mark.parametrize("raw", [
+    b"GET /\r\n\r\n",
+    b"GET / HTTP/1.1\r\n: no-name\r\n\r\n",
+    b"GET / HTTP/1.1\r\nno colon\r\n\r\n",
+    b"GET / HTTP/1.1\r\nTransfer-Encoding : chunked\r\n\r\n",
+    b"GET / HTTP/1.1\r\nTransfer-Encoding\t: chunked\r\n\r\n",
+    b"GET / HTTP/1.1\r\nHost: a\r\n Transfer-Encoding: chunked\r\n\r\n",
+    b"GET / HTTP/1.1\r\nHost: a\r\n\tTransfer-Encoding: chunked\r\n\r\n",
+    b"GET / HTTP/1.1\r\n Host: a\r\n\r\n",
+    b"GET / HTTP/1.1\r\nX(a): 1\r\n\r\n",
+    b"GET / HTTP/1.1\r\nX\xe9: 1\r\n\r\n",
+])
+def test_parse_request_head_rejects_malformed(raw):
+    with pytest.raises(HttpParseError):
+        parse_request_head(raw)
+
+
+@pytest.mark.parametrize("raw", [
+    b"HTTP/1.1\r\n\r\n",
+    b"HTTP/1.1 abc OK\r\n\r\n",
+    b"ICY 200 OK\r\n\r\n",
+])
+def test_parse_response_head_rejects_malformed(raw):
+    with pytest.raises(HttpParseError):
+        parse_response_head(raw)
+
+
+@pytest.mark.parametrize("raw", [
+    b"GET / HTTP/1.1\nHost: a\r\n\r\n",
+    b"GET / HTTP/1.1\r\nHost: a\nX-Smuggled: 1\r\n\r\n",
+    b"GET / HTTP/1.1\r\nHost: a\rX-Smuggled: 1\r\n\r\n",
+])
+def test_parse_head_rejects_bare_cr_lf(raw):
+    with pytest.raises(HttpParseError):
+        parse_request_head(raw)
+
+
+def test_parse_head_header_limit():
+    headers = b"".join(b"X-%d: v\r\n" % i for i in range(MAX_HEADERS))
+    assert len(parse_request_head(b"GET / HTTP/1.1\r\n" + headers + b"\r\n").headers) == MAX_HEADERS
+    with pytest.raises(HttpParseError):
+        parse_request_head(b"GET / HTTP/1.1\r\n" + headers + b"X-More: v\r\n\r\n")
+
+
+def _read_request_head(data: bytes):
+    async def run():
+        return await read_request_head(_reader(data))
+    return asyncio.run(run())
+
+
+def test_read_request_head():
+    assert _read_request_head(b"GET / HTTP/1.1\r\nHost: a\r\n\r\nbody").get("host") == "a"
+
+
+def test_read_request_head_too_large():
+    raw = b"GET / HTTP/1.1\r\nX-Big: " + b"a" * MAX_HEAD_SIZE + b"\r\n\r\n"
+    with pytest.raises(HeadTooLargeError):
+        _read_request_head(raw)
+
+
+def test_read_request_head_incomplete():
+    with pytest.raises(asyncio.IncompleteReadError):
+        _read_request_head(b"GET / HTTP/1.1\r\nHost: a\r\n")
+
+
+def test_parse_connect_target():
+    assert parse_connect_target("example.com:8443") == ("example.com", 8443)
+    assert parse_connect_target("example.com") == ("example.com", 443)
+    assert parse_connect_target("example.com:https") is None
+
+
+# Framing
+
+def test_request_framing():
+    assert request_framing(parse_request_head(b"GET / HTTP/1.1\r\n\r\n")) == (FRAMING_NONE, 0)
+    head = parse_request_head(b"POST / HTTP/1.1\r\nContent-Length: 12\r\n\r\n")
+    assert request_framing(head) == (FRAMING_LENGTH, 12)
+    head = parse_request_head(b"POST / HTTP/1.1\r\nContent-Length: 0\r\n\r\n")
+    assert request_framing(head) == (FRAMING_NONE, 0)
+    head = parse_request_head(b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip, Chunked\r\n\r\n")
+    assert request_framing(head) == (FRAMING_CHUNKED, 0)
+
+
+def test_response_framing():
+    head = parse_response_head(_response(headers="Content-Length: 7\r\n"))
+    assert response_framing(head, "GET") == (FRAMING_LENGTH, 7)
+    assert response_framing(head, "HEAD") == (FRAMING_NONE, 0)
+    head = parse_response_head(_response(headers="Content-Length: 0\r\n"))
+    assert response_framing(head, "GET") == (FRAMING_LENGTH, 0)
+    head = parse_response_head(_response(headers="Transfer-Encoding: chunked\r\n"))
+    assert response_framing(head, "GET") == (FRAMING_CHUNKED, 0)
+    assert response_framing(parse_response_head(_response()), "GET") == (FRAMING_CLOSE, 0)
+
+
+def test_transfer_encoding_all_headers_count():
+    head = parse_request_head(
+        b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n"
+    )
+    assert request_framing(head) == (FRAMING_CHUNKED, 0)
+    head = parse_response_head(_response(headers="Transfer-Encoding: chunked\r\nTransfer-Encoding: gzip\r\n"))
+    assert response_framing(head, "GET") == (FRAMING_CLOSE, 0)
+
+
+@pytest.mark.parametrize("headers", [
+    "Transfer-Encoding: gzip\r\n",
+    "Transfer-Encoding: chunked, gzip\r\n",
+    "Transfer-Encoding: chunked\r\nTransfer-Encoding: gzip\r\n",
+    "Transfer-Encoding: xchunked\r\n",
+])
+def test_request_transfer_encoding_must_end_with_chunked(headers):
+    with pytest.raises(HttpParseError):
+        request_framing(parse_request_head(b"POST / HTTP/1.1\r\n" + headers.encode() + b"\r\n"))
+
+
+@pytest.mark.parametrize("headers", [
+    "Transfer-Encoding: chunked\r\nContent-Length: 3\r\n",
+    "Transfer-Encoding: gzip\r\nTransfer-Encoding: chunked\r\nContent-Length: 3\r\n",
+])
+def test_transfer_encoding_with_content_length_rejected(headers):
+    with pytest.raises(HttpParseError):
+        request_framing(parse_request_head(b"POST / HTTP/1.1\r\n" + headers.encode() + b"\r\n"))
+    with pytest.raises(HttpParseError):
+        response_framing(parse_response_head(_response(headers=headers)), "GET")
+
+
+@pytest.mark.parametrize("status", [100, 101, 204, 304])
+def test_response_framing_without_body(status):
+    head = parse_response_head(_response(status, "Content-Length: 10\r\n"))
+    assert response_framing(head, "GET") == (FRAMING_NONE, 0)
+
+
+def test_content_length_repeated_same_value():
+    head = parse_response_head(_response(headers="Content-Length: 5\r\nContent-Length: 5, 5\r\n"))
+    assert response_framing(head, "GET") == (FRAMING_LENGTH, 5)
+
+
+@pytest.mark.parametrize("headers", [
+    "Content-Length: 5\r\nContent-Length: 6\r\n",
+    "Content-Length: 5, 6\r\n",
+    "Content-Length: -1\r\n",
+    "Content-Length: +5\r\n",
+    "Content-Length: 1_0\r\n",
+    "Content-Length: 0x10\r\n",
+    "Content-Length: \r\n",
+])
+def test_content_length_rejected(headers):
+    with pytest.raises(HttpParseError):
+        response_framing(parse_response_head(_response(headers=headers)), "GET")
+    with pytest.raises(HttpParseError):
+        request_framing(parse_request_head(b"POST / HTTP/1.1\r\n" + headers.encode() + b"\r\n"))
+
+
+def test_content_length_non_ascii_digits_rejected():
+    raw = b"POST / HTTP/1.1\r\nContent-Length: \xb2\r\n\r\n"  # superscript two in latin-1
+    with pytest.raises(HttpParseError):
+        request_framing(parse_request_head(raw))
+
+
+# Body copying
+
+def test_copy_length():
+    assert _copy(b"hello world, and more", FRAMING_LENGTH, 11) == (11, b"hello world")
+
+
+def test_copy_length_truncated():
+    with pytest.raises(TruncatedBodyError) as info:
+        _copy(b"hello", FRAMING_LENGTH, 11)
+    assert info.value.copied == 5
+    assert info.value.expected == 11
+
+
+def test_copy_close():
+    assert _copy(b"until the end", FRAMING_CLOSE) == (13, b"until the end")
+
+
+def test_copy_none():
+    assert _copy(b"ignored", FRAMING_NONE) == (0, b"")
+
+
+def test_copy_chunked_forwarded_as_is():
+    body = b"5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n"
+    assert _copy(body + b"next request", FRAMING_CHUNKED) == (len(body), body)
+
+
+def test_copy_chunked_size_with_extension_whitespace():
+    body = b"5 ;ext\r\nhello\r\n0\r\n\r\n"
+    assert _copy(body, FRAMING_CHUNKED) == (len(body), body)
+
+
+@pytest.mark.parametrize("size", [b"zz", b"-1", b"0x5", b"+5", b"1_0", b" 5", b"5 ", b"", b"1" * 17])
+def test_copy_chunked_invalid_size(size):
+    with pytest.raises(HttpParseError):
+        _copy(size + b"\r\nhello\r\n0\r\n\r\n", FRAMING_CHUNKED)
+
+
+def test_copy_chunked_smuggled_request_rejected():
+    with pytest.raises(HttpParseError):
+        _copy(b"-1\r\nX0\r\n\r\nGET /smuggled HTTP/1.1\r\n\r\n", FRAMING_CHUNKED)
+
+
+@pytest.mark.parametrize("body", [
+    b"5\r\nhelloXY0\r\n\r\n",
+    b"5\r\nhello\n0\r\n\r\n",
+    b"3\r\nhello\r\n0\r\n\r\n",
+])
+def test_copy_chunked_data_not_followed_by_crlf(body):
+    with pytest.raises(HttpParseError):
+        _copy(body, FRAMING_CHUNKED)
+
+
+@pytest.mark.parametrize("body", [
+    b"5;a\nb\r\nhello\r\n0\r\n\r\n",
+    b"0\r\nX-Trailer: a\nb\r\n\r\n",
+])
+def test_copy_chunked_bare_lf_rejected(body):
+    with pytest.raises(HttpParseError):
+        _copy(body, FRAMING_CHUNKED)
+
+
+def test_copy_chunked_line_too_long():
+    with pytest.raises(HttpParseError):
+        _copy(b"5;" + b"x" * MAX_HEAD_SIZE + b"\r\nhello\r\n0\r\n\r\n", FRAMING_CHUNKED)
+
+
+def test_copy_chunked_trailers_too_large():
+    trailers = b"X-T: " + b"x" * 1000 + b"\r\n"
+    with pytest.raises(HttpParseError):
+        _copy(b"0\r\n" + trailers * 70 + b"\r\n", FRAMING_CHUNKED)
+
+
+@pytest.mark.parametrize("body", [
+    b"5\r\nhel",
+    b"5\r\nhello\r\n",
+    b"5\r\nhello\r\n0\r\nX-Trailer: 1\r\n",
+    b"5\r\nhello\r",
+])
+def test_copy_chunked_truncated(body):
+    with pytest.raises(TruncatedBodyError):
+        _copy(body, FRAMING_CHUNKED)
@@ -0,0 +1,115 @@
+"""Tests for the caching, coalescing DNS resolver."""
+
+import asyncio
+import socket
+
+import pytest
+
+from config import DnsConfig
+from resolver import Resolver
+
+INFOS = [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", ("192.0.2.1", 80))]
+
+
+class _Lookups:
+    """Stands in for loop.getaddrinfo, counting the lookups made."""
+
+    def __init__(self, result=INFOS, delay: float = 0.01):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, host, port, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def _run(lookups: _Lookups, body):
+    async def run():
+        asyncio.get_running_loop().getaddrinfo = lookups
+        return await body()
+    return asyncio.run(run())
+
+
+def test_concurrent_lookups_are_coalesced():
+    resolver = Resolver(DnsConfig())
+    lookups = _Lookups()
+
+    async def body():
+        return await asyncio.gather(*(resolver.resolve("proxy", 80) for _ in range(5)))
+
+    assert _run(lookups, body) == [INFOS] * 5
+    assert lookups.calls == 1
+    assert (resolver.misses, resolver.coalesced) == (1, 4)
+
+
+def test_results_are_cached_until_ttl():
+    resolver = Resolver(DnsConfig(ttl=60))
+    lookups = _Lookups()
+
+    async def body():
+        await resolver.resolve("proxy", 80)
+        await resolver.resolve("proxy", 80)
+        resolver._cache[("proxy", 80)].expires = 0
+        await resolver.resolve("proxy", 80)
+
+    _run(lookups, body)
+    assert lookups.calls == 2
+    assert (resolver.hits, resolver.misses) == (1, 2)
+
+
+def test_ttl_zero_disables_cache():
+    resolver = Resolver(DnsConfig(ttl=0))
+    lookups = _Lookups()
+
+    async def body():
+        await resolver.resolve("proxy", 80)
+        await resolver.resolve("proxy", 80)
+
+    _run(lookups, body)
+    assert lookups.calls == 2
+
+
+def test_failures_are_cached_for_negative_ttl():
+    resolver = Resolver(DnsConfig(negative_ttl=5))
+    lookups = _Lookups(socket.gaierror(socket.EAI_NONAME, "not found"))
+
+    async def body():
+        for _ in range(2):
+            with pytest.raises(socket.gaierror):
+                await resolver.resolve("missing", 80)
+
+    _run(lookups, body)
+    assert lookups.calls == 1
+    assert (resolver.failures, resolver.negative_hits) == (1, 1)
+
+
+def test_caller_timeout_does_not_cancel_shared_lookup():
+    resolver = Resolver(DnsConfig())
+    lookups = _Lookups(delay=0.05)
+
+    async def body():
+        impatient = asyncio.wait_for(resolver.resolve("proxy", 80), 0.01)
+        patient = resolver.resolve("proxy", 80)
+        return await asyncio.gather(impatient, patient, return_exceptions=True)
+
+    impatient, patient = _run(lookups, body)
+    assert isinstance(impatient, asyncio.TimeoutError)
+    assert patient == INFOS
+    assert lookups.calls == 1
+
+
+def test_ip_literals_skip_lookup():
+    resolver = Resolver(DnsConfig())
+    lookups = _Lookups()
+
+    async def body():
+        return await resolver.resolve("127.0.0.1", 80), await resolver.resolve("[::1]", 80)
+
+    v4, v6 = _run(lookups, body)
+    assert v4[0][0] == socket.AF_INET and v4[0][4] == ("127.0.0.1", 80)
+    assert v6[0][0] == socket.AF_INET6 and v6[0][4][0] == "::1"
+    assert lookups.calls == 0
@@ -0,0 +1,128 @@
+"""Tests for the CONNECT retry policy."""
+
+import asyncio
+
+import pytest
+
+import metrics
+from config import RetryConfig
+from retry import RetryPolicy
+from tunnel import CorporateRefusedError, TunnelError, UpstreamUnavailableError
+
+
+def _policy(**overrides) -> RetryPolicy:
+    settings = dict(max_attempts=3, backoff_base=0.0, backoff_max=0.0, deadline=5.0, attempt_timeout=1.0)
+    settings.update(overrides)
+    return RetryPolicy(RetryConfig(**settings))
+
+
+def _attempts(*outcomes):
+    """An attempt() returning or raising each outcome in turn; counts calls."""
+    calls = []
+
+    async def attempt():
+        outcome = outcomes[len(calls)]
+        calls.append(outcome)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if callable(outcome):
+            return await outcome()
+        return outcome
+
+    return attempt, calls
+
+
+def test_first_attempt_succeeds():
+    policy = _policy()
+    attempt, calls = _attempts("tunnel")
+    assert asyncio.run(policy.run(attempt, "test")) == "tunnel"
+    assert len(calls) == 1
+    assert policy.stats() == {"retries": 0, "recovered": 0, "exhausted": 0}
+
+
+def test_recovers_after_retryable_failure():
+    policy = _policy()
+    attempt, calls = _attempts(TunnelError("bad gateway", 502), TunnelError("timeout", 504), "tunnel")
+    assert asyncio.run(policy.run(attempt, "test")) == "tunnel"
+    assert len(calls) == 3
+    assert policy.stats() == {"retries": 2, "recovered": 1, "exhausted": 0}
+
+
+def test_gives_up_after_max_attempts():
+    policy = _policy(max_attempts=2)
+    errors = [TunnelError("first", 502), TunnelError("last", 502), "never"]
+    attempt, calls = _attempts(*errors)
+    with pytest.raises(TunnelError) as info:
+        asyncio.run(policy.run(attempt, "test"))
+    assert info.value is errors[1]
+    assert len(calls) == 2
+    assert policy.stats() == {"retries": 1, "recovered": 0, "exhausted": 1}
+
+
+def test_non_retryable_status_fails_at_once():
+    policy = _policy()
+    error = TunnelError("forbidden", 403)
+    attempt, calls = _attempts(error, "never")
+    with pytest.raises(TunnelError) as info:
+        asyncio.run(policy.run(attempt, "test"))
+    assert info.value is error
+    assert len(calls) == 1
+    assert policy.stats()["exhausted"] == 0
+
+
+def test_no_upstream_available_fails_at_once():
+    policy = _policy()
+    attempt, calls = _attempts(UpstreamUnavailableError("all circuits open"), "never")
+    with pytest.raises(UpstreamUnavailableError):
+        asyncio.run(policy.run(attempt, "test"))
+    assert len(calls) == 1
+
+
+def test_corporate_refusal_fails_at_once():
+    policy = _policy(statuses=[407, 502, 503, 504])
+    attempt, calls = _attempts(CorporateRefusedError("Corporate proxy returned 407", 407), "never")
+    with pytest.raises(CorporateRefusedError):
+        asyncio.run(policy.run(attempt, "test"))
+    assert len(calls) == 1
+
+
+def test_slow_attempt_is_abandoned_and_retried():
+    async def hang():
+        await asyncio.sleep(10)
+
+    policy = _policy(attempt_timeout=0.05)
+    attempt, calls = _attempts(hang, "tunnel")
+    assert asyncio.run(policy.run(attempt, "test")) == "tunnel"
+    assert len(calls) == 2
+    assert policy.stats()["recovered"] == 1
+
+
+def test_attempt_timeout_counted():
+    async def hang():
+        await asyncio.sleep(10)
+
+    counter = metrics.TIMEOUTS[metrics.HOP_ATTEMPT]
+    before = counter.value
+    attempt, _ = _attempts(hang, "tunnel")
+    asyncio.run(_policy(attempt_timeout=0.05).run(attempt, "test"))
+    assert counter.value == before + 1
+
+
+def test_deadline_bounds_all_attempts():
+    async def hang():
+        await asyncio.sleep(10)
+
+    policy = _policy(max_attempts=10, deadline=0.1, attempt_timeout=0.08)
+    attempt, calls = _attempts(*[hang] * 10)
+    with pytest.raises(TunnelError) as info:
+        asyncio.run(policy.run(attempt, "test"))
+    assert info.value.status_code == 502
+    assert "0.1s" in info.value.message
+    assert len(calls) == 2
+
+
+def test_backoff_is_capped_and_jittered():
+    policy = _policy(backoff_base=0.1, backoff_max=0.3)
+    for attempt in range(1, 10):
+        ceiling = min(0.3, 0.1 * 2 ** (attempt - 1))
+        assert 0 <= policy.backoff(attempt) <= ceiling
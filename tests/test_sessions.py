@@ -0,0 +1,98 @@
+"""Tests for the sticky session table."""
+
+import base64
+
+from config import ProxyConfig, SessionConfig
+from http_parser import parse_request_head
+from sessions import Sessions
+
+
+def _sessions(**overrides) -> Sessions:
+    settings = dict(enabled=True)
+    settings.update(overrides)
+    return Sessions(SessionConfig(**settings))
+
+
+def _head(*headers: str):
+    lines = "".join(f"{header}\r\n" for header in headers)
+    return parse_request_head(f"CONNECT a:443 HTTP/1.1\r\n{lines}\r\n".encode())
+
+
+def _basic(username: str) -> str:
+    return "Proxy-Authorization: Basic " + base64.b64encode(f"{username}:pw".encode()).decode()
+
+
+def test_disabled():
+    assert _sessions(enabled=False).lookup(_head(), "10.0.0.1") is None
+
+
+def test_same_key_same_session():
+    sessions = _sessions()
+    first = sessions.lookup(_head(), "10.0.0.1")
+    assert sessions.lookup(_head(), "10.0.0.1") is first
+    assert sessions.lookup(_head(), "10.0.0.2") is not first
+    assert sessions.stats() == {"active": 2, "created": 2, "reused": 1, "expired": 0, "evicted": 0}
+
+
+def test_header_key():
+    sessions = _sessions(key="header")
+    assert sessions.lookup(_head(), "10.0.0.1") is None
+    first = sessions.lookup(_head("X-Mooltiroute-Session: cart"), "10.0.0.1")
+    assert sessions.lookup(_head("X-Mooltiroute-Session: cart"), "10.0.0.2") is first
+
+
+def test_username_key():
+    sessions = _sessions(key="username")
+    assert sessions.lookup(_head(_basic("crawler")), "10.0.0.1") is None
+    first = sessions.lookup(_head(_basic("crawler-session-42")), "10.0.0.1")
+    assert first.key == "42"
+    assert sessions.lookup(_head(_basic("other-session-42")), "10.0.0.2") is first
+    assert sessions.lookup(_head("Proxy-Authorization: Basic !!!"), "10.0.0.1") is None
+
+
+def test_unused_session_expires_after_ttl():
+    sessions = _sessions(ttl=60)
+    first = sessions.lookup(_head(), "10.0.0.1")
+    first.last_used -= 59
+    assert sessions.lookup(_head(), "10.0.0.1") is first  # refreshed
+    first.last_used -= 60
+    second = sessions.lookup(_head(), "10.0.0.1")
+    assert second is not first
+    assert second.id != first.id
+    assert sessions.stats()["expired"] == 1
+
+
+def test_stats_expire_sessions():
+    sessions = _sessions(ttl=60)
+    sessions.lookup(_head(), "10.0.0.1").last_used -= 60
+    assert sessions.stats()["active"] == 0
+
+
+def test_least_recently_used_evicted():
+    sessions = _sessions(max_sessions=2)
+    first = sessions.lookup(_head(), "10.0.0.1")
+    sessions.lookup(_head(), "10.0.0.2")
+    sessions.lookup(_head(), "10.0.0.1")  # 10.0.0.2 is now the oldest
+    sessions.lookup(_head(), "10.0.0.3")
+    assert sessions.stats()["evicted"] == 1
+    assert sessions.lookup(_head(), "10.0.0.1") is first
+    assert sessions.stats()["created"] == 3
+
+
+def test_session_username():
+    session = _sessions().lookup(_head(), "10.0.0.1")
+    webshare = ProxyConfig("ws", 80, "user", "secret")
+    proxy = session.proxy(webshare)
+    assert proxy.username == f"user-session-{session.id}"
+    assert proxy.password == "secret"
+    assert proxy.auth_line != webshare.auth_line
+    assert session.proxy(webshare) is proxy
+
+
+def test_reconfigure_forgets_sessions_when_key_changes():
+    sessions = _sessions()
+    first = sessions.lookup(_head(), "10.0.0.1")
+    sessions.reconfigure(SessionConfig(enabled=True, ttl=5))
+    assert sessions.lookup(_head(), "10.0.0.1") is first
+    sessions.reconfigure(SessionConfig(enabled=True, key="header"))
+    assert sessions.stats()["active"] == 0
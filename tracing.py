@@ -0,0 +1,127 @@
+"""Per-connection phase tracing for Mooltiroute."""
+
+from __future__ import annotations
+
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from config import TracingConfig
+
+logger = logging.getLogger("mooltiroute.trace")
+
+FIRST_BYTE_UPSTREAM = "first_byte_client_to_upstream"
+FIRST_BYTE_DOWNSTREAM = "first_byte_upstream_to_client"
+
+# Events marking the moment a client can start using its connection
+# (tunnel_ready: the tunnel behind an optimistic 200 is established)
+READY_EVENTS = ("connect_200_sent", "tunnel_ready", "response_head")
+
+_current: ContextVar[Trace | None] = ContextVar("mooltiroute_trace", default=None)
+
+
+class Trace:
+    """Timeline of one client connection: (event, monotonic time) pairs."""
+
+    __slots__ = ("client", "target", "started", "events")
+
+    def __init__(self, client: str):
+        self.client = client
+        self.target = ""
+        self.started = time.monotonic()
+        self.events: list[tuple[str, float]] = []
+
+    def mark(self, event: str) -> None:
+        self.events.append((event, time.monotonic()))
+
+    def mark_first(self, event: str) -> None:
+        """Mark event unless it was already recorded (first byte markers)."""
+        if not any(name == event for name, _ in self.events):
+            self.mark(event)
+
+    def setup_time(self, now: float) -> float:
+        """Seconds until the connection was ready (whole lifetime if never)."""
+        for event, at in self.events:
+            if event in READY_EVENTS:
+                return at - self.started
+        return now - self.started
+
+    def record(self, now: float) -> dict:
+        return {
+            "client": self.client,
+            "target": self.target,
+            "setup_ms": round(self.setup_time(now) * 1000, 2),
+            "total_ms": round((now - self.started) * 1000, 2),
+            "events": [[event, round((at - self.started) * 1000, 2)] for event, at in self.events],
+        }
+
+
+class Tracer:
+    """
+    Create connection traces and log the interesting ones.
+
+    A trace is logged as one JSON line on the mooltiroute.trace logger
+    when the connection took longer than slow_threshold to become ready
+    (tunnel established or response head received), or when it is picked
+    by sample_rate. Long-lived tunnels are therefore not reported as slow
+    just for staying open.
+    """
+
+    def __init__(self, config: TracingConfig):
+        self.config = config
+        self.logged = 0
+
+    def start(self, client_addr) -> Trace | None:
+        """
+        Begin a trace for a newly accepted connection (None when disabled).
+
+        The caller makes it current with activate() in the task serving
+        the connection; tasks it creates inherit it.
+        """
+        if not self.config.enabled:
+            return None
+        client = f"{client_addr[0]}:{client_addr[1]}" if client_addr else "?"
+        return Trace(client)
+
+    def finish(self, trace: Trace | None) -> None:
+        """Close the trace and log it if slow or sampled."""
+        if trace is None:
+            return
+        trace.mark("close")
+        now = time.monotonic()
+        if (
+            trace.setup_time(now) >= self.config.slow_threshold
+            or random.random() < self.config.sample_rate
+        ):
+            self.logged += 1
+            logger.info(json.dumps(trace.record(now), separators=(",", ":")))
+
+
+def activate(trace: Trace | None) -> None:
+    """Make trace the current one in this task."""
+    _current.set(trace)
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def mark(event: str) -> None:
+    """Record an event on the current connection's trace, if any."""
+    trace = _current.get()
+    if trace is not None:
+        trace.events.append((event, time.monotonic()))
+
+
+def mark_first(event: str) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.mark_first(event)
+
+
+def set_target(target: str) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.target = target
@@ -4,14 +4,31 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
 from asyncio import StreamReader, StreamWriter
+from functools import lru_cache
 
+import metrics
+import tracing
 from config import ProxyConfig
+from connector import Connector, default_connector
+from http_parser import HttpParseError, read_response_head
+from relay import (
+    ENGINE_STREAM,
+    READ_SIZE_MIN,
+    WRITE_BUFFER_HIGH,
+    RelayDeadline,
+    next_read_size,
+    relay_sockets,
+    set_write_limits,
+)
 
 logger = logging.getLogger("mooltiroute.tunnel")
 
 CONNECT_TIMEOUT = 30  # seconds
-BUFFER_SIZE = 65536
+CONNECT_CACHE_SIZE = 256  # CONNECT requests kept ready, per target and credentials
+# Corporate proxy answers meaning webshare could not be reached through it
+CORPORATE_GATEWAY_ERRORS = (502, 504)
 
 
 class TunnelError(Exception):
@@ -23,62 +40,112 @@ class TunnelError(Exception):
         super().__init__(message)
 
 
+class UpstreamClosedError(TunnelError):
+    """Upstream closed the connection before answering a CONNECT."""
+
+
+class CorporateProxyError(TunnelError):
+    """
+    The corporate proxy could not be reached.
+
+    Charged to the corporate proxy's circuit breaker, not to the webshare
+    upstream the tunnel was meant for.
+    """
+
+
+class UpstreamUnavailableError(TunnelError):
+    """No usable upstream proxy (every circuit breaker is open)."""
+
+    def __init__(self, message: str):
+        super().__init__(message, status_code=503)
+
+
+class ProxyRefusedError(TunnelError):
+    """
+    The proxy answered the target CONNECT with a non-2xx status.
+
+    The proxy itself is reachable; the target or the credentials are the
+    problem. A corporate proxy answering the CONNECT to webshare with a
+    gateway error raises a plain TunnelError instead: for us, webshare is
+    unreachable.
+    """
+
+
+class CorporateRefusedError(TunnelError):
+    """
+    The corporate proxy refused the CONNECT to webshare (407, 403...).
+
+    A corporate misconfiguration (credentials, ACL): charged to no
+    circuit breaker, so it does not open every webshare upstream in
+    turn, and not retried.
+    """
+
+
 def _build_connect_request(
     target_host: str,
     target_port: int,
     proxy: ProxyConfig,
 ) -> bytes:
     """Build CONNECT request bytes."""
-    lines = [
-        f"CONNECT {target_host}:{target_port} HTTP/1.1",
-        f"Host: {target_host}:{target_port}",
-    ]
+    return _connect_request(target_host, target_port, proxy.auth_line)
 
-    if proxy.requires_auth:
-        lines.append(f"Proxy-Authorization: {proxy.auth_header}")
 
-    lines.extend(["", ""])
-    return "\r\n".join(lines).encode()
+@lru_cache(maxsize=CONNECT_CACHE_SIZE)
+def _connect_request(target_host: str, target_port: int, auth_line: bytes) -> bytes:
+    # Cached on the preencoded auth line: bytes cache their hash
+    target = f"{target_host}:{target_port}".encode()
+    return b"CONNECT %s HTTP/1.1\r\nHost: %s\r\n%s\r\n" % (target, target, auth_line)
 
 
-async def _read_connect_response(reader: StreamReader) -> tuple[int, str]:
-    """Read and parse CONNECT response. Returns (status_code, status_message)."""
+async def _read_connect_response(
+    reader: StreamReader,
+    hop: str,
+    started: float,
+) -> tuple[int, str]:
+    """
+    Read and parse CONNECT response. Returns (status_code, status_message).
+
+    hop is the metrics hop of the proxy answering (metrics.HOP_CORPORATE
+    or metrics.HOP_WEBSHARE) and started the time the CONNECT was sent.
+    """
     try:
-        response_line = await asyncio.wait_for(
-            reader.readline(),
+        head = await asyncio.wait_for(
+            read_response_head(reader),
             timeout=CONNECT_TIMEOUT,
         )
     except asyncio.TimeoutError:
+        metrics.TIMEOUTS[hop].inc()
         raise TunnelError("Timeout reading CONNECT response")
-
-    if not response_line:
-        raise TunnelError("Empty response from proxy")
-
-    try:
-        response_str = response_line.decode().strip()
-        parts = response_str.split(" ", 2)
-        if len(parts) < 2:
-            raise TunnelError(f"Invalid response: {response_str}")
-
-        status_code = int(parts[1])
-        status_message = parts[2] if len(parts) > 2 else ""
-    except (ValueError, IndexError) as e:
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            raise UpstreamClosedError("Empty response from proxy")
+        raise TunnelError("Connection closed while reading CONNECT response")
+    except HttpParseError as e:
         raise TunnelError(f"Failed to parse response: {e}")
 
-    # Read and discard headers until empty line
-    while True:
-        try:
-            header_line = await asyncio.wait_for(
-                reader.readline(),
-                timeout=CONNECT_TIMEOUT,
-            )
-        except asyncio.TimeoutError:
-            raise TunnelError("Timeout reading response headers")
+    metrics.SETUP[hop].observe(time.monotonic() - started)
+    metrics.record_status(hop, head.status_code)
+    tracing.mark(hop)
+    return head.status_code, head.reason
 
-        if header_line in (b"\r\n", b"\n", b""):
-            break
 
-    return status_code, status_message
+async def _open_proxy_connection(
+    proxy: ProxyConfig,
+    connector: Connector | None,
+) -> tuple[StreamReader, StreamWriter]:
+    """Connect to a proxy, racing its addresses, within CONNECT_TIMEOUT."""
+    connector = connector or default_connector
+    started = time.monotonic()
+    try:
+        connection = await asyncio.wait_for(
+            connector.open_connection(proxy.host, proxy.port),
+            timeout=CONNECT_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        metrics.TIMEOUTS[metrics.HOP_TCP].inc()
+        raise
+    metrics.SETUP[metrics.HOP_TCP].observe(time.monotonic() - started)
+    return connection
 
 
 async def create_tunnel(
@@ -86,6 +153,7 @@ async def create_tunnel(
     target_port: int,
     proxy: ProxyConfig,
     existing_connection: tuple[StreamReader, StreamWriter] | None = None,
+    connector: Connector | None = None,
 ) -> tuple[StreamReader, StreamWriter]:
     """
     Establish a CONNECT tunnel to target via proxy.
@@ -100,10 +168,7 @@ async def create_tunnel(
         reader, writer = existing_connection
     else:
         try:
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(proxy.host, proxy.port),
-                timeout=CONNECT_TIMEOUT,
-            )
+            reader, writer = await _open_proxy_connection(proxy, connector)
         except asyncio.TimeoutError:
             raise TunnelError(f"Connection timeout to {proxy.host}:{proxy.port}")
         except OSError as e:
@@ -111,19 +176,29 @@ async def create_tunnel(
 
     # Send CONNECT request
     connect_request = _build_connect_request(target_host, target_port, proxy)
+    started = time.monotonic()
     writer.write(connect_request)
     await writer.drain()
 
     logger.debug(f"Sent CONNECT to {target_host}:{target_port} via {proxy.host}:{proxy.port}")
 
     # Read response
-    status_code, status_message = await _read_connect_response(reader)
+    try:
+        status_code, status_message = await _read_connect_response(
+            reader,
+            metrics.HOP_WEBSHARE,
+            started,
+        )
+    except BaseException:
+        if not existing_connection:
+            writer.close()
+        raise
 
     if not 200 <= status_code < 300:
         if not existing_connection:
             writer.close()
             await writer.wait_closed()
-        raise TunnelError(
+        raise ProxyRefusedError(
             f"Proxy returned {status_code} {status_message}",
             status_code=status_code,
         )
@@ -132,54 +207,158 @@ async def create_tunnel(
     return reader, writer
 
 
-async def create_chained_tunnel(
-    target_host: str,
-    target_port: int,
+async def _open_corporate_connection(
     corporate: ProxyConfig,
-    webshare: ProxyConfig,
+    connector: Connector | None,
 ) -> tuple[StreamReader, StreamWriter]:
-    """
-    Create double tunnel: corporate -> webshare -> target.
+    """Connect to the corporate proxy, as a CorporateProxyError on failure."""
+    try:
+        return await _open_proxy_connection(corporate, connector)
+    except asyncio.TimeoutError:
+        raise CorporateProxyError(f"Connection timeout to corporate proxy {corporate.host}:{corporate.port}")
+    except OSError as e:
+        raise CorporateProxyError(f"Connection failed to corporate proxy {corporate.host}:{corporate.port}: {e}")
 
-    1. Connect to corporate proxy
-    2. CONNECT to webshare via corporate
-    3. CONNECT to target via webshare
+
+async def _expect_connect_success(
+    reader: StreamReader,
+    writer: StreamWriter,
+    hop: str,
+    started: float,
+) -> None:
     """
-    logger.debug(f"Creating chained tunnel to {target_host}:{target_port}")
+    Read the CONNECT response of hop, closing writer unless it is a 2xx.
 
-    # Step 1: Connect to corporate proxy and establish tunnel to webshare
+    A corporate proxy that cannot reach webshare (CORPORATE_GATEWAY_ERRORS)
+    raises a plain TunnelError, one refusing the CONNECT otherwise
+    CorporateRefusedError, and a webshare proxy refusing the target
+    ProxyRefusedError.
+    """
     try:
-        reader, writer = await asyncio.wait_for(
-            asyncio.open_connection(corporate.host, corporate.port),
-            timeout=CONNECT_TIMEOUT,
+        status_code, status_message = await _read_connect_response(reader, hop, started)
+    except BaseException:
+        # Also when cancelled, e.g. as the losing attempt of a hedge
+        writer.close()
+        raise
+
+    if not 200 <= status_code < 300:
+        writer.close()
+        await writer.wait_closed()
+        if hop == metrics.HOP_CORPORATE:
+            error = TunnelError if status_code in CORPORATE_GATEWAY_ERRORS else CorporateRefusedError
+            raise error(
+                f"Corporate proxy returned {status_code} {status_message}",
+                status_code=status_code,
+            )
+        raise ProxyRefusedError(
+            f"Webshare proxy returned {status_code} {status_message}",
+            status_code=status_code,
         )
-    except asyncio.TimeoutError:
-        raise TunnelError(f"Connection timeout to corporate proxy {corporate.host}:{corporate.port}")
-    except OSError as e:
-        raise TunnelError(f"Connection failed to corporate proxy {corporate.host}:{corporate.port}: {e}")
 
-    # Step 2: CONNECT to webshare through corporate proxy
+    logger.debug(f"{hop}: {status_code} {status_message}")
+
+
+async def open_webshare_leg(
+    corporate: ProxyConfig,
+    webshare: ProxyConfig,
+    connector: Connector | None = None,
+) -> tuple[StreamReader, StreamWriter]:
+    """
+    Open a tunnel to webshare through the corporate proxy.
+
+    The returned connection speaks directly to webshare and is ready
+    for a target CONNECT (see create_chained_tunnel).
+    """
+    reader, writer = await _open_corporate_connection(corporate, connector)
+
     connect_to_webshare = _build_connect_request(
         webshare.host,
         webshare.port,
         corporate,
     )
+    started = time.monotonic()
     writer.write(connect_to_webshare)
     await writer.drain()
 
     logger.debug(f"Sent CONNECT to {webshare.host}:{webshare.port} via corporate proxy")
 
-    status_code, status_message = await _read_connect_response(reader)
+    await _expect_connect_success(reader, writer, metrics.HOP_CORPORATE, started)
+    return reader, writer
+
 
-    if not 200 <= status_code < 300:
-        writer.close()
-        await writer.wait_closed()
-        raise TunnelError(
-            f"Corporate proxy returned {status_code} {status_message}",
-            status_code=status_code,
+async def _create_pipelined_chain(
+    target_host: str,
+    target_port: int,
+    corporate: ProxyConfig,
+    webshare: ProxyConfig,
+    connector: Connector | None,
+) -> tuple[StreamReader, StreamWriter]:
+    """
+    Send both CONNECTs of the chain in one write, then read both answers.
+
+    The corporate proxy relays the webshare CONNECT as soon as its tunnel
+    is up, which saves the round trip of waiting for its 200 first. The
+    answers arrive in order, so a refusal is attributed to the hop whose
+    answer it is.
+    """
+    reader, writer = await _open_corporate_connection(corporate, connector)
+
+    started = time.monotonic()
+    try:
+        writer.write(
+            _build_connect_request(webshare.host, webshare.port, corporate)
+            + _build_connect_request(target_host, target_port, webshare)
         )
+        await writer.drain()
+    except OSError as e:
+        writer.close()
+        raise CorporateProxyError(f"Connection to corporate proxy lost: {e}")
+
+    logger.debug(f"Sent pipelined CONNECTs to {target_host}:{target_port} via corporate and webshare")
+
+    await _expect_connect_success(reader, writer, metrics.HOP_CORPORATE, started)
+    # Webshare only sees its CONNECT once the corporate tunnel is up
+    await _expect_connect_success(reader, writer, metrics.HOP_WEBSHARE, time.monotonic())
+    return reader, writer
+
+
+async def create_chained_tunnel(
+    target_host: str,
+    target_port: int,
+    corporate: ProxyConfig,
+    webshare: ProxyConfig,
+    existing_connection: tuple[StreamReader, StreamWriter] | None = None,
+    connector: Connector | None = None,
+    pipeline: bool = False,
+) -> tuple[StreamReader, StreamWriter]:
+    """
+    Create double tunnel: corporate -> webshare -> target.
+
+    1. Connect to corporate proxy
+    2. CONNECT to webshare via corporate
+    3. CONNECT to target via webshare
+
+    If existing_connection is provided, it must be an already established
+    corporate -> webshare leg (from open_webshare_leg, e.g. taken from the
+    upstream pool) and only step 3 is performed. The connection is consumed
+    either way: it is closed if the target CONNECT fails. Otherwise, with
+    pipeline, both CONNECTs are sent without waiting for the first answer.
+    """
+    logger.debug(f"Creating chained tunnel to {target_host}:{target_port}")
 
-    logger.debug(f"Tunnel to webshare established via corporate: {status_code}")
+    # Steps 1-2: Connect to corporate proxy and establish tunnel to webshare
+    if existing_connection:
+        reader, writer = existing_connection
+    elif pipeline:
+        return await _create_pipelined_chain(
+            target_host,
+            target_port,
+            corporate,
+            webshare,
+            connector,
+        )
+    else:
+        reader, writer = await open_webshare_leg(corporate, webshare, connector)
 
     # Step 3: CONNECT to target through webshare (using existing tunnel)
     connect_to_target = _build_connect_request(
@@ -187,46 +366,66 @@ async def create_chained_tunnel(
         target_port,
         webshare,
     )
-    writer.write(connect_to_target)
-    await writer.drain()
+    started = time.monotonic()
+    try:
+        writer.write(connect_to_target)
+        await writer.drain()
+    except OSError as e:
+        writer.close()
+        raise UpstreamClosedError(f"Connection to webshare lost: {e}")
 
     logger.debug(f"Sent CONNECT to {target_host}:{target_port} via webshare")
 
-    status_code, status_message = await _read_connect_response(reader)
-
-    if not 200 <= status_code < 300:
-        writer.close()
-        await writer.wait_closed()
-        raise TunnelError(
-            f"Webshare proxy returned {status_code} {status_message}",
-            status_code=status_code,
-        )
-
-    logger.debug(f"Chained tunnel established: {status_code} {status_message}")
+    await _expect_connect_success(reader, writer, metrics.HOP_WEBSHARE, started)
+    logger.debug(f"Chained tunnel established to {target_host}:{target_port}")
     return reader, writer
 
 
 async def _relay_one_way(
     reader: StreamReader,
     writer: StreamWriter,
-    direction: str,
+    relayed: metrics.CounterChild,
+    first_byte: str,
+    deadline: RelayDeadline,
 ) -> None:
-    """Relay data from reader to writer until EOF."""
+    """
+    Relay data from reader to writer until EOF, counting bytes in relayed.
+
+    The EOF is passed on as a half-close (write_eof), so the opposite
+    direction keeps flowing; on an error the writer is closed, which
+    ends the opposite direction too. The first chunk is marked as
+    first_byte on the connection trace.
+
+    Read sizes follow the traffic (relay.next_read_size), and writes are
+    coalesced in the transport buffer: drain() is only awaited once the
+    buffer is above WRITE_BUFFER_HIGH.
+    """
+    trace = tracing.current()
+    transport = writer.transport
+    size = READ_SIZE_MIN
     try:
         while True:
-            data = await reader.read(BUFFER_SIZE)
+            data = await reader.read(size)
             if not data:
                 break
+            if transport.is_closing():
+                return  # the peer is gone, drain() would not tell
             writer.write(data)
-            await writer.drain()
+            received = len(data)
+            relayed.inc(received)
+            deadline.touch()
+            if trace is not None:
+                trace.mark_first(first_byte)
+                trace = None
+            size = next_read_size(size, received)
+            if transport.get_write_buffer_size() > WRITE_BUFFER_HIGH:
+                await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+            return
     except (ConnectionResetError, BrokenPipeError, OSError):
         pass
-    finally:
-        try:
-            writer.close()
-            await writer.wait_closed()
-        except Exception:
-            pass
+    writer.close()
 
 
 async def relay_data(
@@ -234,17 +433,74 @@ async def relay_data(
     client_writer: StreamWriter,
     remote_reader: StreamReader,
     remote_writer: StreamWriter,
+    engine: str = ENGINE_STREAM,
+    idle_timeout: float = 0,
+    max_lifetime: float = 0,
 ) -> None:
     """
     Relay data bidirectionally until connection closes.
     Uses asyncio.gather for both directions.
-    """
-    logger.debug("Starting bidirectional relay")
 
-    await asyncio.gather(
-        _relay_one_way(client_reader, remote_writer, "client->remote"),
-        _relay_one_way(remote_reader, client_writer, "remote->client"),
-        return_exceptions=True,
-    )
+    The tunnel ends when both directions reached EOF or one failed. It
+    is aborted after idle_timeout seconds without data in either
+    direction or max_lifetime seconds in total (0 disables either).
 
-    logger.debug("Relay completed")
+    With engine "recv_into" or "splice" the raw sockets are relayed by
+    relay.relay_sockets instead, falling back to the stream relay when
+    the connections cannot be taken over.
+    """
+    logger.debug(f"Starting bidirectional relay ({engine})")
+    started = time.monotonic()
+    try:
+        if engine != ENGINE_STREAM:
+            if await relay_sockets(
+                client_reader,
+                client_writer,
+                remote_reader,
+                remote_writer,
+                engine,
+                idle_timeout,
+                max_lifetime,
+            ):
+                logger.debug("Relay completed")
+                return
+            logger.debug("Socket relay unavailable for this tunnel, using stream relay")
+
+        def expire() -> None:
+            # Aborted transports feed EOF to their readers, ending both directions
+            client_writer.transport.abort()
+            remote_writer.transport.abort()
+
+        deadline = RelayDeadline(idle_timeout, max_lifetime, expire)
+        set_write_limits(client_writer.transport)
+        set_write_limits(remote_writer.transport)
+        try:
+            await asyncio.gather(
+                _relay_one_way(
+                    client_reader,
+                    remote_writer,
+                    metrics.BYTES_UPSTREAM,
+                    tracing.FIRST_BYTE_UPSTREAM,
+                    deadline,
+                ),
+                _relay_one_way(
+                    remote_reader,
+                    client_writer,
+                    metrics.BYTES_DOWNSTREAM,
+                    tracing.FIRST_BYTE_DOWNSTREAM,
+                    deadline,
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            deadline.cancel()
+            for writer in (client_writer, remote_writer):
+                try:
+                    writer.close()
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+
+        logger.debug("Relay completed")
+    finally:
+        metrics.RELAY_SECONDS.observe(time.monotonic() - started)
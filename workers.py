@@ -0,0 +1,187 @@
+"""Multi-process worker supervisor for Mooltiroute."""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import time
+from typing import Callable
+
+logger = logging.getLogger("mooltiroute.workers")
+
+STATS_INTERVAL = 10  # seconds
+SHUTDOWN_TIMEOUT = 10  # seconds
+RESTART_DELAY_MIN = 1.0  # seconds
+RESTART_DELAY_MAX = 30.0  # seconds
+STABLE_UPTIME = 10.0  # seconds a worker must live to reset its restart delay
+
+WorkerTarget = Callable[[int, "multiprocessing.Queue"], None]
+
+
+def reuse_port_supported() -> bool:
+    """True if the platform can bind several listeners to the same port."""
+    return hasattr(socket, "SO_REUSEPORT") and sys.platform != "win32"
+
+
+def aggregate_stats(per_worker: list[dict]) -> dict:
+    """Sum integer counters across workers (nested dicts are merged)."""
+    total: dict = {}
+    for stats in per_worker:
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                total[key] = aggregate_stats([total.get(key, {}), value])
+            elif isinstance(value, int) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+class _WorkerSlot:
+    """A worker position and the process currently filling it."""
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process: multiprocessing.Process | None = None
+        self.started_at = 0.0
+        self.restart_delay = RESTART_DELAY_MIN
+        self.restart_at: float | None = None
+
+
+class Supervisor:
+    """
+    Run N worker processes and keep them alive.
+
+    Each worker runs its own event loop and ProxyServer bound to the same
+    port with SO_REUSEPORT, so the kernel spreads connections across them.
+    The supervisor forwards SIGINT/SIGTERM and SIGHUP (configuration
+    reload) to the workers, restarts crashed workers with an increasing
+    delay and periodically logs the sum of the stats reported by the
+    workers.
+    """
+
+    def __init__(self, num_workers: int, target: WorkerTarget):
+        self.num_workers = num_workers
+        self.target = target
+        self._ctx = multiprocessing.get_context("fork")
+        self._stats_queue = self._ctx.Queue()
+        self._slots = [_WorkerSlot(i) for i in range(num_workers)]
+        self._latest_stats: dict[int, dict] = {}
+        self._shutting_down = False
+        self._reload_requested = False
+
+    def run(self) -> int:
+        """Start the workers and supervise them until a shutdown signal."""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._handle_signal)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._handle_reload)
+
+        for slot in self._slots:
+            self._spawn(slot)
+        logger.info(f"Supervisor started {self.num_workers} workers")
+
+        next_report = time.monotonic() + STATS_INTERVAL
+        while not self._shutting_down:
+            if self._reload_requested:
+                self._forward_reload()
+            self._collect_stats(timeout=0.5)
+            self._check_workers()
+            if time.monotonic() >= next_report:
+                self._report_stats()
+                next_report = time.monotonic() + STATS_INTERVAL
+
+        self._stop_workers()
+        self._report_stats()
+        return 0
+
+    def _handle_signal(self, signum: int, frame) -> None:
+        logger.info(f"Supervisor received {signal.Signals(signum).name}, stopping workers")
+        self._shutting_down = True
+
+    def _handle_reload(self, signum: int, frame) -> None:
+        # Forwarded from the supervision loop: a worker forked meanwhile
+        # still has this handler installed
+        self._reload_requested = True
+
+    def _forward_reload(self) -> None:
+        """Have every live worker reload the configuration file."""
+        self._reload_requested = False
+        logger.info("Supervisor received SIGHUP, reloading workers' configuration")
+        for slot in self._slots:
+            if slot.process is not None and slot.process.is_alive():
+                os.kill(slot.process.pid, signal.SIGHUP)
+
+    def _spawn(self, slot: _WorkerSlot) -> None:
+        process = self._ctx.Process(
+            target=self.target,
+            args=(slot.worker_id, self._stats_queue),
+            name=f"mooltiroute-worker-{slot.worker_id}",
+        )
+        process.start()
+        slot.process = process
+        slot.started_at = time.monotonic()
+        slot.restart_at = None
+        logger.info(f"Worker {slot.worker_id} started (pid {process.pid})")
+
+    def _check_workers(self) -> None:
+        """Restart workers that exited without being asked to."""
+        now = time.monotonic()
+        for slot in self._slots:
+            process = slot.process
+            if process is not None and not process.is_alive():
+                process.join()
+                self._latest_stats.pop(slot.worker_id, None)
+                if now - slot.started_at >= STABLE_UPTIME:
+                    slot.restart_delay = RESTART_DELAY_MIN
+                logger.warning(
+                    f"Worker {slot.worker_id} (pid {process.pid}) exited with code "
+                    f"{process.exitcode}, restarting in {slot.restart_delay:.0f}s"
+                )
+                slot.process = None
+                slot.restart_at = now + slot.restart_delay
+                slot.restart_delay = min(slot.restart_delay * 2, RESTART_DELAY_MAX)
+
+            if slot.process is None and slot.restart_at is not None and now >= slot.restart_at:
+                self._spawn(slot)
+
+    def _collect_stats(self, timeout: float) -> None:
+        try:
+            worker_id, stats = self._stats_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self._latest_stats[worker_id] = stats
+        while True:
+            try:
+                worker_id, stats = self._stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._latest_stats[worker_id] = stats
+
+    def _report_stats(self) -> None:
+        if not self._latest_stats:
+            return
+        alive = sum(1 for slot in self._slots if slot.process and slot.process.is_alive())
+        total = aggregate_stats(list(self._latest_stats.values()))
+        logger.info(f"Workers alive: {alive}/{self.num_workers}, totals: {total}")
+
+    def _stop_workers(self) -> None:
+        """Propagate SIGTERM, then kill workers that do not exit in time."""
+        processes = [slot.process for slot in self._slots if slot.process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker pid {process.pid} did not stop, killing it")
+                process.kill()
+                process.join()
+
+        self._collect_stats(timeout=0)
+        logger.info("All workers stopped")